@@ -1,13 +1,14 @@
-import numpy as np
-import sounddevice as sd
 import tkinter as tk
 from tkinter import ttk
 import threading
-from scipy.signal import butter, lfilter
+from hearing_aid.backends import SoundDeviceBackend
+from hearing_aid.engine import LATENCY_PROFILES, LiveSession
+from hearing_aid.params import ParameterStore
 
 class SimpleHearingAid:
-    def __init__(self, root):
+    def __init__(self, root, backend=None):
         self.root = root
+        self.backend = backend or SoundDeviceBackend()
         self.root.title("Simple Hearing Aid")
         self.root.geometry("500x300")
         
@@ -27,6 +28,17 @@ class SimpleHearingAid:
         self.clarity_var = tk.DoubleVar(value=0.7)
         ttk.Scale(self.frame, from_=0.0, to=1.0, variable=self.clarity_var).pack(fill="x")
         
+        # Audio callback reads parameters from the store, never from Tk
+        self.params = ParameterStore()
+        self.params.trace('gain', self.gain_var)
+        self.params.trace('clarity', self.clarity_var)
+        
+        # Latency profile, read when processing starts
+        ttk.Label(self.frame, text="Latency:").pack(anchor="w")
+        self.latency_var = tk.StringVar(value="standard")
+        ttk.Combobox(self.frame, textvariable=self.latency_var, state="readonly",
+                     values=list(LATENCY_PROFILES)).pack(anchor="w")
+        
         # Start/Stop button
         self.is_processing = False
         self.button = ttk.Button(self.frame, text="Start Hearing Aid", command=self.toggle_processing)
@@ -45,54 +57,15 @@ class SimpleHearingAid:
             self.is_processing = True
             self.button.config(text="Stop Hearing Aid")
             self.status_var.set("Processing audio...")
-            threading.Thread(target=self.process_audio, daemon=True).start()
+            threading.Thread(target=self.process_audio, args=(self.latency_var.get(),),
+                             daemon=True).start()
     
-    def design_bandpass_filter(self, lowcut=300, highcut=5000, fs=44100):
-        nyquist = 0.5 * fs
-        low = lowcut / nyquist
-        high = highcut / nyquist
-        b, a = butter(4, [low, high], btype='band')
-        return b, a
-    
-    def process_audio(self):
-        fs = 44100
-        blocksize = 1024
-        b, a = self.design_bandpass_filter()
-        
-        def audio_callback(indata, outdata, frames, time, status):
-            if status:
-                print(f"Status: {status}")
-            
-            audio_in = indata[:, 0] if indata.ndim > 1 else indata[:]
-            gain = self.gain_var.get()
-            clarity = self.clarity_var.get()
-            
-            # Apply bandpass filter
-            filtered = lfilter(b, a, audio_in)
-            
-            # Apply speech clarity enhancement
-            if clarity > 0:
-                speech_b, speech_a = butter(2, [1000/22050, 3000/22050], btype='band')
-                enhanced = lfilter(speech_b, speech_a, filtered)
-                # Blend original and enhanced based on clarity setting
-                filtered = (1-clarity) * filtered + clarity * enhanced * 1.5
-            
-            # Apply gain and prevent clipping
-            processed = np.clip(filtered * gain, -0.99, 0.99)
-            
-            # Output to all channels
-            if outdata.ndim > 1:
-                for i in range(outdata.shape[1]):
-                    outdata[:, i] = processed
-            else:
-                outdata[:] = processed
+    def process_audio(self, profile):
+        # The engine session owns the chain and the audio callback
+        session = LiveSession(self.backend, self.params, profile=profile)
         
         try:
-            with sd.Stream(channels=1, callback=audio_callback, 
-                          samplerate=fs, blocksize=blocksize,
-                          latency='low'):
-                while self.is_processing and self.root.winfo_exists():
-                    sd.sleep(100)
+            session.run(lambda: self.is_processing and self.root.winfo_exists())
         except Exception as e:
             print(f"Error: {e}")
             self.is_processing = False
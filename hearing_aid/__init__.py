@@ -0,0 +1,56 @@
+import importlib
+
+# Names are imported from their modules on first use, so `import
+# hearing_aid.params` (as the app does at startup) doesn't pay for every
+# other module and their dependencies
+_EXPORTS = {
+    'MultibandCompressor': 'compressor',
+    'LiveSession': 'engine',
+    'OfflineRender': 'engine',
+    'PlaybackSession': 'engine',
+    'Session': 'engine',
+    'FeedbackCanceller': 'feedback',
+    'BandpassNode': 'filters',
+    'ClarityNode': 'filters',
+    'FilterChain': 'filters',
+    'GainNode': 'filters',
+    'LimiterNode': 'filters',
+    'design_bandpass_filter': 'filters',
+    'Fitting': 'fitting',
+    'FittingNode': 'fitting',
+    'PartitionedConvolver': 'fitting',
+    'load_fitting': 'fitting',
+    'Graph': 'graph',
+    'Node': 'graph',
+    'write_output': 'graph',
+    'CallbackMetrics': 'metrics',
+    'export_metrics': 'metrics',
+    'NoiseReducer': 'noise',
+    'ParameterStore': 'params',
+    'ParameterSmoother': 'params',
+    'ProcessingParams': 'params',
+    'ResampledReader': 'resample',
+    'Resampler': 'resample',
+    'RelayServer': 'server',
+    'RelaySession': 'server',
+    'RingBuffer': 'ringbuffer',
+    'VoiceActivityDetector': 'vad',
+    'VoiceActivityGate': 'vad',
+    'WavReader': 'wavio',
+    'WavWriter': 'wavio',
+    'write_wav': 'wavio',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f'.{_EXPORTS[name]}', __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,308 @@
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+# Same fields as the time struct sounddevice passes to callbacks
+StreamTime = namedtuple('StreamTime', ['currentTime', 'inputBufferAdcTime', 'outputBufferDacTime'])
+
+
+class SoundDeviceBackend:
+    # Real audio devices through sounddevice/PortAudio.
+    # Callbacks use the sounddevice signatures for each stream kind.
+
+    def __init__(self, device=None):
+        self.device = device
+        self._module = None
+
+    @property
+    def _sd(self):
+        # Imported on first use: loading PortAudio is slow on small
+        # machines, and the app's window shouldn't wait for it
+        if self._module is None:
+            import sounddevice
+            self._module = sounddevice
+        return self._module
+
+    def open_stream(self, callback, samplerate, blocksize=0, channels=1, latency=None):
+        return self._sd.Stream(samplerate=samplerate, blocksize=blocksize, channels=channels,
+                               callback=callback, latency=latency, device=self.device)
+
+    def open_input_stream(self, callback, samplerate, blocksize=0, channels=1, latency=None):
+        return self._sd.InputStream(samplerate=samplerate, blocksize=blocksize, channels=channels,
+                                    callback=callback, latency=latency, device=self.device)
+
+    def open_output_stream(self, callback, samplerate, blocksize=0, channels=1, latency=None):
+        return self._sd.OutputStream(samplerate=samplerate, blocksize=blocksize, channels=channels,
+                                     callback=callback, latency=latency, device=self.device)
+
+    def sleep(self, msec):
+        self._sd.sleep(msec)
+
+
+class SimulatedFlags:
+    # Stand-in for sounddevice.CallbackFlags
+    def __init__(self, **flags):
+        self.input_underflow = flags.get('input_underflow', False)
+        self.input_overflow = flags.get('input_overflow', False)
+        self.output_underflow = flags.get('output_underflow', False)
+        self.output_overflow = flags.get('output_overflow', False)
+
+    def __bool__(self):
+        return (self.input_underflow or self.input_overflow
+                or self.output_underflow or self.output_overflow)
+
+    def __repr__(self):
+        names = [name for name, value in vars(self).items() if value]
+        return f"SimulatedFlags({', '.join(names)})"
+
+
+# === Simulated sources and sinks ===
+
+class ArraySource:
+    # Feeds frames from an array; zeros (or a loop) once it runs out
+    def __init__(self, audio, loop=False):
+        audio = np.asarray(audio, dtype=np.float32)
+        self.audio = audio.reshape(len(audio), -1)
+        self.loop = loop
+        self.pos = 0
+
+    def read(self, frames, channels):
+        out = np.zeros((frames, channels), dtype=np.float32)
+        filled = 0
+        while filled < frames and len(self.audio):
+            if self.pos >= len(self.audio):
+                if not self.loop:
+                    break
+                self.pos = 0
+            take = min(frames - filled, len(self.audio) - self.pos)
+            out[filled:filled+take] = self.audio[self.pos:self.pos+take, :channels]
+            filled += take
+            self.pos += take
+        return out
+
+
+class WavSource:
+    # Feeds a WAV file block by block through WavReader
+    def __init__(self, filename, loop=False):
+        from .wavio import WavReader
+        self.reader = WavReader(filename)
+        self.fs = self.reader.fs
+        self.loop = loop
+        self.pos = 0
+
+    def read(self, frames, channels):
+        out = np.zeros((frames, channels), dtype=np.float32)
+        filled = 0
+        while filled < frames and len(self.reader):
+            if self.pos >= len(self.reader):
+                if not self.loop:
+                    break
+                self.pos = 0
+            block = self.reader.read(self.pos, frames - filled)
+            out[filled:filled+len(block)] = block[:, None]
+            filled += len(block)
+            self.pos += len(block)
+        return out
+
+
+class SignalSource:
+    # Generated test signal: a sine tone plus optional white noise
+    def __init__(self, fs, frequency=1000.0, amplitude=0.1, noise=0.0, seed=0):
+        self.fs = fs
+        self.frequency = frequency
+        self.amplitude = amplitude
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+        self.pos = 0
+
+    def read(self, frames, channels):
+        t = (self.pos + np.arange(frames)) / self.fs
+        self.pos += frames
+        signal = self.amplitude * np.sin(2 * np.pi * self.frequency * t)
+        if self.noise:
+            signal = signal + self.noise * self.rng.standard_normal(frames)
+        return np.repeat(signal[:, None], channels, axis=1).astype(np.float32)
+
+
+class ArraySink:
+    # Keeps the most recent max_frames of output (all of it if None)
+    def __init__(self, max_frames=None):
+        self.max_frames = max_frames
+        self.blocks = []
+        self.frames = 0
+
+    def write(self, outdata):
+        self.blocks.append(outdata.copy())
+        self.frames += len(outdata)
+        while self.max_frames is not None and self.frames - len(self.blocks[0]) >= self.max_frames:
+            self.frames -= len(self.blocks.pop(0))
+
+    def data(self):
+        if not self.blocks:
+            return np.zeros((0, 1), dtype=np.float32)
+        return np.concatenate(self.blocks)
+
+
+class WavSink:
+    # Streams output to a WAV file
+    def __init__(self, filename, fs, channels=1):
+        from .wavio import WavWriter
+        self.writer = WavWriter(filename, fs, channels)
+
+    def write(self, outdata):
+        self.writer.write(outdata)
+
+    def close(self):
+        self.writer.close()
+
+
+class FeedbackPath:
+    # Closed acoustic loop for a duplex SimulatedBackend: pass the same
+    # object as source and sink. The microphone hears `source` plus
+    # everything written to the speaker, filtered by `response` (an FIR)
+    # after `delay` samples. delay must cover at least one block, as the
+    # device buffers would.
+    def __init__(self, source, response, delay):
+        from scipy.signal import lfilter
+        from .ringbuffer import RingBuffer
+        self._lfilter = lfilter
+        self.source = source
+        self.response = np.asarray(response, dtype=float)
+        self.delay = delay
+        self._zi = np.zeros(len(self.response) - 1)
+        self._leak = RingBuffer(delay + (1 << 16), dtype=float)
+        self._leak.write(np.zeros(delay))
+        # Feedback part of the last block read, for measuring cancellation
+        self.leak = np.zeros((0, 1))
+
+    def read(self, frames, channels):
+        if self._leak.available() < frames:
+            raise ValueError("Feedback delay is shorter than the block size")
+        self.leak = self._leak.read(frames)
+        out = self.source.read(frames, channels)
+        out += self.leak.astype(np.float32)
+        return out
+
+    def write(self, outdata):
+        leak, self._zi = self._lfilter(self.response, 1.0, outdata[:, 0], zi=self._zi)
+        self._leak.write(leak)
+
+
+class SimulatedStream:
+    # Calls the stream callback from a worker thread on a simulated clock.
+    # With speed=1.0 blocks are paced at the device rate against
+    # perf_counter deadlines; speed=4.0 runs four times faster; speed=None
+    # runs as fast as the callback allows. A callback that misses its
+    # deadline is reported as an underflow on the next block, as PortAudio
+    # would.
+
+    def __init__(self, kind, callback, samplerate, blocksize, channels,
+                 source=None, sink=None, speed=1.0):
+        self.kind = kind
+        self.callback = callback
+        self.samplerate = samplerate
+        self.blocksize = blocksize or 256
+        self.channels = channels
+        self.source = source
+        self.sink = sink
+        self.speed = speed
+        # Report one block each way, like a minimal device buffer
+        block_time = self.blocksize / samplerate
+        self.latency = (block_time, block_time) if kind == 'duplex' else block_time
+        self.frames_processed = 0
+        self.active = False
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def _run(self):
+        block_time = self.blocksize / self.samplerate
+        clock = 0.0
+        started = time.perf_counter()
+        late = False
+        outdata = np.zeros((self.blocksize, self.channels), dtype=np.float32)
+        while not self._stopping.is_set():
+            if self.speed:
+                # Wait for this block's deadline on the simulated clock
+                delay = started + clock / self.speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+            if self.kind == 'output':
+                indata = None
+            elif self.source is not None:
+                indata = self.source.read(self.blocksize, self.channels)
+            else:
+                indata = np.zeros((self.blocksize, self.channels), dtype=np.float32)
+            status = SimulatedFlags(output_underflow=late and self.kind != 'input',
+                                    input_overflow=late and self.kind != 'output')
+            stream_time = StreamTime(clock, clock, clock + block_time)
+
+            if self.kind == 'duplex':
+                self.callback(indata, outdata, self.blocksize, stream_time, status)
+            elif self.kind == 'input':
+                self.callback(indata, self.blocksize, stream_time, status)
+            else:
+                self.callback(outdata, self.blocksize, stream_time, status)
+
+            if self.sink is not None and self.kind != 'input':
+                self.sink.write(outdata)
+            self.frames_processed += self.blocksize
+            clock += block_time
+            late = bool(self.speed) and time.perf_counter() > started + clock / self.speed
+
+    def start(self):
+        if self.active:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self.active = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.active = False
+
+    def close(self):
+        self.stop()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class SimulatedBackend:
+    # Hardware-free backend for tests and soak runs on machines without a
+    # sound card. Input comes from `source` (ArraySource, WavSource,
+    # SignalSource or anything with read(frames, channels)), output goes
+    # to `sink` (anything with write(outdata)).
+
+    def __init__(self, source=None, sink=None, speed=1.0):
+        self.source = source
+        self.sink = sink
+        self.speed = speed
+
+    def _open(self, kind, callback, samplerate, blocksize, channels, latency):
+        # Latency hints don't apply; the simulated device buffers one block
+        return SimulatedStream(kind, callback, samplerate, blocksize, channels,
+                               source=self.source, sink=self.sink, speed=self.speed)
+
+    def open_stream(self, callback, samplerate, blocksize=0, channels=1, latency=None):
+        return self._open('duplex', callback, samplerate, blocksize, channels, latency)
+
+    def open_input_stream(self, callback, samplerate, blocksize=0, channels=1, latency=None):
+        return self._open('input', callback, samplerate, blocksize, channels, latency)
+
+    def open_output_stream(self, callback, samplerate, blocksize=0, channels=1, latency=None):
+        return self._open('output', callback, samplerate, blocksize, channels, latency)
+
+    def sleep(self, msec):
+        # Wall-clock sleep, scaled so polling loops keep pace with the stream
+        time.sleep(msec / 1000 / (self.speed or 1000))
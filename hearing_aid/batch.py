@@ -0,0 +1,120 @@
+"""Process a directory of WAV files through the hearing aid chain.
+
+    python -m hearing_aid.batch in_dir out_dir --gain 2 --clarity 0.7
+
+Files are fanned out across a process pool and written to out_dir with the
+same relative paths, plus a summary.csv with per-file timings.
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .engine import OfflineRender
+from .filters import FilterChain
+from .fitting import load_fitting
+from .noise import NOISE_REDUCTION_PRESETS
+from .params import ParameterStore
+from .wavio import WavReader
+
+
+def find_wav_files(in_dir):
+    for dirpath, dirnames, filenames in os.walk(in_dir):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith('.wav'):
+                yield os.path.relpath(os.path.join(dirpath, name), in_dir)
+
+
+def process_file(in_path, out_path, gain, clarity, compression=True, fitting=None,
+                 noise_reduction=False, internal_rate=None, mono=False):
+    # Channels are processed separately unless mixed down to mono
+    reader = WavReader(in_path, mono=mono)
+    # Offline there is no callback budget, so use long FIR partitions
+    chain = FilterChain(fs=reader.fs, compression=compression, fitting=fitting,
+                        partition_size=4096, noise_reduction=noise_reduction,
+                        internal_rate=internal_rate, channels=reader.channels,
+                        blocksize=OfflineRender.BLOCKSIZE)
+    os.makedirs(os.path.dirname(out_path) or '.', exist_ok=True)
+    render = OfflineRender(reader, ParameterStore(gain, clarity), out_path, chain=chain)
+    try:
+        render.run()
+    finally:
+        reader.close()
+    return render.summary()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m hearing_aid.batch',
+                                     description="Process WAV files offline through the hearing aid chain.")
+    parser.add_argument('in_dir', help="directory searched recursively for .wav files")
+    parser.add_argument('out_dir', help="directory for processed files")
+    parser.add_argument('--gain', type=float, default=2.0)
+    parser.add_argument('--clarity', type=float, default=0.7)
+    parser.add_argument('--no-compression', dest='compression', action='store_false',
+                        help="skip the multi-band compressor")
+    parser.add_argument('--fitting', default=None,
+                        help="audiogram fitting JSON to use instead of the fixed bandpass")
+    parser.add_argument('--noise-reduction', default=False, choices=list(NOISE_REDUCTION_PRESETS),
+                        help="enable STFT noise reduction with this preset")
+    parser.add_argument('--internal-rate', type=int, default=None,
+                        help="run the DSP at this sample rate (default: each file's own)")
+    parser.add_argument('--mono', action='store_true',
+                        help="mix multichannel files down to mono instead of processing each channel")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="number of worker processes (default: one per CPU)")
+    parser.add_argument('--summary', default=None,
+                        help="timing summary CSV (default: OUT_DIR/summary.csv)")
+    args = parser.parse_args(argv)
+
+    fitting = load_fitting(args.fitting) if args.fitting else None
+
+    names = list(find_wav_files(args.in_dir))
+    if not names:
+        print(f"No WAV files found in {args.in_dir}")
+        return 1
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    summary_path = args.summary or os.path.join(args.out_dir, 'summary.csv')
+
+    rows = []
+    failures = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {
+            pool.submit(process_file, os.path.join(args.in_dir, name),
+                        os.path.join(args.out_dir, name), args.gain, args.clarity,
+                        args.compression, fitting, args.noise_reduction,
+                        args.internal_rate, args.mono): name
+            for name in names
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Error processing {name}: {e}")
+                failures += 1
+                continue
+            print(f"{name}: {result['duration_s']:.1f}s of audio in "
+                  f"{result['processing_s']:.2f}s ({result['speedup']:.0f}x real time)")
+            rows.append(dict(file=name, **result))
+
+    rows.sort(key=lambda row: row['file'])
+    with open(summary_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['file', 'samplerate', 'duration_s',
+                                               'processing_s', 'speedup'])
+        writer.writeheader()
+        writer.writerows(rows)
+
+    total_audio = sum(row['duration_s'] for row in rows)
+    wall = time.perf_counter() - start
+    print(f"Processed {len(rows)} file(s), {total_audio:.1f}s of audio in {wall:.2f}s; "
+          f"{failures} failed. Summary written to {summary_path}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,573 @@
+"""Throughput benchmark for the processing chain.
+
+    python -m hearing_aid.bench --save-baseline baseline.json
+    python -m hearing_aid.bench --baseline baseline.json
+    python -m hearing_aid.bench --check-allocations
+    python -m hearing_aid.bench --check-kernels
+    python -m hearing_aid.bench --check-vad
+    python -m hearing_aid.bench --check-noise-reduction
+    python -m hearing_aid.bench --check-resample-seek
+
+Drives FilterChain with synthetic speech-shaped noise across block sizes,
+sample rates and gain/clarity settings and reports throughput, per-block
+p50/p99 time and real-time factor (processing time / audio time). With
+--baseline it exits non-zero if any case is slower than the stored run by
+more than --tolerance. Baselines are machine specific; record one per
+machine before comparing.
+
+--check-allocations drives the live session callback instead and exits
+non-zero if a warmed-up callback allocates a block-sized buffer: if its
+peak passes a fixed limit, or if any source line it runs allocates more at
+twice the block size, which catches arrays too small for the limit.
+Each case runs again with the DSP at a 16 kHz internal rate (or at
+--internal-rate only, if given).
+
+--check-kernels runs the chain once per kernel backend (Numba loops and
+their NumPy reference implementations), reports the time each takes and
+exits non-zero if their outputs differ by more than rounding. --kernels
+picks the backend for the throughput cases.
+
+--check-vad plays talk spurts over room hiss, after half a second of
+digital silence, through the chain with and without the voice activity
+gate and reports how many blocks the gate skipped, the time saved and how
+closely the speech matches. Each chain's time is the median of five runs.
+It exits non-zero if the gate skips too little or makes the chain more than
+10% slower. --vad runs the other modes with the gate on.
+
+--check-noise-reduction runs room hiss through the noise reducer with and
+without leading digital silence and exits non-zero if the silence leaves
+the hiss less reduced.
+
+--check-resample-seek seeks a resampled file reader to its last frame and
+to its end, as the player's seek bar can, and exits non-zero if a read
+there fails or comes back the wrong length or shape.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from scipy.signal import butter, sosfilt
+
+from . import kernels
+from .engine import LiveSession
+from .filters import FilterChain
+from .fitting import load_fitting
+from .noise import NOISE_REDUCTION_PRESETS, NoiseReducer
+from .params import ParameterStore
+from .resample import ResampledReader
+
+BLOCK_SIZES = (64, 128, 256, 512, 1024, 2048, 4096)
+SAMPLE_RATES = (16000, 44100, 48000)
+SETTINGS = ((2.0, 0.0), (2.0, 0.7), (5.0, 1.0))
+# Peak traced bytes a warmed-up callback may use: room for the interpreter's
+# own short-lived objects (floats, bound methods, views), but not for an
+# array of 512 samples or more
+ALLOCATION_LIMIT = 4096
+# Bytes per sample and channel of the smaller block that a source line's
+# traced peak may grow by when the block size doubles: any float32 or
+# float64 block-sized array grows by at least this, while the interpreter's
+# own objects don't grow at all
+ALLOCATION_GROWTH = 4
+# DSP rate --check-allocations also runs the chain at, between the
+# resamplers, unless --internal-rate picks one
+ALLOCATION_INTERNAL_RATE = 16000
+# Largest difference allowed between kernel backends' outputs
+KERNEL_TOLERANCE = 1e-9
+# Least share of blocks the voice activity gate must skip in check_vad,
+# whose talk spurts leave it about 60% to skip
+VAD_MIN_SKIP = 0.4
+# How much slower than the ungated chain the gated one may be in check_vad,
+# so timing noise doesn't fail it
+VAD_SLOWDOWN_TOLERANCE = 0.1
+# Most that leading silence may cost the noise reducer, in dB of reduction
+NOISE_LEAD_TOLERANCE_DB = 0.5
+
+
+def speech_shaped_noise(fs, duration, seed=0):
+    # White noise shaped to roughly the long-term speech spectrum (flat to
+    # 500 Hz, then falling) with a 4 Hz syllabic envelope, at -20 dBFS RMS
+    rng = np.random.default_rng(seed)
+    noise = rng.standard_normal(int(fs * duration))
+    noise = sosfilt(butter(1, 500, btype='lowpass', fs=fs, output='sos'), noise)
+    noise = sosfilt(butter(2, 100, btype='highpass', fs=fs, output='sos'), noise)
+    t = np.arange(len(noise)) / fs
+    noise *= 0.6 + 0.4 * np.sin(2 * np.pi * 4 * t)
+    return (noise * 0.1 / np.sqrt(np.mean(noise ** 2))).astype(np.float32)
+
+
+def talk_spurts(fs, duration, talk=1.5, pause=2.5, hiss_db=-55.0, seed=0):
+    # Speech-shaped noise for `talk` seconds out of every talk + pause,
+    # over white room hiss at hiss_db dBFS. Returns the signal and a mask
+    # of where the talking is.
+    rng = np.random.default_rng(seed)
+    speech = speech_shaped_noise(fs, duration, seed)
+    t = np.arange(len(speech)) / fs
+    talking = (t % (talk + pause)) >= pause
+    hiss = rng.standard_normal(len(speech)) * 10 ** (hiss_db / 20)
+    return (speech * talking + hiss).astype(np.float32), talking
+
+
+def run_case(signal, fs, blocksize, gain, clarity, fitting=None, noise_reduction=False,
+             internal_rate=None, channels=1, vad=False):
+    chain = FilterChain(fs=fs, fitting=fitting, noise_reduction=noise_reduction,
+                        internal_rate=internal_rate, channels=channels, vad=vad)
+    # The same signal in every channel, as (channels, frames) blocks
+    signal = np.tile(signal, (channels, 1))
+    length = signal.shape[1]
+    # Warm up so one-off costs (FFT plans, caches) aren't counted
+    for pos in range(0, min(length, 8 * blocksize), blocksize):
+        chain.process(signal[:, pos:pos+blocksize], gain, clarity)
+    chain.reset()
+
+    times = []
+    for pos in range(0, length - blocksize + 1, blocksize):
+        block = signal[:, pos:pos+blocksize]
+        started = time.perf_counter()
+        chain.process(block, gain, clarity)
+        times.append(time.perf_counter() - started)
+
+    times = np.array(times)
+    total = times.sum()
+    samples = len(times) * blocksize
+    return {
+        'samplerate': fs,
+        'blocksize': blocksize,
+        'channels': channels,
+        'gain': gain,
+        'clarity': clarity,
+        'samples_per_s': samples / total,
+        'p50_ms': float(np.percentile(times, 50)) * 1e3,
+        'p99_ms': float(np.percentile(times, 99)) * 1e3,
+        'realtime_factor': total / (samples / fs),
+    }
+
+
+def line_tracer(peaks):
+    # sys.settrace hook that keeps, per (file, line), the smallest traced
+    # peak over the times that line ran. Each line is measured on its own,
+    # so a small array can't hide under the interpreter objects other lines
+    # have in flight the way it can in a whole callback's peak. An array
+    # a line makes is there every time it runs, while the interpreter's
+    # occasional free-list refills aren't, so the smallest is the steadiest.
+    state = {'line': None, 'base': 0}
+
+    def trace(frame, event, arg):
+        peak = tracemalloc.get_traced_memory()[1] - state['base']
+        line = state['line']
+        if line is not None and peak < peaks.get(line, peak + 1):
+            peaks[line] = peak
+        if event == 'line':
+            state['line'] = (frame.f_code.co_filename, frame.f_lineno)
+        elif event == 'return' and frame.f_back is not None:
+            # Back to finishing the caller's line
+            state['line'] = (frame.f_back.f_code.co_filename, frame.f_back.f_lineno)
+        else:
+            state['line'] = None
+        tracemalloc.reset_peak()
+        state['base'] = tracemalloc.get_traced_memory()[0]
+        return trace
+
+    return trace
+
+
+def check_allocations(fs=44100, blocksize=1024, fitting=None, noise_reduction=False,
+                      callbacks=200, channels=1, vad=False, internal_rate=None):
+    # Largest traced peak within one live callback, after warm-up, over
+    # what was in use when it started (so the interpreter refilling its
+    # free lists under tracing isn't counted against the callback), and
+    # the peak of every source line the callback runs (see line_tracer).
+    # Parameters move halfway through each phase so the smoother's ramps
+    # are exercised too. Compare the peak against ALLOCATION_LIMIT, and the
+    # lines against another run at twice the block size (line_growth).
+    signal = speech_shaped_noise(fs, 3 * callbacks * blocksize / fs)
+    params = ParameterStore(gain=2.0, clarity=0.7)
+    session = LiveSession(None, params, fs=fs, blocksize=blocksize, fitting=fitting,
+                          noise_reduction=noise_reduction, internal_rate=internal_rate,
+                          channels=channels, vad=vad)
+    outdata = np.zeros((blocksize, channels), dtype=np.float32)
+    blocks = signal[:3 * callbacks * blocksize].reshape(3 * callbacks, blocksize, 1)
+    blocks = np.repeat(blocks, channels, axis=2)
+    lines = {}
+
+    def run(blocks, changes, measure=False, trace=False):
+        peak = 0
+        for i, indata in enumerate(blocks):
+            if i == len(blocks) // 2:
+                params.update(**changes)
+            if measure:
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+            if trace:
+                sys.settrace(line_tracer(lines))
+            session.callback(indata, outdata, blocksize, None, None)
+            if trace:
+                sys.settrace(None)
+            if measure:
+                peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+        return peak
+
+    run(blocks[:callbacks], {'gain': 3.0, 'clarity': 0.0})
+    tracemalloc.start()
+    try:
+        peak = run(blocks[callbacks:2 * callbacks], {'gain': 2.0, 'clarity': 0.7}, measure=True)
+        run(blocks[2 * callbacks:], {'gain': 3.0, 'clarity': 0.0}, trace=True)
+    finally:
+        tracemalloc.stop()
+    return peak, lines
+
+
+def line_growth(lines, doubled, again=None):
+    # Largest growth in a line's peak from one check_allocations run to one
+    # at twice the block size, and where, over the lines both ran. A line's
+    # peak is net of what it frees, so an interpreter object that happens
+    # to be released inside a C call can shift it by a few hundred bytes
+    # from one session to the next; with `again`, a second (lines, doubled)
+    # pair from fresh sessions, each line counts its smaller growth, which
+    # a block-sized array keeps and that shift doesn't.
+    growth, where = 0, None
+    for line, peak in doubled.items():
+        grown = peak - lines.get(line, peak)
+        if again is not None:
+            lines_again, doubled_again = again
+            if line in lines_again and line in doubled_again:
+                grown = min(grown, doubled_again[line] - lines_again[line])
+            else:
+                grown = 0
+        if grown > growth:
+            growth, where = grown, line
+    return growth, where
+
+
+def check_kernels(fs=44100, blocksize=1024, duration=2.0, fitting=None, noise_reduction=False,
+                  channels=1):
+    # Same signal through the chain under each kernel backend, hot enough
+    # that the compressor and limiter both work. Returns the largest output
+    # difference and each backend's mean time per block.
+    signal = np.tile(speech_shaped_noise(fs, duration), (channels, 1))
+    outputs, times = {}, {}
+    previous = kernels.backend()
+    try:
+        for name in kernels.BACKENDS:
+            kernels.set_backend(name)
+            chain = FilterChain(fs=fs, fitting=fitting, noise_reduction=noise_reduction,
+                                channels=channels)
+            out = np.zeros_like(signal, dtype=float)
+            elapsed = []
+            for pos in range(0, signal.shape[1], blocksize):
+                started = time.perf_counter()
+                block = chain.process(signal[:, pos:pos+blocksize], 40.0, 0.7)
+                elapsed.append(time.perf_counter() - started)
+                out[:, pos:pos+blocksize] = block
+            outputs[name] = out
+            # The first block pays for compiling or loading cached kernels
+            times[name] = float(np.mean(elapsed[1:] or elapsed))
+    finally:
+        kernels.set_backend(previous)
+    difference = float(np.max(np.abs(outputs['numpy'] - outputs['compiled'])))
+    return difference, times
+
+
+def check_vad(fs=44100, blocksize=1024, duration=20.0, fitting=None, noise_reduction=False,
+              channels=1, lead=0.5, repeats=5):
+    # Talk spurts through the chain without and with the gate, after `lead`
+    # seconds of exact zeros (which mustn't throw the detector's noise
+    # floor). The two take turns `repeats` times over. Returns the share of
+    # blocks skipped, each chain's median over the repeats of its mean time
+    # per block, and the largest difference during talking (past each
+    # spurt's first hang time, when the gate is fully open) relative to the
+    # ungated peak.
+    signal, talking = talk_spurts(fs, duration)
+    signal = np.concatenate([np.zeros(int(lead * fs), dtype=np.float32), signal])
+    talking = np.concatenate([np.zeros(int(lead * fs), dtype=bool), talking])
+    signal = np.tile(signal, (channels, 1))
+    chains = {}
+    for vad in (False, True):
+        chain = chains[vad] = FilterChain(fs=fs, fitting=fitting,
+                                          noise_reduction=noise_reduction,
+                                          channels=channels, vad=vad)
+        # Warm up on the same kind of signal
+        for pos in range(0, 8 * blocksize, blocksize):
+            chain.process(signal[:, pos:pos+blocksize], 2.0, 0.7)
+    outputs = {vad: np.zeros_like(signal, dtype=float) for vad in chains}
+    runs = {vad: [] for vad in chains}
+    for _ in range(repeats):
+        for vad, chain in chains.items():
+            chain.reset()
+            if vad:
+                chain.gate.blocks = chain.gate.skipped = 0
+            out = outputs[vad]
+            elapsed = 0.0
+            for pos in range(0, signal.shape[1], blocksize):
+                started = time.perf_counter()
+                block = chain.process(signal[:, pos:pos+blocksize], 2.0, 0.7)
+                elapsed += time.perf_counter() - started
+                out[:, pos:pos+blocksize] = block
+            runs[vad].append(elapsed / -(-signal.shape[1] // blocksize))
+    times = {vad: float(np.median(runs[vad])) for vad in runs}
+    skipped = chains[True].gate.skip_fraction
+    # Talking that started at least 0.3 s ago
+    settled = np.convolve(~talking, np.ones(int(0.3 * fs)))[:len(talking)] == 0
+    difference = np.max(np.abs(outputs[True] - outputs[False])[:, settled], initial=0.0)
+    return skipped, times, float(difference / np.max(np.abs(outputs[False])))
+
+
+def check_noise_reduction(fs=44100, blocksize=1024, preset='balanced', duration=4.0,
+                          channels=1, lead=1024):
+    # White hiss through a NoiseReducer, once as is and once after `lead`
+    # samples of exact zeros. Returns each run's reduction in dB over the
+    # last second, when the noise floor has long settled.
+    rng = np.random.default_rng(0)
+    hiss = rng.standard_normal((channels, int(fs * duration))) * 0.01
+    reductions = []
+    for zeros in (0, lead):
+        signal = np.concatenate([np.zeros((channels, zeros)), hiss], axis=1)
+        reducer = NoiseReducer.preset(preset)
+        reducer.prepare(fs, blocksize, channels)
+        out = np.zeros_like(signal)
+        for pos in range(0, signal.shape[1], blocksize):
+            block = signal[:, pos:pos+blocksize]
+            out[:, pos:pos+block.shape[1]] = reducer.process(block)
+        tail = slice(signal.shape[1] - fs, signal.shape[1])
+        ratio = np.mean(out[:, tail] ** 2) / np.mean(signal[:, tail] ** 2)
+        reductions.append(float(-10 * np.log10(ratio)))
+    return reductions
+
+
+class ArrayAudio:
+    # In-memory source for ResampledReader, with WavReader's block shapes:
+    # (frames,) for one channel, (frames, channels) for more
+    def __init__(self, samples, fs):
+        self.samples = samples
+        self.fs = fs
+        self.channels = 1 if samples.ndim == 1 else samples.shape[1]
+
+    def __len__(self):
+        return len(self.samples)
+
+    def read(self, pos, frames):
+        return self.samples[pos:pos+frames]
+
+
+def check_resample_seek(fs=44100, blocksize=1024, channels=1, device_rate=48000,
+                        duration=1.0):
+    # Speech-shaped noise at fs, read at device_rate by a fresh
+    # ResampledReader seeking straight to its last frame, its end or its
+    # middle. Returns a description of each read that raised or came back
+    # the wrong length or shape.
+    samples = speech_shaped_noise(fs, duration)
+    if channels > 1:
+        samples = np.tile(samples[:, None], (1, channels))
+    audio = ArrayAudio(samples, fs)
+    length = len(ResampledReader(audio, device_rate))
+    problems = []
+    for pos in (length - 1, length, length // 2):
+        reader = ResampledReader(audio, device_rate)
+        expected = (min(blocksize, len(reader) - pos),) + samples.shape[1:]
+        try:
+            shape = reader.read(pos, blocksize).shape
+        except Exception as error:
+            problems.append(f"read at {pos} raised {error!r}")
+            continue
+        if shape != expected:
+            problems.append(f"read at {pos} gave {shape}, not {expected}")
+    return problems
+
+
+def case_key(result):
+    key = f"{result['samplerate']}/{result['blocksize']}/{result['gain']}/{result['clarity']}"
+    # Baselines from before multichannel runs are mono
+    if result.get('channels', 1) != 1:
+        key += f"/{result['channels']}ch"
+    return key
+
+
+def compare(results, baseline, tolerance):
+    # A case regresses when throughput drops or p99 grows past the tolerance
+    reference = {case_key(r): r for r in baseline}
+    regressions = []
+    for result in results:
+        old = reference.get(case_key(result))
+        if old is None:
+            continue
+        if result['samples_per_s'] < old['samples_per_s'] * (1 - tolerance):
+            regressions.append(f"{case_key(result)}: throughput {result['samples_per_s']:.0f} "
+                               f"< baseline {old['samples_per_s']:.0f} samples/s")
+        if result['p99_ms'] > old['p99_ms'] * (1 + tolerance):
+            regressions.append(f"{case_key(result)}: p99 {result['p99_ms']:.3f} ms "
+                               f"> baseline {old['p99_ms']:.3f} ms")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m hearing_aid.bench',
+                                     description="Benchmark the hearing aid processing chain.")
+    parser.add_argument('--duration', type=float, default=2.0,
+                        help="seconds of audio per case (default: 2)")
+    parser.add_argument('--blocksizes', type=int, nargs='+', default=BLOCK_SIZES)
+    parser.add_argument('--samplerates', type=int, nargs='+', default=SAMPLE_RATES)
+    parser.add_argument('--fitting', default=None, help="benchmark with an audiogram fitting loaded")
+    parser.add_argument('--noise-reduction', default=False, choices=list(NOISE_REDUCTION_PRESETS),
+                        help="benchmark with noise reduction enabled")
+    parser.add_argument('--internal-rate', type=int, default=None,
+                        help="benchmark with the DSP resampled to this rate")
+    parser.add_argument('--channels', type=int, default=1,
+                        help="channels processed per block, each with its own state (default: 1)")
+    parser.add_argument('--json', default=None, help="write results to this file")
+    parser.add_argument('--save-baseline', default=None, help="store results as a baseline")
+    parser.add_argument('--baseline', default=None, help="fail on regressions against this baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed slowdown before a case counts as a regression (default: 0.25)")
+    parser.add_argument('--check-allocations', action='store_true',
+                        help="check that the live callback doesn't allocate after warm-up")
+    parser.add_argument('--kernels', default=kernels.backend(), choices=kernels.BACKENDS,
+                        help="kernel backend for the sample-by-sample loops "
+                             f"(default: {kernels.backend()})")
+    parser.add_argument('--check-kernels', action='store_true',
+                        help="compare the kernel backends' output and speed")
+    parser.add_argument('--vad', action='store_true',
+                        help="run with the voice activity gate on")
+    parser.add_argument('--check-vad', action='store_true',
+                        help="measure what the voice activity gate skips on talk spurts")
+    parser.add_argument('--check-noise-reduction', action='store_true',
+                        help="check that leading silence doesn't disable noise reduction")
+    parser.add_argument('--check-resample-seek', action='store_true',
+                        help="check reads after seeking a resampled file to its end")
+    args = parser.parse_args(argv)
+
+    fitting = load_fitting(args.fitting) if args.fitting else None
+
+    if args.check_kernels:
+        if not kernels.COMPILED:
+            # Still checks the loops' logic, just slowly
+            print("Numba is not installed; the compiled kernels run interpreted")
+        failures = 0
+        for fs in args.samplerates:
+            for blocksize in args.blocksizes:
+                difference, times = check_kernels(fs, blocksize, args.duration, fitting,
+                                                  args.noise_reduction, args.channels)
+                ok = difference <= KERNEL_TOLERANCE
+                failures += not ok
+                print(f"{fs:>6} {blocksize:>6}: numpy {times['numpy'] * 1e3:>8.3f} ms, "
+                      f"compiled {times['compiled'] * 1e3:>8.3f} ms per block "
+                      f"({times['numpy'] / times['compiled']:.1f}x), max difference "
+                      f"{difference:.1e} {'ok' if ok else 'MISMATCH'}")
+        return 1 if failures else 0
+
+    kernels.set_backend(args.kernels)
+
+    if args.check_vad:
+        failures = 0
+        for fs in args.samplerates:
+            for blocksize in args.blocksizes:
+                skipped, times, difference = check_vad(fs, blocksize, max(args.duration, 10.0),
+                                                       fitting, args.noise_reduction,
+                                                       args.channels)
+                problems = []
+                if skipped < VAD_MIN_SKIP:
+                    problems.append("SKIPS TOO LITTLE")
+                if times[True] > times[False] * (1 + VAD_SLOWDOWN_TOLERANCE):
+                    problems.append("SLOWER")
+                failures += bool(problems)
+                print(f"{fs:>6} {blocksize:>6}: skipped {skipped:>4.0%} of blocks, "
+                      f"{times[False] * 1e3:>7.3f} -> {times[True] * 1e3:>7.3f} ms per block "
+                      f"({1 - times[True] / times[False]:>4.0%} saved), speech differs by "
+                      f"{difference:.1e} {', '.join(problems) or 'ok'}")
+        return 1 if failures else 0
+
+    if args.check_noise_reduction:
+        failures = 0
+        for fs in args.samplerates:
+            for blocksize in args.blocksizes:
+                plain, lead = check_noise_reduction(fs, blocksize,
+                                                    args.noise_reduction or 'balanced',
+                                                    max(args.duration, 4.0), args.channels)
+                ok = lead >= plain - NOISE_LEAD_TOLERANCE_DB
+                failures += not ok
+                print(f"{fs:>6} {blocksize:>6}: hiss reduced {plain:>5.1f} dB, "
+                      f"{lead:>5.1f} dB after leading silence {'ok' if ok else 'STUCK'}")
+        return 1 if failures else 0
+
+    if args.check_resample_seek:
+        failures = 0
+        for fs in args.samplerates:
+            device_rate = 44100 if fs == 48000 else 48000
+            for blocksize in args.blocksizes:
+                problems = check_resample_seek(fs, blocksize, args.channels, device_rate)
+                failures += bool(problems)
+                print(f"{fs:>6} -> {device_rate:>6} {blocksize:>6}: "
+                      f"{'; '.join(problems) or 'ok'}")
+        return 1 if failures else 0
+
+    if args.check_allocations:
+        if not kernels.sosfilt_in_place():
+            # The IIR stages will show up as allocating
+            print("SciPy's in-place sosfilt kernel isn't usable; the filters use the public one")
+        failures = 0
+        for fs in args.samplerates:
+            for rate in (args.internal_rate or fs, ALLOCATION_INTERNAL_RATE):
+                if rate == ALLOCATION_INTERNAL_RATE and (args.internal_rate or rate == fs):
+                    continue
+
+                def measure(size):
+                    return check_allocations(fs, size, fitting, args.noise_reduction,
+                                             channels=args.channels, vad=args.vad,
+                                             internal_rate=rate)
+
+                runs = {}
+                for blocksize in args.blocksizes:
+                    for size in (blocksize, 2 * blocksize):
+                        if size not in runs:
+                            runs[size] = measure(size)
+                    peak, lines = runs[blocksize]
+                    growth, where = line_growth(lines, runs[2 * blocksize][1])
+                    limit = ALLOCATION_GROWTH * blocksize * args.channels
+                    if growth >= limit:
+                        # Confirm on fresh sessions (see line_growth)
+                        again = (measure(blocksize)[1], measure(2 * blocksize)[1])
+                        growth, where = line_growth(lines, runs[2 * blocksize][1], again)
+                    ok = peak < ALLOCATION_LIMIT and growth < limit
+                    failures += not ok
+                    line = (f"{fs:>6} {rate:>6} {blocksize:>6}: peak {peak:>6} bytes per "
+                            f"callback, lines grow {growth:>5} bytes at {2 * blocksize}")
+                    if where is not None and growth:
+                        line += f" ({os.path.basename(where[0])}:{where[1]})"
+                    print(f"{line} {'ok' if ok else 'ALLOCATES'}")
+        return 1 if failures else 0
+
+    print(f"{'rate':>6} {'block':>6} {'gain':>5} {'clar':>5} {'Msamp/s':>8} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'RTF':>7}")
+    results = []
+    for fs in args.samplerates:
+        signal = speech_shaped_noise(fs, args.duration)
+        for blocksize in args.blocksizes:
+            for gain, clarity in SETTINGS:
+                r = run_case(signal, fs, blocksize, gain, clarity, fitting, args.noise_reduction,
+                             args.internal_rate, args.channels, args.vad)
+                results.append(r)
+                print(f"{fs:>6} {blocksize:>6} {gain:>5.1f} {clarity:>5.1f} "
+                      f"{r['samples_per_s'] / 1e6:>8.2f} {r['p50_ms']:>8.3f} "
+                      f"{r['p99_ms']:>8.3f} {r['realtime_factor']:>7.4f}")
+
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s) against {args.baseline}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"No regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,302 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+# Bump when a design function changes what it returns for the same settings
+CACHE_VERSION = 1
+
+
+def cache_dir():
+    # HEARING_AID_CACHE overrides the location; set it to an empty string
+    # to turn the disk cache off
+    path = os.environ.get('HEARING_AID_CACHE')
+    if path is None:
+        path = os.path.join(os.path.expanduser('~'), '.cache', 'hearing_aid')
+    return path or None
+
+
+class CoefficientCache:
+    # Filter designs keyed by the settings that produced them.
+    # Designs are kept in memory and as .npz files on disk, so a later run
+    # with the same settings loads its coefficients with NumPy alone and
+    # never has to import scipy.signal to build the chain. Disk problems
+    # (read-only home, full disk, a corrupt file) just fall back to
+    # designing again.
+
+    def __init__(self, path=None):
+        self.path = path
+        self._memory = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _filename(self, name, key):
+        digest = hashlib.sha1(repr((CACHE_VERSION, name, key)).encode()).hexdigest()
+        return os.path.join(self.path, f"{name}-{digest[:16]}.npz")
+
+    def get(self, name, key, design):
+        # design() returns one array or a tuple of arrays for these settings
+        memo = (name, key)
+        if memo in self._memory:
+            return self._memory[memo]
+        value = self._load(name, key)
+        if value is None:
+            self.misses += 1
+            value = design()
+            self._save(name, key, value)
+        else:
+            self.hits += 1
+        self._memory[memo] = value
+        return value
+
+    def _load(self, name, key):
+        if self.path is None:
+            return None
+        try:
+            with np.load(self._filename(name, key)) as data:
+                arrays = [data[f'arr_{i}'] for i in range(len(data.files) - 1)]
+                single = bool(data['single'])
+        except (OSError, KeyError, ValueError):
+            return None
+        return arrays[0] if single else tuple(arrays)
+
+    def _save(self, name, key, value):
+        if self.path is None:
+            return
+        single = isinstance(value, np.ndarray)
+        arrays = [value] if single else list(value)
+        filename = self._filename(name, key)
+        partial = f"{filename}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            with open(partial, 'wb') as f:
+                np.savez(f, *arrays, single=single)
+            # Atomic, so a reader never sees half a file
+            os.replace(partial, filename)
+        except OSError:
+            try:
+                os.remove(partial)
+            except OSError:
+                pass
+
+    def clear(self):
+        self._memory.clear()
+        if self.path is None or not os.path.isdir(self.path):
+            return
+        for name in os.listdir(self.path):
+            if name.endswith('.npz'):
+                os.remove(os.path.join(self.path, name))
+
+
+coefficients = CoefficientCache(cache_dir())
+
+
+def cached_design(name, key, design):
+    return coefficients.get(name, key, design)
+
+
+class Render:
+    # A chain's output for one source played from the start with fixed
+    # settings, filled in as playback gets further: only the first
+    # `frames` samples are valid. `resume` is a copy of the chain as it
+    # was after them, so a later playback can carry on where this one
+    # stopped and keep extending it. Recording stops at `limit` frames,
+    # which the cache sets from its budget.
+
+    def __init__(self, key, length, channels):
+        self.key = key
+        # Pages are only touched as frames are written
+        self.data = np.zeros((length, channels), dtype=np.float32)
+        self.frames = 0
+        self.limit = 0
+        self.resume = None
+        self.users = 0
+        self.filename = None
+
+    @property
+    def frame_bytes(self):
+        return self.data.shape[1] * self.data.itemsize
+
+    @property
+    def nbytes(self):
+        return self.frames * self.frame_bytes
+
+    @property
+    def reserved_bytes(self):
+        # What it may grow to while in use
+        return (self.limit if self.users else self.frames) * self.frame_bytes
+
+    def covers(self, pos, frames):
+        return pos + frames <= self.frames
+
+    def append(self, pos, block):
+        # block is the chain's (channels, frames) or mono output for pos;
+        # only the next frames in line are kept
+        rows = block if block.ndim == 2 else block[None, :]
+        if pos != self.frames or pos + rows.shape[1] > self.limit:
+            return False
+        self.data[pos:pos+rows.shape[1]] = rows.T
+        self.frames += rows.shape[1]
+        return True
+
+
+class RenderCache:
+    # Processed playback audio, keyed by the source file and the chain's
+    # settings, so replaying a clip is a copy instead of a run through the
+    # chain.
+    # Renders stay in memory up to max_bytes. Past that the least recently
+    # used ones move to memory-mapped files in a temporary directory (up to
+    # max_disk_bytes, then they're dropped), where reading them back is
+    # still a copy out of the page cache. Renders a session is using are
+    # never moved; trim() does the moving and is for the sessions' own
+    # threads, never the audio callback. It only holds _lock, which
+    # acquire() and release() take too, to pick what to move; the files
+    # are written and removed outside it. Renders being recorded count at
+    # their limit, so the budgets hold while playback fills them too.
+
+    def __init__(self, max_bytes=256 << 20, max_disk_bytes=2 << 30):
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._renders = OrderedDict()
+        self._lock = threading.Lock()
+        # One trim() at a time
+        self._trimming = threading.Lock()
+        self._path = None
+
+    def source_key(self, audio):
+        # Path, modification time and size of the file behind a reader (or
+        # behind the reader a ResampledReader wraps), or None if there's no
+        # file. Cheap enough for a session's start-up, unlike hashing the
+        # contents, and a rewritten file gets a new key.
+        filename = getattr(audio, 'filename', None)
+        if filename is None:
+            inner = getattr(audio, 'audio', None)
+            return None if inner is None else self.source_key(inner)
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        return (os.path.abspath(filename), stat.st_mtime_ns, stat.st_size)
+
+    def acquire(self, key, length, channels):
+        with self._lock:
+            render = self._renders.get(key)
+            if render is None:
+                render = self._renders[key] = Render(key, length, channels)
+            self._renders.move_to_end(key)
+            render.users += 1
+            self._allow(render)
+            return render
+
+    def _allow(self, render):
+        # Lets a render record as far as what's left of the budget where
+        # it's held; never takes back what it already has
+        on_disk = render.filename is not None
+        budget = self.max_disk_bytes if on_disk else self.max_bytes
+        used = sum(other.reserved_bytes for other in self._renders.values()
+                   if other is not render and (other.filename is not None) == on_disk)
+        room = max(0, budget - used) // render.frame_bytes
+        render.limit = max(render.frames, min(len(render.data), room))
+
+    def release(self, render):
+        with self._lock:
+            render.users -= 1
+
+    def __len__(self):
+        return len(self._renders)
+
+    @property
+    def memory_bytes(self):
+        return sum(r.nbytes for r in self._renders.values() if r.filename is None)
+
+    @property
+    def disk_bytes(self):
+        return sum(r.nbytes for r in self._renders.values() if r.filename is not None)
+
+    def trim(self, reserve=0):
+        # Spills or drops idle renders until those in memory fit in
+        # max_bytes less `reserve`, room for a playback about to record
+        with self._trimming:
+            removed = []
+            while True:
+                with self._lock:
+                    idle = [r for r in self._renders.values() if r.users == 0]
+                    for render in idle:
+                        if render.frames == 0:
+                            removed.append(self._drop(render))
+                    victim = None
+                    if self.memory_bytes > self.max_bytes - reserve:
+                        victim = next((r for r in idle if r.frames and r.filename is None), None)
+                    if victim is None:
+                        break
+                    # Out of the cache while it's written, so nothing can
+                    # acquire it and record into the old buffer meanwhile
+                    keys = list(self._renders)
+                    later = set(keys[keys.index(victim.key) + 1:])
+                    del self._renders[victim.key]
+                spilled = self._spill(victim)
+                with self._lock:
+                    if spilled and victim.key not in self._renders:
+                        self._restore(victim, later)
+                    elif spilled:
+                        removed.append(victim.filename)
+            with self._lock:
+                disk = self.disk_bytes
+                for render in [r for r in self._renders.values() if r.users == 0]:
+                    if disk <= self.max_disk_bytes:
+                        break
+                    if render.filename is not None:
+                        disk -= render.nbytes
+                        removed.append(self._drop(render))
+            self._remove(removed)
+
+    def _spill(self, render):
+        try:
+            if self._path is None:
+                self._path = tempfile.mkdtemp(prefix='hearing_aid-renders-')
+                weakref.finalize(self, shutil.rmtree, self._path, True)
+            digest = hashlib.sha1(repr(render.key).encode()).hexdigest()
+            filename = os.path.join(self._path, f"{digest[:16]}.f32")
+            mapped = np.memmap(filename, dtype=render.data.dtype, mode='w+',
+                               shape=render.data.shape)
+            mapped[:render.frames] = render.data[:render.frames]
+        except OSError:
+            return False
+        render.data = mapped
+        render.filename = filename
+        return True
+
+    def _restore(self, render, later):
+        # Back in its place in the LRU order: ahead of the renders that were
+        # behind it, which keep the order they have now
+        self._renders[render.key] = render
+        for key in [key for key in self._renders if key in later]:
+            self._renders.move_to_end(key)
+
+    def _drop(self, render):
+        # Returns the render's file, for _remove() once _lock is released
+        del self._renders[render.key]
+        filename = render.filename
+        if filename is not None:
+            render.data = None
+        return filename
+
+    @staticmethod
+    def _remove(filenames):
+        for filename in filenames:
+            if filename is not None:
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+
+    def clear(self):
+        with self._lock:
+            removed = [self._drop(render)
+                       for render in [r for r in self._renders.values() if r.users == 0]]
+        self._remove(removed)
@@ -0,0 +1,283 @@
+import math
+
+import numpy as np
+
+from .cache import cached_design
+from .graph import Node
+from .kernels import follow_envelope, sos_state, sosfilt_inplace, use_compiled, warm_up
+
+
+def band_edge_limit(fs):
+    # Highest usable filter edge: Butterworth designs fail at Nyquist and
+    # get steep and fragile close to it
+    return 0.45 * fs
+
+
+def design_crossover(frequency, fs):
+    # Linkwitz-Riley 4th order: each side is a squared 2nd order Butterworth,
+    # and the two sides sum to a 2nd order allpass with the same poles
+    return cached_design('crossover', (float(frequency), float(fs)),
+                         lambda: _design_crossover(frequency, fs))
+
+
+def _design_crossover(frequency, fs):
+    from scipy.signal import butter
+    lp = butter(2, frequency, btype='lowpass', fs=fs, output='sos')
+    hp = butter(2, frequency, btype='highpass', fs=fs, output='sos')
+    ap = lp.copy()
+    ap[0, :3] = ap[0, 5:2:-1]
+    return np.vstack([lp, lp]), np.vstack([hp, hp]), ap
+
+
+class MultibandCompressor(Node):
+    # Wide dynamic range compression in independent frequency bands.
+    # Band levels are tracked on short detector hops rather than per sample:
+    # each hop's peak feeds an attack/release follower that runs across all
+    # bands at once, and the resulting gains are interpolated back to sample
+    # rate. That keeps the Python work per block at one short loop over hops
+    # whatever the number of bands. All of it runs in scratch buffers sized
+    # for the largest block seen, so a warmed-up compressor doesn't allocate.
+    # Channels are compressed independently: the follower treats every
+    # (band, channel) pair as its own row. With the compiled kernel backend
+    # the peak detection and follower run as one Numba loop instead.
+
+    def __init__(self, fs=44100, crossovers=(500, 1000, 2000, 4000),
+                 threshold_db=-30.0, ratio=2.0, attack=0.005, release=0.05,
+                 makeup_db=0.0, hop=16):
+        super().__init__()
+        self.fs = fs
+        self.crossovers = tuple(crossovers)
+        self.threshold_db = threshold_db
+        self.ratio = ratio
+        self.attack = attack
+        self.release = release
+        self.makeup_db = makeup_db
+        self.hop = hop
+        self.design()
+
+    @property
+    def active_crossovers(self):
+        # Crossovers above the usable range at this rate (4 kHz at 8 kHz)
+        # are dropped, merging those bands into the top one
+        return tuple(f for f in self.crossovers if f < band_edge_limit(self.fs))
+
+    @property
+    def num_bands(self):
+        return len(self.splits) + 1
+
+    def _band_values(self, value):
+        # Per-band settings may be given as one value or one per band;
+        # settings for dropped bands are ignored
+        value = np.asarray(value, dtype=float)
+        if value.ndim:
+            value = value[:self.num_bands]
+        return np.broadcast_to(value, (self.num_bands,)).copy()
+
+    def design(self):
+        designs = [design_crossover(f, self.fs) for f in self.active_crossovers]
+        self.splits = [(lp, hp) for lp, hp, ap in designs]
+        # Lower bands skip the later crossovers, so they get those crossovers'
+        # allpass instead to keep the bands phase-aligned and summing flat
+        self.compensation = [
+            np.vstack([designs[j][2] for j in range(i + 1, len(designs))])
+            for i in range(self.num_bands - 2)
+        ]
+        self._threshold = self._band_values(self.threshold_db)
+        self._slope = 1.0 / self._band_values(self.ratio) - 1.0
+        self._makeup = self._band_values(self.makeup_db)
+        self._attack_coef = np.exp(-self.hop / (self.fs * self._band_values(self.attack)))
+        self._release_coef = np.exp(-self.hop / (self.fs * self._band_values(self.release)))
+        self._attack_rest = 1 - self._attack_coef
+        self._release_rest = 1 - self._release_coef
+        warm_up()
+        self.reset()
+
+    @property
+    def rows(self):
+        # Follower rows: every band of every channel
+        return self.num_bands * self.channels
+
+    def _row_values(self, values):
+        # Per-band values repeated for each channel's row
+        return np.repeat(values, self.channels)
+
+    def reset(self):
+        channels = self.channels
+        self.split_zi = [(sos_state(lp, channels), sos_state(hp, channels))
+                         for lp, hp in self.splits]
+        self.compensation_zi = [sos_state(sos, channels) for sos in self.compensation]
+        self.envelope = np.zeros(self.rows)
+        self.last_gain = self._row_values(10 ** (self._makeup / 20))
+        self._row_attack_coef = self._row_values(self._attack_coef)
+        self._row_release_coef = self._row_values(self._release_coef)
+        self._row_attack_rest = self._row_values(self._attack_rest)
+        self._row_release_rest = self._row_values(self._release_rest)
+        self._allocate(self.blocksize)
+
+    def _allocate(self, frames):
+        # Flat scratch for blocks of up to `frames` samples. Blocks take
+        # contiguous views from the front (see _scratch): NumPy runs ufuncs
+        # on strided 2-D views through a temporary buffer.
+        rows = self.rows
+        hops = -(-frames // self.hop)
+        self._frames = frames
+        self._allocated_rows = rows
+        self._bands = np.zeros(rows * frames)
+        self._rectified = np.zeros(rows * hops * self.hop)
+        self._peaks = np.zeros(rows * hops)
+        self._levels = np.zeros(rows * hops)
+        self._knots = np.zeros(rows * (hops + 1))
+        self._start_gains = np.zeros(rows * frames)
+        self._sample_gains = np.zeros(rows * frames)
+        self._coef = np.zeros(rows)
+        self._rest = np.zeros(rows)
+        self._held = np.zeros(rows)
+        self._rising = np.zeros(rows, dtype=bool)
+        # Interpolation indices depend only on the block length
+        self._interpolation = {}
+
+    @staticmethod
+    def _scratch(buffer, *shape):
+        return buffer[:math.prod(shape)].reshape(shape)
+
+    def key(self):
+        # Settings that change the output (see FilterChain.key)
+        return tuple(tuple(np.ravel(getattr(self, name)).tolist())
+                     for name in ('crossovers', 'threshold_db', 'ratio', 'attack', 'release',
+                                  'makeup_db', 'hop'))
+
+    def configure(self, **changes):
+        # Same contract as FilterChain.configure
+        changed = False
+        for name, value in changes.items():
+            if name not in ('fs', 'crossovers', 'threshold_db', 'ratio', 'attack',
+                            'release', 'makeup_db', 'hop'):
+                raise TypeError(f"Unknown compressor parameter: {name}")
+            if name == 'crossovers' and value is not None:
+                value = tuple(value)
+            if value is not None and not np.array_equal(getattr(self, name), value):
+                setattr(self, name, value)
+                changed = True
+        if changed:
+            self.design()
+        return changed
+
+    def split(self, audio_in):
+        # (channels, frames) in, (bands, channels, frames) out
+        if self._frames != self.blocksize or self._allocated_rows != self.rows:
+            self._allocate(self.blocksize)
+        bands = self._scratch(self._bands, self.num_bands, *audio_in.shape)
+        # The top band doubles as the running highpass remainder
+        rest = bands[-1]
+        rest[:] = audio_in
+        for i, (lp, hp) in enumerate(self.splits):
+            lp_zi, hp_zi = self.split_zi[i]
+            bands[i] = rest
+            sosfilt_inplace(lp, bands[i], lp_zi)
+            sosfilt_inplace(hp, rest, hp_zi)
+
+        for i, sos in enumerate(self.compensation):
+            sosfilt_inplace(sos, bands[i], self.compensation_zi[i])
+        return bands
+
+    def _interpolation_indices(self, frames, hops):
+        indices = self._interpolation.get(frames)
+        if indices is None:
+            position = np.arange(1, frames + 1) / self.hop
+            index = np.minimum(position.astype(int), hops - 1)
+            # Tiled across rows, as a broadcast operand would be buffered
+            frac = np.tile(position - index, (self.rows, 1))
+            indices = self._interpolation[frames] = (index, index + 1, frac)
+        return indices
+
+    def band_gains(self, bands):
+        # bands is (rows, frames), one row per band and channel. Returns a
+        # view of scratch memory, valid until the next call.
+        rows, frames = bands.shape
+        hops = -(-frames // self.hop)
+        levels = self._scratch(self._levels, rows, hops)
+        if use_compiled():
+            follow_envelope(bands, self.hop, self.envelope, self._row_attack_coef,
+                            self._row_attack_rest, self._row_release_coef,
+                            self._row_release_rest, levels)
+        else:
+            self._follow_envelope(bands, levels)
+        return self._gain_curve(levels, frames)
+
+    def _follow_envelope(self, bands, levels):
+        # NumPy reference for kernels.follow_envelope
+        rows, frames = bands.shape
+        hops = levels.shape[1]
+
+        # Peak of each row over each detector hop, shape (rows, hops)
+        rectified = self._scratch(self._rectified, rows, hops, self.hop)
+        flat = rectified.reshape(rows, hops * self.hop)
+        if frames == flat.shape[1]:
+            np.abs(bands, out=flat)
+        else:
+            # Row by row: a block that isn't whole hops (e.g. between
+            # resamplers) would make flat[:, :frames] a strided view
+            for row in range(rows):
+                np.abs(bands[row], out=flat[row, :frames])
+                flat[row, frames:] = 0
+        peaks = self._scratch(self._peaks, rows, hops)
+        rectified.max(axis=2, out=peaks)
+
+        # Attack/release follower, vectorized across rows
+        envelope = self.envelope
+        coef, rest, held, rising = self._coef, self._rest, self._held, self._rising
+        for k in range(hops):
+            peak = peaks[:, k]
+            np.greater(peak, envelope, out=rising)
+            np.copyto(coef, self._row_release_coef)
+            np.copyto(coef, self._row_attack_coef, where=rising)
+            np.copyto(rest, self._row_release_rest)
+            np.copyto(rest, self._row_attack_rest, where=rising)
+            # envelope = coef * envelope + (1 - coef) * peak
+            np.multiply(coef, envelope, out=held)
+            np.multiply(rest, peak, out=envelope)
+            envelope += held
+            levels[:, k] = envelope
+
+    def _gain_curve(self, levels, frames):
+        rows, hops = levels.shape
+        # Static curve: linear below threshold, 1/ratio slope above it
+        np.maximum(levels, 1e-9, out=levels)
+        np.log10(levels, out=levels)
+        levels *= 20
+        # One row per band, covering that band's channels
+        for level, threshold, slope, makeup in zip(levels.reshape(self.num_bands, -1),
+                                                   self._threshold, self._slope, self._makeup):
+            level -= threshold
+            np.maximum(level, 0, out=level)
+            level *= slope
+            level += makeup
+        levels /= 20
+        np.power(10, levels, out=levels)
+
+        # Interpolate from the previous block's last gain to sample rate
+        knots = self._scratch(self._knots, rows, hops + 1)
+        knots[:, 0] = self.last_gain
+        knots[:, 1:] = levels
+        index, next_index, frac = self._interpolation_indices(frames, hops)
+        start = self._scratch(self._start_gains, rows, frames)
+        sample_gains = self._scratch(self._sample_gains, rows, frames)
+        # mode='clip' because the default mode buffers out= through a copy
+        np.take(knots, index, axis=1, out=start, mode='clip')
+        np.take(knots, next_index, axis=1, out=sample_gains, mode='clip')
+        sample_gains -= start
+        sample_gains *= frac
+        sample_gains += start
+        self.last_gain[:] = sample_gains[:, -1]
+        return sample_gains
+
+    def process(self, block, params=None):
+        self.fit(block)
+        out = self.output(block)
+        if block.shape[1] == 0:
+            return out
+        bands = self.split(block)
+        rows = bands.reshape(self.rows, -1)
+        rows *= self.band_gains(rows)
+        bands.sum(axis=0, out=out)
+        return out
@@ -0,0 +1,510 @@
+import copy
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from .feedback import FeedbackCanceller
+from .filters import FilterChain
+from .graph import write_output
+from .metrics import CallbackMetrics
+from .params import ParameterSmoother
+from .resample import ResampledReader
+from .ringbuffer import RingBuffer
+from .wavio import WavWriter
+
+# Callback size, PortAudio latency hint and FIR partition size for each
+# latency profile. Smaller blocks cut the delay through the device but leave
+# less time per callback; at 44.1 kHz a block lasts 1.5, 2.9, 5.8 and
+# 23.2 ms respectively.
+LatencyProfile = namedtuple('LatencyProfile', ['blocksize', 'latency', 'partition_size'])
+LATENCY_PROFILES = {
+    'ultra-low': LatencyProfile(64, 'low', 64),
+    'low': LatencyProfile(128, 'low', 128),
+    'medium': LatencyProfile(256, 'low', 256),
+    'standard': LatencyProfile(1024, 'low', 256),
+}
+
+
+def latency_profile(profile):
+    # A LATENCY_PROFILES name or a LatencyProfile
+    if isinstance(profile, LatencyProfile):
+        return profile
+    if profile not in LATENCY_PROFILES:
+        raise ValueError(f"Unknown latency profile: {profile}")
+    return LATENCY_PROFILES[profile]
+
+
+class Session:
+    # One audio stream running a FilterChain.
+    # Front ends (the Tk app, the soak tool, services) build a session from
+    # a backend and a ParameterStore, then call run() on a worker thread.
+    # The audio callback only touches the chain, the smoother and the
+    # metrics, all of which belong to this session. A latency profile, if
+    # given, sets the block size and re-plans the chain for it, and
+    # internal_rate runs the chain's DSP at that rate (see FilterChain).
+    # With several channels each one (e.g. each ear) is processed with its
+    # own state, and `fitting` may be a list with one Fitting per channel.
+
+    name = 'session'
+
+    def __init__(self, backend, params, fs, blocksize=1024, fitting=None, noise_reduction=False,
+                 chain=None, profile=None, internal_rate=None, channels=1, vad=False):
+        self.profile = latency_profile(profile) if profile is not None else None
+        if self.profile is not None:
+            blocksize = self.profile.blocksize
+        self.backend = backend
+        self.fs = fs
+        self.blocksize = blocksize
+        self.channels = channels
+        self.chain = chain or FilterChain(fs=fs, fitting=fitting, noise_reduction=noise_reduction,
+                                          blocksize=blocksize, internal_rate=internal_rate,
+                                          channels=channels, vad=vad)
+        if self.profile is not None:
+            self.chain.plan(blocksize, self.profile.partition_size)
+        self.smoother = ParameterSmoother(params, fs=fs)
+        self.metrics = CallbackMetrics(self.name, fs, blocksize)
+        self.metrics.gate = self.chain.gate
+        self.finished = threading.Event()
+
+    def open_stream(self):
+        raise NotImplementedError
+
+    def run(self, keep_running, on_report=None, report_interval=1.0):
+        # Blocks until keep_running() is false or the source runs out.
+        # on_report is called from this thread every report_interval seconds.
+        with self.open_stream() as stream:
+            self.metrics.set_stream(stream)
+            last_report = time.monotonic()
+            while keep_running() and not self.finished.is_set():
+                self.backend.sleep(100)
+                if on_report is not None and time.monotonic() - last_report >= report_interval:
+                    last_report = time.monotonic()
+                    on_report(self.metrics)
+        return self.finished.is_set()
+
+
+class LiveSession(Session):
+    # Microphone -> chain -> speaker on a full-duplex stream.
+    # feedback_cancellation is True for the default FeedbackCanceller or a
+    # configured one; it subtracts the speaker's estimated leak into the
+    # microphone before the chain and learns from what was played.
+    name = 'live'
+
+    def __init__(self, backend, params, fs=44100, blocksize=1024, fitting=None,
+                 noise_reduction=False, latency='low', chain=None, feedback_cancellation=False,
+                 profile=None, internal_rate=None, channels=1, vad=False):
+        super().__init__(backend, params, fs, blocksize, fitting, noise_reduction, chain, profile,
+                         internal_rate, channels, vad)
+        self.latency = self.profile.latency if self.profile is not None else latency
+        self.canceller = None
+        if feedback_cancellation:
+            self.canceller = (feedback_cancellation
+                              if isinstance(feedback_cancellation, FeedbackCanceller)
+                              else FeedbackCanceller())
+            self.canceller.prepare(fs, self.blocksize, channels)
+
+    def callback(self, indata, outdata, frames, time_info, status):
+        started = time.perf_counter()
+        params = self.smoother.next_block(frames)
+        if self.canceller is None:
+            self.chain.run_callback(indata, outdata, frames, params)
+        else:
+            cleaned = self.canceller.process(self.chain.read_input(indata, frames))
+            write_output(outdata, self.chain.run(cleaned, params))
+            self.canceller.push(outdata[:frames].T)
+        self.metrics.record(time.perf_counter() - started, frames, status)
+
+    def open_stream(self):
+        return self.backend.open_stream(self.callback, self.fs, blocksize=self.blocksize,
+                                        channels=self.channels, latency=self.latency)
+
+
+class PlaybackSession(Session):
+    # Audio source -> chain -> speaker. The source is anything with a
+    # sample rate `fs`, a length and read(pos, frames), e.g. a WavReader;
+    # sources returning (frames, channels) blocks play with one channel
+    # each, and should say how many in `channels`.
+    # With device_rate set, the source is resampled to it and the stream
+    # opens at that rate, for devices that can't play the file's own rate.
+    # With a RenderCache, blocks played with settled settings are kept, and
+    # a later playback of the same file with the same chain and settings
+    # copies them out instead of running the chain (see play_cached).
+    # Without prefetch only the settings playback started with are cached,
+    # since the callback can't switch renders.
+    # Playback can be paused, moved with seek() and looped over an A/B
+    # region with set_loop(), all while the stream stays open. With prefetch
+    # set (seconds), a producer thread runs the chain that far ahead into a
+    # ring buffer and the callback only copies out of it, so a slow block
+    # doesn't cost a dropout; slider changes are heard that much later.
+    name = 'playback'
+
+    # Seconds of input the chain is run over, output discarded, to settle
+    # its state when it takes over from the cache mid-file
+    CATCH_UP = 0.25
+    # Read-ahead the app uses for file playback
+    PREFETCH = 0.2
+
+    def __init__(self, backend, audio, params, blocksize=1024, fitting=None,
+                 noise_reduction=False, name=None, chain=None, profile=None,
+                 internal_rate=None, device_rate=None, cache=None, vad=False, prefetch=None):
+        if name is not None:
+            self.name = name
+        if device_rate is not None and device_rate != audio.fs:
+            audio = ResampledReader(audio, device_rate)
+        super().__init__(backend, params, audio.fs, blocksize, fitting, noise_reduction, chain,
+                         profile, internal_rate, getattr(audio, 'channels', 1), vad)
+        self.audio = audio
+        self.pos = 0
+        self.cache = cache
+        self.cached_frames = 0
+        self._key = None
+        if cache is not None:
+            source = cache.source_key(audio)
+            if source is not None:
+                self._key = (source, audio.fs, len(audio), self.blocksize, self.chain.key())
+        self._render = None
+        self._render_params = None
+        # The render whose output the chain's state exactly continues
+        self._recording = None
+        self._in_sync = True
+        # Frame the listener has reached; pos is where the chain has got to
+        self.position = 0
+        self.paused = False
+        self.loop = None
+        # (request count, frame) from seek(), applied by whoever runs the
+        # chain once its count differs from _seeks_done
+        self._seek_request = (0, 0)
+        self._seeks_done = 0
+        self._counter = np.arange(self.blocksize)
+        self._ring = None
+        if prefetch:
+            blocks = max(2, -(-int(prefetch * self.fs) // self.blocksize))
+            self._ring = RingBuffer(blocks * self.blocksize, self.channels)
+            # Source frame of every buffered frame, written before the audio
+            # so the callback always finds as many as it read
+            self._positions = RingBuffer(blocks * self.blocksize, 1, dtype=np.int64)
+            self._played = np.zeros((self.blocksize, 1), dtype=np.int64)
+            self.metrics.buffer = self._ring
+            # Flush handshake: the producer bumps _flush, the callback (the
+            # rings' reader) clears them and copies it to _flushed
+            self._flush = 0
+            self._flushed = 0
+            self._exhausted = False
+            self._stop = threading.Event()
+
+    def seek(self, pos):
+        # From any thread; what's already buffered is dropped
+        pos = max(0, min(int(pos), len(self.audio)))
+        self._seek_request = (self._seek_request[0] + 1, pos)
+        self.position = pos
+
+    def set_loop(self, start=None, end=None):
+        # Repeat frames [start, end) without a gap once playback reaches
+        # end from inside the region; no start plays straight through
+        if start is None:
+            self.loop = None
+            return
+        end = len(self.audio) if end is None else min(int(end), len(self.audio))
+        if not 0 <= start < end:
+            raise ValueError(f"Empty loop region: {start} to {end}")
+        self.loop = (int(start), end)
+        if self._ring is not None and self.position <= end < self.pos:
+            # The producer has already run past the end of the region
+            self.seek(self.position)
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+
+    def callback(self, outdata, frames, time_info, status):
+        started = time.perf_counter()
+        if self._ring is not None:
+            self._play_prefetched(outdata, frames)
+        elif self.paused:
+            outdata.fill(0)
+        else:
+            done = self.produce(outdata[:frames])
+            if done == 0:
+                # End of source; run() sees the event and returns
+                self.finished.set()
+            outdata[done:] = 0
+            self.position = self.pos
+        self.metrics.record(time.perf_counter() - started, frames, status)
+
+    def produce(self, out, positions=None):
+        # Fills out (frames, channels) with the next processed audio,
+        # following seeks and the loop; returns the frames written, fewer
+        # only at the end of the source. positions gets each one's frame.
+        frames = len(out)
+        done = 0
+        while done < frames:
+            request = self._seek_request
+            # With prefetch, only once _prefetch has had the rings flushed
+            # for it, so no audio from before a seek plays after it
+            if request[0] != self._seeks_done \
+                    and (self._ring is None or request[0] == self._flushed):
+                self._seeks_done = request[0]
+                self._jump(request[1])
+            end = len(self.audio)
+            loop = self.loop
+            if loop is not None and self.pos <= loop[1]:
+                if self.pos == loop[1]:
+                    # Back to the start, the chain's state carrying on
+                    # across the join as if the audio were spliced
+                    self.pos = loop[0]
+                    continue
+                end = loop[1]
+            if self.pos >= end:
+                break
+            count = min(frames - done, end - self.pos)
+            params = self.smoother.next_block(count)
+            block = out[done:done+count]
+            if self._key is None:
+                if not self._in_sync:
+                    self._catch_up(None)
+                write_output(block, self.chain.run(self.audio.read(self.pos, count).T, params))
+            else:
+                self.play_cached(block, count, params)
+            if positions is not None:
+                np.add(self._counter[:count], self.pos, out=positions[done:done+count])
+            self.pos += count
+            done += count
+        return done
+
+    def _jump(self, pos):
+        if pos == self.pos:
+            return
+        self.pos = pos
+        # The chain's state belongs to the old position
+        self._in_sync = False
+        self._recording = None
+
+    def _play_prefetched(self, outdata, frames):
+        if self._flush != self._flushed:
+            self._ring.clear()
+            self._positions.clear()
+            self._flushed = self._flush
+            # Nothing from the new position yet; not an underrun
+            outdata.fill(0)
+            return
+        if self.paused:
+            outdata.fill(0)
+            return
+        if frames > len(self._played):
+            self._played = np.zeros((frames, 1), dtype=np.int64)
+        got = len(self._ring.read(frames, out=outdata))
+        if got:
+            self._positions.read(got, out=self._played)
+            self.position = int(self._played[got-1, 0]) + 1
+        if got < frames:
+            outdata[got:] = 0
+            if not self._exhausted:
+                self.metrics.buffer_underruns += 1
+            elif self._ring.available() == 0:
+                # Everything up to the end of the source has played
+                self.finished.set()
+
+    def _prefetch(self):
+        # Producer thread: keeps the ring topped up a block at a time
+        frames = self.blocksize
+        block = np.zeros((frames, self.channels), dtype=np.float32)
+        positions = np.zeros((frames, 1), dtype=np.int64)
+        wait = frames / self.fs / 4
+        while not self._stop.is_set():
+            request = self._seek_request[0]
+            if request != self._seeks_done and request != self._flush:
+                # Audio from the old position goes before any from the
+                # new one is written; produce() makes the jump after that
+                self._exhausted = False
+                self._flush = request
+            elif self._flush == self._flushed and not self._exhausted \
+                    and self._ring.free() >= frames:
+                done = self.produce(block, positions[:, 0])
+                if done:
+                    self._positions.write(positions[:done])
+                    self._ring.write(block[:done])
+                if done < frames:
+                    self._exhausted = True
+                continue
+            time.sleep(wait)
+
+    def play_cached(self, outdata, frames, params):
+        # Settled settings play from, or record into, the render for them.
+        # The chain only runs past the end of what's cached or while a
+        # slider ramps; it sits idle during cached stretches and catches up
+        # when it's needed again.
+        render = self._render_for(params)
+        pos = self.pos
+        if render is not None and render.covers(pos, frames):
+            outdata[:frames] = render.data[pos:pos+frames]
+            outdata[frames:] = 0
+            self.cached_frames += frames
+            self._in_sync = False
+            return
+        if not self._in_sync:
+            self._catch_up(render)
+        processed = self.chain.run(self.audio.read(pos, frames).T, params)
+        if self._recording is not None and not self._recording.append(pos, processed):
+            self._recording = None
+        write_output(outdata, processed)
+
+    def _render_for(self, params):
+        if any(isinstance(value, np.ndarray) for value in params):
+            # Ramping: no render matches, and the chain's state won't match
+            # any render afterwards either
+            self._recording = None
+            return None
+        # Settled parameters are the store's snapshot itself
+        if params is not self._render_params:
+            if self._ring is None:
+                # In the audio callback, which mustn't take the cache's
+                # lock or allocate a render: only the one run() acquired
+                # plays, and only for the settings it was acquired with
+                if params != self._render_params:
+                    self._recording = None
+                    return None
+            else:
+                self._acquire_render(params)
+        return self._render
+
+    def _acquire_render(self, params):
+        if self._render is not None:
+            self.cache.release(self._render)
+        self._render = self.cache.acquire(self._key + tuple(params), len(self.audio),
+                                          self.channels)
+        self._render_params = params
+        if self.pos == 0:
+            # Nothing has run through the chain yet
+            self._recording = self._render
+
+    def _catch_up(self, render):
+        self._in_sync = True
+        if render is not None and render.resume is not None and render.frames == self.pos:
+            # Exactly where an earlier playback stopped recording
+            self.chain, render.resume = render.resume, None
+            self._recording = render
+            return
+        self._recording = None
+        self.chain.reset()
+        params = self.smoother.store.snapshot()
+        blocks = int(self.CATCH_UP * self.fs) // self.blocksize
+        for pos in range(max(0, self.pos - blocks * self.blocksize), self.pos, self.blocksize):
+            frames = min(self.blocksize, self.pos - pos)
+            self.chain.run(self.audio.read(pos, frames).T, params)
+
+    def run(self, keep_running, on_report=None, report_interval=1.0):
+        if self._key is not None:
+            # Make room to record this source whole (float32 samples), and
+            # take the render for the current settings before the stream
+            # starts
+            self.cache.trim(reserve=len(self.audio) * self.channels * 4)
+            self._acquire_render(self.smoother.store.snapshot())
+        producer = None
+        if self._ring is not None:
+            # No callback yet, so this thread can empty the rings itself
+            self._ring.clear()
+            self._positions.clear()
+            self._flush = self._flushed = self._seek_request[0]
+            self._stop.clear()
+            producer = threading.Thread(target=self._prefetch, daemon=True)
+            producer.start()
+            # Start with a full buffer rather than an underrun
+            deadline = time.monotonic() + 1.0
+            while (self._ring.free() >= self.blocksize and not self._exhausted
+                   and time.monotonic() < deadline):
+                time.sleep(0.001)
+        try:
+            return super().run(keep_running, on_report, report_interval)
+        finally:
+            if producer is not None:
+                self._stop.set()
+                producer.join()
+            if self._render is not None:
+                render = self._render
+                if self._recording is render and render.frames == self.pos \
+                        and self.pos < len(self.audio):
+                    render.resume = copy.deepcopy(self.chain)
+                self.cache.release(render)
+                self._render = self._render_params = self._recording = None
+                self.cache.trim()
+
+    def open_stream(self):
+        return self.backend.open_output_stream(self.callback, self.fs, blocksize=self.blocksize,
+                                               channels=self.channels)
+
+
+class OfflineRender:
+    # Audio source -> chain -> WAV file, as fast as the CPU allows.
+    # Runs the same chain as a PlaybackSession, with its state carried
+    # across large blocks, so the file matches what streaming playback would
+    # have sent to the speaker. Output is written as it's produced; progress
+    # and speed are readable from any thread while run() works.
+    # The voice activity gate decides once per block, so with vad on the
+    # chain runs at the streaming block size, stream_blocksize, instead;
+    # a gate deciding every 1.5 s would skip and fade elsewhere than the
+    # playback it should match.
+
+    # Large blocks keep Python overhead negligible
+    BLOCKSIZE = 65536
+
+    def __init__(self, audio, params, filename, blocksize=BLOCKSIZE, fitting=None,
+                 noise_reduction=False, internal_rate=None, chain=None, vad=False,
+                 stream_blocksize=1024):
+        self.audio = audio
+        self.filename = filename
+        if vad or (chain is not None and chain.gate is not None):
+            blocksize = stream_blocksize
+        self.blocksize = blocksize
+        self.channels = getattr(audio, 'channels', 1)
+        # No callback budget offline, so use long FIR partitions
+        self.chain = chain or FilterChain(fs=audio.fs, fitting=fitting, partition_size=4096,
+                                          noise_reduction=noise_reduction,
+                                          internal_rate=internal_rate, channels=self.channels,
+                                          blocksize=blocksize, vad=vad)
+        self.smoother = ParameterSmoother(params, fs=audio.fs)
+        self.frames_done = 0
+        self.elapsed = 0.0
+
+    @property
+    def progress(self):
+        return self.frames_done / len(self.audio) if len(self.audio) else 1.0
+
+    @property
+    def speedup(self):
+        # Seconds of audio rendered per second of processing, so bigger is
+        # faster (bench's realtime_factor is the inverse)
+        return self.frames_done / self.audio.fs / self.elapsed if self.elapsed > 0 else 0.0
+
+    def run(self, keep_running=lambda: True, on_report=None, report_interval=0.25):
+        # Returns True once the whole source is written, False if
+        # keep_running() went false first (the partial file is kept).
+        # on_report(render) is called from this thread.
+        started = time.perf_counter()
+        last_report = started
+        with WavWriter(self.filename, self.audio.fs, self.channels) as writer:
+            while self.frames_done < len(self.audio):
+                if not keep_running():
+                    return False
+                chunk = self.audio.read(self.frames_done, self.blocksize)
+                params = self.smoother.next_block(len(chunk))
+                writer.write(self.chain.run(chunk.T, params).T)
+                self.frames_done += len(chunk)
+                now = time.perf_counter()
+                self.elapsed = now - started
+                if on_report is not None and now - last_report >= report_interval:
+                    last_report = now
+                    on_report(self)
+        return True
+
+    def summary(self):
+        duration = self.frames_done / self.audio.fs
+        return {
+            'samplerate': self.audio.fs,
+            'duration_s': duration,
+            'processing_s': self.elapsed,
+            'speedup': self.speedup,
+        }
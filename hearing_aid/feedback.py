@@ -0,0 +1,165 @@
+import numpy as np
+
+from .graph import Node
+
+
+class FeedbackCanceller(Node):
+    # Adaptive acoustic feedback cancellation for the live path.
+    # Models the speaker -> microphone path as a `taps`-long FIR starting
+    # `delay` samples back and subtracts its estimate of the feedback from
+    # the microphone before the chain sees it. process() cancels a block;
+    # push() must then be given the block sent to the speaker.
+    #
+    # The filter adapts as a partitioned-block frequency-domain NLMS
+    # (MDF): every partition_size samples one rfft of the reference, one of
+    # the error and a per-bin normalized update of all partitions at once,
+    # so the cost per sample is fixed whatever the callback size. One
+    # partition per block is constrained back to a linear (not circular)
+    # convolution, round-robin. The whole estimate for a partition is
+    # computed when it starts, which needs every reference sample it uses to
+    # have been played already: delay is raised to at least one callback
+    # plus one partition. Each channel (ear) models its own speaker ->
+    # microphone path; all channels share every FFT and update.
+
+    # Reference power smoothing per partition
+    power_smoothing = 0.9
+    # Step normalization floor relative to the mean reference power, so
+    # bins the speaker never excites (outside the bandpass) don't wander
+    regularization = 0.01
+
+    def __init__(self, taps=1024, partition_size=128, delay=None, step=0.01):
+        super().__init__()
+        self.partition_size = partition_size
+        self.partitions = -(-taps // partition_size)
+        self.taps = self.partitions * partition_size
+        self.requested_delay = delay
+        self.step = step
+        self.delay = 0
+
+    def prepare(self, fs, blocksize, channels=1):
+        grown = blocksize > self.blocksize
+        if grown:
+            self.delay = max(self.requested_delay or 0, blocksize + self.partition_size)
+        super().prepare(fs, blocksize, channels)
+        if grown:
+            self.reset()
+
+    def reset(self):
+        size, count, channels = self.partition_size, self.partitions, self.channels
+        bins = size + 1
+        # Per partition, one row per channel
+        self.weights = np.zeros((count, channels, bins), dtype=complex)
+        self._spectra = np.zeros((count, channels, bins), dtype=complex)
+        self._shift = np.zeros((count, channels, bins), dtype=complex)
+        self._power = np.zeros((channels, bins))
+        self._estimate = np.zeros((channels, size))
+        self._error = np.zeros((channels, 2 * size))
+        self._frame = np.zeros((channels, 2 * size))
+        self._error_spectrum = np.zeros((channels, bins), dtype=complex)
+        self._gradient = np.zeros((channels, bins), dtype=complex)
+        self._update = np.zeros((channels, bins), dtype=complex)
+        self._scratch = np.zeros((channels, bins))
+        self._fill = 0
+        self._constrain_next = 0
+        self.blocks_adapted = 0
+
+        # Speaker history, oldest first, starting with silence. _start is
+        # the stream position of its first sample; it's compacted in place
+        # when full, which never overlaps since it's twice the live span.
+        span = self.delay + 2 * size + self.blocksize
+        self._history = np.zeros((channels, 2 * span))
+        self._keep = self.delay + size
+        self._start = -self._keep
+        self._length = self._keep
+        self._position = 0
+
+    def push(self, output):
+        # Record what was sent to the speaker for the block just cancelled,
+        # mono or (channels, frames)
+        frames = output.shape[-1]
+        if self._length + frames > self._history.shape[1]:
+            keep = self._keep
+            for row in self._history:
+                row[:keep] = row[self._length - keep:self._length]
+            self._start += self._length - keep
+            self._length = keep
+        self._history[:, self._length:self._length + frames] = output
+        self._length += frames
+
+    def _begin_partition(self):
+        # Spectrum of the reference two partitions long ending `delay`
+        # samples before the partition starts, then the feedback estimate
+        size = self.partition_size
+        end = self._position - self.delay + size - self._start
+        np.copyto(self._shift[:-1], self._spectra[:-1])
+        self._spectra[1:] = self._shift[:-1]
+        np.fft.rfft(self._history[:, end - 2 * size:end], axis=-1, out=self._spectra[0])
+
+        np.abs(self._spectra[0], out=self._scratch)
+        self._scratch *= self._scratch
+        self._power *= self.power_smoothing
+        self._scratch *= 1 - self.power_smoothing
+        self._power += self._scratch
+
+        np.einsum('kcf,kcf->cf', self.weights, self._spectra, out=self._update)
+        np.fft.irfft(self._update, axis=-1, out=self._frame)
+        self._estimate[:] = self._frame[:, size:]
+
+    def _adapt(self):
+        size = self.partition_size
+        self._error[:, :size] = 0
+        np.fft.rfft(self._error, axis=-1, out=self._error_spectrum)
+        # Normalized step per bin, floored per channel (row by row, as a
+        # broadcast column would be buffered)
+        for power, scratch in zip(self._power, self._scratch):
+            np.add(power, self.regularization * power.mean() + 1e-10, out=scratch)
+        # Real and imaginary parts separately: a complex / float divide
+        # casts through a temporary buffer
+        np.copyto(self._gradient, self._error_spectrum)
+        self._gradient.real /= self._scratch
+        self._gradient.imag /= self._scratch
+        self._gradient *= self.step
+        for weights, spectrum in zip(self.weights, self._spectra):
+            np.conjugate(spectrum, out=self._update)
+            self._update *= self._gradient
+            weights += self._update
+
+        # Keep one partition a linear convolution: zero its wrapped half
+        weights = self.weights[self._constrain_next]
+        np.fft.irfft(weights, axis=-1, out=self._frame)
+        self._frame[:, size:] = 0
+        np.fft.rfft(self._frame, axis=-1, out=weights)
+        self._constrain_next = (self._constrain_next + 1) % self.partitions
+        self.blocks_adapted += 1
+
+    def process(self, block, params=None):
+        # Mono blocks come back mono, (channels, frames) blocks as such
+        rows = block if block.ndim == 2 else block[None, :]
+        self.fit(rows)
+        size = self.partition_size
+        frames = rows.shape[1]
+        out = self.output(rows)
+        done = 0
+        while done < frames:
+            if self._fill == 0:
+                self._begin_partition()
+            take = min(size - self._fill, frames - done)
+            fill = self._fill
+            np.subtract(rows[:, done:done + take], self._estimate[:, fill:fill + take],
+                        out=out[:, done:done + take])
+            self._error[:, size + fill:size + fill + take] = out[:, done:done + take]
+            self._fill += take
+            self._position += take
+            done += take
+            if self._fill == size:
+                self._adapt()
+                self._fill = 0
+        return out if block.ndim == 2 else out[0]
+
+    def impulse_response(self):
+        # Current estimate of the path, starting `delay` samples back: one
+        # row per channel, or a single response for one channel
+        size = self.partition_size
+        frames = np.fft.irfft(self.weights, n=2 * size, axis=2)[:, :, :size]
+        response = frames.transpose(1, 0, 2).reshape(self.channels, -1)
+        return response[0] if self.channels == 1 else response
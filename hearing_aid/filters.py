@@ -0,0 +1,461 @@
+import numpy as np
+
+from .cache import cached_design
+from .compressor import MultibandCompressor, band_edge_limit
+from .fitting import FittingNode
+from .graph import Graph, Node
+from .kernels import lookahead_limit, sos_state, sosfilt_inplace, use_compiled, warm_up
+from .noise import NoiseReducer
+from .params import ProcessingParams
+from .resample import Resampler
+from .ringbuffer import RingBuffer
+from .vad import VoiceActivityGate
+
+
+def design_bandpass_filter(lowcut=300, highcut=5000, fs=44100, order=4):
+    # A high edge past the usable range (the 5 kHz default on 8 kHz
+    # telephone audio) is pulled down to it
+    highcut = min(highcut, band_edge_limit(fs))
+    if lowcut >= highcut:
+        raise ValueError(f"Band {lowcut}-{highcut} Hz doesn't fit at {fs} Hz")
+    return cached_design('bandpass', (float(lowcut), float(highcut), float(fs), order),
+                         lambda: _design_bandpass(lowcut, highcut, fs, order))
+
+
+def _design_bandpass(lowcut, highcut, fs, order):
+    from scipy.signal import butter
+    nyquist = 0.5 * fs
+    low = lowcut / nyquist
+    high = highcut / nyquist
+    return butter(order, [low, high], btype='band', output='sos')
+
+
+def scale(block, factor, out):
+    # out = block * factor for a scalar, a per-sample ramp, or one ramp per
+    # row (channels, frames). NumPy buffers a ramp broadcast across several
+    # channels through a temporary, so those go row by row.
+    if isinstance(factor, np.ndarray) and factor.ndim == 2:
+        for row, row_factor, out_row in zip(block, factor, out):
+            np.multiply(row, row_factor, out=out_row)
+    elif isinstance(factor, np.ndarray) and len(block) > 1:
+        for row, out_row in zip(block, out):
+            np.multiply(row, factor, out=out_row)
+    else:
+        np.multiply(block, factor, out=out)
+    return out
+
+
+class BandpassNode(Node):
+    # Fixed bandpass designed as second-order sections with carried state
+    def __init__(self, lowcut=300, highcut=5000, order=4):
+        super().__init__()
+        self.lowcut = lowcut
+        self.highcut = highcut
+        self.order = order
+
+    def design(self):
+        self.sos = design_bandpass_filter(self.lowcut, self.highcut, self.fs, self.order)
+        self.reset()
+
+    def reset(self):
+        self.zi = sos_state(self.sos, self.channels)
+
+    def process(self, block, params):
+        out = self.output(block)
+        out[:] = block
+        return sosfilt_inplace(self.sos, out, self.zi)
+
+
+class ClarityNode(BandpassNode):
+    # Blends in a boosted speech band according to params.clarity.
+    # The band filter always runs so its state stays continuous when the
+    # clarity setting moves away from zero.
+    def __init__(self, low=1000, high=3000, boost=1.5):
+        super().__init__(low, high, order=2)
+        self.boost = boost
+
+    def process(self, block, params):
+        enhanced = super().process(block, params)
+        clarity = params.clarity
+        if isinstance(clarity, np.ndarray) and clarity.ndim == 2:
+            active = clarity.max() > 0
+        elif isinstance(clarity, np.ndarray):
+            # Smoother ramps are linear, so their ends bound every sample
+            active = clarity[0] > 0 or clarity[-1] > 0
+        else:
+            active = clarity > 0
+        if active:
+            # (1-clarity) * block + clarity * boost * enhanced, in place
+            enhanced *= self.boost
+            enhanced -= block
+            scale(enhanced, clarity, enhanced)
+            enhanced += block
+        else:
+            enhanced[:] = block
+        return enhanced
+
+
+class GainNode(Node):
+    # Volume from params.gain (scalar or per-sample ramp)
+    def process(self, block, params):
+        return scale(block, params.gain, self.output(block))
+
+
+class LimiterNode(Node):
+    # Look-ahead peak limiter, so nothing leaves the chain above full scale.
+    # The signal is delayed by `lookahead`. The gain each sample needs to
+    # stay under the ceiling is held at its minimum over that window, the
+    # gain reduction recovers exponentially over `release`, and a moving
+    # average as long as the window turns the steps into ramps. Every gain
+    # in the average is at or below the delayed sample's own requirement,
+    # so peaks are caught without clipping; the hard clip behind it only
+    # catches rounding. lookahead=0 leaves just the hard clip.
+    # The compiled kernel backend runs all of this as one Numba loop; the
+    # NumPy path does the release as a running maximum in decaying units.
+
+    def __init__(self, ceiling=0.99, lookahead=0.001, release=0.05):
+        super().__init__()
+        self.ceiling = ceiling
+        self.lookahead = lookahead
+        self.release = release
+        self.length = 0
+
+    @property
+    def delay(self):
+        # Added latency, in samples at the node's rate
+        return max(self.length - 1, 0)
+
+    def design(self):
+        self.length = max(1, round(self.lookahead * self.fs)) if self.lookahead else 0
+        self._release_coef = float(np.exp(-1 / (self.release * self.fs)))
+        # Ramps for the NumPy release, in chunks short enough that the
+        # growing ramp stays far from overflow
+        chunk = max(1, min(self.blocksize, int(20 * self.release * self.fs)))
+        steps = np.arange(1, chunk + 1)
+        self._decay = self._release_coef ** steps
+        self._grow = 1 / self._decay
+        if self.length:
+            warm_up()
+        self.reset()
+
+    def reset(self):
+        self._work = np.zeros((3, self.channels, 0))
+        self._reduction = np.zeros(self.channels)
+        self._allocate(self.blocksize)
+
+    def _allocate(self, frames):
+        # Keeps the carried history of the delay line and gains; gains
+        # start at unity
+        lead = self.delay
+        work = np.ones((3, self.channels, lead + frames))
+        work[0] = 0
+        if self._work.shape[2]:
+            work[:, :, :lead] = self._work[:, :, :lead]
+        self._work = work
+        self._gains = np.zeros(frames)
+        # Scratch for the running minimum and moving average
+        self._scan = np.zeros((2, lead + frames + 1))
+
+    def _window_min(self, line, frames, out):
+        # out[i] = min(line[i:i + length]), from minima over windows of 2,
+        # 4, 8... samples and then two overlapping power-of-two windows
+        span, source = 1, line
+        while 2 * span <= self.length:
+            target = self._scan[span.bit_length() % 2]
+            n = len(line) - 2 * span + 1
+            np.minimum(source[:n], source[span:span + n], out=target[:n])
+            source, span = target, 2 * span
+        offset = self.length - span
+        np.minimum(source[:frames], source[offset:offset + frames], out=out)
+
+    def _window_mean(self, line, frames, out):
+        # out[i] = mean(line[i:i + length]) as a difference of running sums
+        sums = self._scan[0, :len(line) + 1]
+        sums[0] = 0
+        np.cumsum(line, out=sums[1:])
+        np.subtract(sums[self.length:self.length + frames], sums[:frames], out=out)
+        out /= self.length
+
+    def process(self, block, params):
+        out = self.output(block)
+        if self.length:
+            frames = block.shape[1]
+            if self._work.shape[2] < self.delay + frames:
+                self._allocate(frames)
+            if use_compiled():
+                lookahead_limit(block, self._work, self._reduction, self.ceiling,
+                                self._release_coef, self.length, out)
+            else:
+                for r in range(len(block)):
+                    self._limit(r, block[r], out[r])
+            block = out
+        np.clip(block, -self.ceiling, self.ceiling, out=out)
+        return out
+
+    def _limit(self, r, x, out):
+        # NumPy reference for kernels.lookahead_limit, one channel
+        lead, frames = self.delay, len(x)
+        delayed, required, released = self._work[:, r]
+        gains = self._gains[:frames]
+
+        delayed[lead:lead + frames] = x
+        new = required[lead:lead + frames]
+        np.abs(x, out=new)
+        np.maximum(new, self.ceiling, out=new)
+        np.divide(self.ceiling, new, out=new)
+        self._window_min(required[:lead + frames], frames, gains)
+
+        # reduction[k] = max(1 - held[k], coef * reduction[k-1]) is a running
+        # maximum once each term is divided by coef**(k+1)
+        np.subtract(1, gains, out=gains)
+        reduction = self._reduction[r]
+        for start in range(0, frames, len(self._decay)):
+            chunk = gains[start:start + len(self._decay)]
+            n = len(chunk)
+            chunk *= self._grow[:n]
+            np.maximum.accumulate(chunk, out=chunk)
+            np.maximum(chunk, reduction, out=chunk)
+            chunk *= self._decay[:n]
+            reduction = chunk[-1]
+        self._reduction[r] = reduction
+        np.subtract(1, gains, out=released[lead:lead + frames])
+
+        self._window_mean(released[:lead + frames], frames, gains)
+        np.multiply(delayed[:frames], gains, out=out)
+        for line in (delayed, required, released):
+            line[:lead] = line[frames:frames + lead]
+
+
+class FilterChain(Graph):
+    # The hearing aid chain for one audio stream:
+    # bandpass (or fitted FIR) -> noise reduction (optional) -> speech clarity
+    # -> gain -> compressor -> limiter.
+    # Coefficients are designed when the chain is built or reconfigured,
+    # never inside the audio callback, and every stage carries its state
+    # from block to block so there are no clicks at block boundaries.
+    # With internal_rate set, the stages run at that rate between a pair of
+    # streaming resamplers, e.g. 16 kHz DSP for a 48 kHz device to save CPU.
+    # Output still comes back one sample per input sample, behind a short
+    # FIFO that absorbs the resamplers' uneven block lengths.
+    # Blocks may be mono or (channels, frames), e.g. one row per ear; each
+    # channel keeps its own state, and `fitting` may be a list with one
+    # Fitting per channel.
+    # With vad set (True, or a configured VoiceActivityGate) the stages only
+    # run around speech; during silence the chain passes its input through
+    # turned down (see VoiceActivityGate).
+
+    def __init__(self, fs=44100, lowcut=300, highcut=5000,
+                 clarity_low=1000, clarity_high=3000, compression=True,
+                 fitting=None, partition_size=128, noise_reduction=False, blocksize=1024,
+                 internal_rate=None, channels=1, vad=False):
+        self.internal_rate = internal_rate
+        self._resamplers = None
+        self._ramp_index = np.zeros(0, dtype=np.int64)
+        self.lowcut = lowcut
+        self.highcut = highcut
+        self.clarity_low = clarity_low
+        self.clarity_high = clarity_high
+        # A loaded audiogram fitting replaces the fixed bandpass
+        self.fitting = fitting
+        self.partition_size = partition_size
+        # False, or a NOISE_REDUCTION_PRESETS name
+        self.noise_reduction = noise_reduction
+        # Band layout and timing are tuned through compressor.configure()
+        self.compressor = MultibandCompressor(fs) if compression else None
+        self.vad = vad
+        super().__init__(self._build_nodes(), fs, blocksize, channels)
+
+    def _build_nodes(self):
+        if self.fitting is not None:
+            front = FittingNode(self.fitting, self.partition_size)
+        else:
+            front = BandpassNode(self.lowcut, self.highcut)
+        nodes = [front]
+        if self.noise_reduction:
+            nodes.append(NoiseReducer.preset(self.noise_reduction))
+        nodes += [ClarityNode(self.clarity_low, self.clarity_high), GainNode()]
+        if self.compressor is not None:
+            # Compress after the volume gain so the limiter is only a safety net
+            nodes.append(self.compressor)
+        nodes.append(LimiterNode())
+        if isinstance(self.vad, VoiceActivityGate):
+            self.gate = self.vad
+        else:
+            self.gate = VoiceActivityGate() if self.vad else None
+        return nodes
+
+    def configure(self, **changes):
+        # Only rebuild when a band edge, the fitting or the sample rate
+        # really changed
+        changed = False
+        for name, value in changes.items():
+            if name not in ('fs', 'lowcut', 'highcut', 'clarity_low', 'clarity_high',
+                            'fitting', 'partition_size', 'noise_reduction', 'internal_rate',
+                            'vad'):
+                raise TypeError(f"Unknown filter parameter: {name}")
+            if value is not None and getattr(self, name) != value:
+                setattr(self, name, value)
+                changed = True
+        if changed:
+            self.nodes = self._build_nodes()
+            if self.compressor is not None:
+                self.compressor.reset()
+            self.prepare(self.fs, self.blocksize)
+        return changed
+
+    def key(self):
+        # Everything apart from the input and gain/clarity that decides what
+        # the chain outputs, e.g. to look up audio it rendered before
+        fitting = self.fitting
+        if isinstance(fitting, (list, tuple)):
+            fitting = tuple(ear.key() for ear in fitting)
+        elif fitting is not None:
+            fitting = fitting.key()
+        return (self.fs, self.channels, self.lowcut, self.highcut, self.clarity_low,
+                self.clarity_high, fitting, self.partition_size, self.noise_reduction,
+                self.internal_rate, self.compressor.key() if self.compressor else None,
+                bool(self.vad))
+
+    @property
+    def dsp_rate(self):
+        return self.internal_rate or self.fs
+
+    def prepare(self, fs, blocksize, channels=None):
+        self.fs = fs
+        self.blocksize = blocksize
+        if channels is not None:
+            self.channels = channels
+        rate = self.dsp_rate
+        if rate == fs:
+            self._resamplers = None
+            inner_blocksize = blocksize
+        else:
+            if self._resamplers is None or self._resamplers[0].fs_out != rate \
+                    or self._resamplers[0].fs_in != fs:
+                self._resamplers = (Resampler(fs, rate), Resampler(rate, fs))
+                self._fifo = None
+            # Resampled blocks come out a sample or two longer at times
+            inner_blocksize = -(-blocksize * rate // fs) + 2
+            if len(self._ramp_index) < inner_blocksize:
+                self._reset_ramps(inner_blocksize)
+            if self._fifo is None or self._fifo.capacity < 4 * blocksize \
+                    or self._fifo.channels != self.channels:
+                self._reset_fifo(blocksize)
+        for node in self.nodes:
+            node.prepare(rate, inner_blocksize, self.channels)
+        if self.gate is not None:
+            self.gate.prepare(rate, inner_blocksize, self.channels, self.delay)
+
+    @property
+    def delay(self):
+        # Samples at the DSP rate that noise reduction and the limiter's
+        # look-ahead hold the signal back
+        return sum(node.latency if isinstance(node, NoiseReducer) else node.delay
+                   for node in self.nodes if isinstance(node, (NoiseReducer, LimiterNode)))
+
+    def process_nodes(self, rows, params):
+        gate = self.gate
+        if gate is None:
+            return super().process_nodes(rows, params)
+        mode = gate.update(rows)
+        if gate.onset:
+            # Bring the stages up to date before they're heard again
+            settled = ProcessingParams(*(value[..., -1:] if isinstance(value, np.ndarray)
+                                         else value for value in params))
+            for recent in gate.recent_blocks():
+                super().process_nodes(recent, settled)
+        bypassed = gate.bypass(rows, params.gain)
+        if mode == gate.BYPASS:
+            return bypassed
+        processed = super().process_nodes(rows, params)
+        if mode == gate.FULL:
+            return processed
+        return gate.blend(processed, bypassed)
+
+    def _reset_fifo(self, blocksize):
+        channels = self.channels
+        self._fifo = RingBuffer(4 * blocksize + self._fifo_lead(), channels, dtype=float)
+        self._fifo.write(np.zeros((self._fifo_lead(), channels)))
+        self._fifo_out = np.zeros(channels * blocksize)
+
+    def _fifo_lead(self):
+        # Enough queued output that a short resampled block never leaves
+        # the FIFO empty
+        return 2 * -(-self.fs // self.dsp_rate) + 2
+
+    @property
+    def resampling_latency(self):
+        # Extra delay from running at internal_rate, in samples at fs
+        if self._resamplers is None:
+            return 0
+        to_dsp, from_dsp = self._resamplers
+        return to_dsp.delay * self.fs / self.dsp_rate + from_dsp.delay + self._fifo_lead()
+
+    def reset(self):
+        super().reset()
+        if self.gate is not None:
+            self.gate.reset()
+        if self._resamplers is not None:
+            for resampler in self._resamplers:
+                resampler.reset()
+            self._reset_fifo(self.blocksize)
+
+    def run(self, block, params):
+        if self._resamplers is None:
+            return super().run(block, params)
+        rows = block if block.ndim == 2 else block[None, :]
+        channels, frames = rows.shape
+        if frames > self.blocksize or channels != self.channels:
+            self.prepare(self.fs, max(frames, self.blocksize), channels)
+        to_dsp, from_dsp = self._resamplers
+        inner = to_dsp.process(rows)
+        inner_params = self._resample_params(params, frames, inner.shape[1])
+        inner = self.process_nodes(inner, inner_params)
+        self._fifo.write(from_dsp.process(inner).T)
+        out = self._fifo_out[:channels * frames].reshape(channels, frames)
+        self._fifo.read(frames, out=out.T)
+        return out if block.ndim == 2 else out[0]
+
+    def _resample_params(self, params, frames, inner_frames):
+        # Per-sample ramps are picked at the internal rate's sample times,
+        # into buffers kept from block to block
+        if not any(isinstance(value, np.ndarray) for value in params):
+            return params
+        if len(self._ramp_index) < inner_frames:
+            self._reset_ramps(inner_frames)
+        index = self._ramp_index[:inner_frames]
+        np.multiply(self._ramp_counter[:inner_frames], frames, out=index)
+        np.floor_divide(index, max(inner_frames, 1), out=index)
+        index -= 1
+        picked = []
+        for i, value in enumerate(params):
+            if isinstance(value, np.ndarray):
+                shape = value.shape[:-1] + (len(self._ramp_index),)
+                ramp = self._ramps.get(i)
+                if ramp is None or ramp.shape != shape:
+                    ramp = self._ramps[i] = np.zeros(shape)
+                value = np.take(value, index, axis=-1, out=ramp[..., :inner_frames],
+                                mode='clip')
+            picked.append(value)
+        return ProcessingParams(*picked)
+
+    def _reset_ramps(self, frames):
+        # Sized in prepare for the longest resampled block, so they don't
+        # grow in a callback when a block comes out a sample longer
+        self._ramp_counter = np.arange(1, frames + 1)
+        self._ramp_index = np.zeros(frames, dtype=np.int64)
+        self._ramps = {}
+
+    def plan(self, blocksize, partition_size=None):
+        # Re-plan for a callback size: FIR partitions follow the block so a
+        # callback runs whole partitions (64 to 512 samples), and every
+        # buffer is sized now rather than in the first callback
+        if partition_size is None:
+            partition_size = min(max(blocksize, 64), 512)
+        self.configure(partition_size=partition_size)
+        self.prepare(self.fs, blocksize)
+
+    def process(self, audio_in, gain, clarity):
+        # gain and clarity may be scalars or per-sample ramps. The result is
+        # a view of the limiter's buffer, overwritten by the next call.
+        return self.run(audio_in, ProcessingParams(gain, clarity))
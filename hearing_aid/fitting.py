@@ -0,0 +1,238 @@
+import json
+
+import numpy as np
+
+from .cache import cached_design
+from .graph import Node
+
+# NAL-R frequency corrections (dB) from Byrne & Dillon (1986)
+NAL_R_CORRECTIONS = {250: -17, 500: -8, 750: -3, 1000: 1, 1500: 1, 2000: -1,
+                     3000: -2, 4000: -2, 6000: -2, 8000: -2}
+
+
+def interp_log_frequency(freq, table):
+    # Linear interpolation on a log-frequency axis, edges held
+    freqs = sorted(table)
+    return np.interp(np.log(freq), np.log(freqs), [table[f] for f in freqs])
+
+
+def half_gain(audiogram):
+    return {freq: 0.5 * loss for freq, loss in audiogram.items()}
+
+
+def nal_r(audiogram):
+    # Three-frequency average uses 500, 1000 and 2000 Hz, interpolated if missing
+    x = 0.05 * sum(interp_log_frequency(f, audiogram) for f in (500, 1000, 2000))
+    return {freq: max(0.0, x + 0.31 * loss + interp_log_frequency(freq, NAL_R_CORRECTIONS))
+            for freq, loss in audiogram.items()}
+
+
+FITTING_RULES = {'half-gain': half_gain, 'nal-r': nal_r}
+
+# numpy.fft takes out= from NumPy 2.0; older versions allocate each FFT
+FFT_OUT = np.lib.NumpyVersion(np.__version__) >= '2.0.0'
+
+
+class Fitting:
+    # Prescription for one ear: an audiogram (dB HL per frequency) plus the
+    # rule and FIR settings used to turn it into a filter. The FIR itself is
+    # designed per sample rate by design().
+
+    def __init__(self, audiogram, rule='nal-r', numtaps=255, phase='minimum', max_gain_db=40.0):
+        if rule not in FITTING_RULES:
+            raise ValueError(f"Unknown fitting rule: {rule}")
+        if phase not in ('linear', 'minimum'):
+            raise ValueError(f"Unknown filter phase: {phase}")
+        self.audiogram = {float(freq): float(loss) for freq, loss in audiogram.items()}
+        self.rule = rule
+        self.numtaps = numtaps | 1  # odd length so the Nyquist gain is free
+        self.phase = phase
+        self.max_gain_db = max_gain_db
+
+    def target_gains(self):
+        gains = FITTING_RULES[self.rule](self.audiogram)
+        freqs = sorted(gains)
+        return np.array(freqs), np.minimum([gains[f] for f in freqs], self.max_gain_db)
+
+    def key(self):
+        # Everything the design depends on apart from the sample rate
+        return (tuple(sorted(self.audiogram.items())), self.rule, self.numtaps, self.phase,
+                float(self.max_gain_db))
+
+    def design(self, fs):
+        return cached_design('fitting', self.key() + (float(fs),), lambda: self._design(fs))
+
+    def _design(self, fs):
+        from scipy.signal import firwin2, minimum_phase
+        freqs, gains_db = self.target_gains()
+
+        # Dense log-spaced grid so firwin2's linear interpolation follows
+        # the audiogram's octave spacing; edge gains are held to DC/Nyquist
+        nyquist = fs / 2
+        grid = np.geomspace(min(freqs[0], 100), nyquist, 64)
+        grid_gains = np.interp(np.log(grid), np.log(freqs), gains_db)
+        grid = np.concatenate([[0], grid[:-1], [nyquist]])
+        grid_gains = np.concatenate([[grid_gains[0]], grid_gains])
+
+        if self.phase == 'linear':
+            return firwin2(self.numtaps, grid, 10 ** (grid_gains / 20), fs=fs)
+
+        # minimum_phase() halves the length and takes the square root of the
+        # magnitude, so start from twice the taps and twice the gain in dB
+        prototype = firwin2(2 * self.numtaps - 1, grid, 10 ** (grid_gains / 10), fs=fs)
+        return minimum_phase(prototype, method='homomorphic')
+
+
+def load_fitting(filename):
+    # JSON: either {"250": 20, "500": 30, ...} or
+    # {"audiogram": {...}, "rule": "half-gain", "numtaps": 255, "phase": "linear"},
+    # or a list of those, one per channel (e.g. [left, right]), which
+    # loads as a list of Fittings
+    with open(filename) as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        return [fitting_from_json(ear) for ear in data]
+    return fitting_from_json(data)
+
+
+def fitting_from_json(data):
+    if 'audiogram' not in data:
+        data = {'audiogram': data}
+    return Fitting(**data)
+
+
+def channel_fittings(fitting, channels):
+    # One Fitting per channel from a single Fitting or a per-channel list
+    fittings = list(fitting) if isinstance(fitting, (list, tuple)) else [fitting]
+    if len(fittings) == 1:
+        return fittings * channels
+    if len(fittings) != channels:
+        raise ValueError(f"{len(fittings)} fittings for {channels} channels")
+    return fittings
+
+
+class PartitionedConvolver:
+    # Streaming FIR via uniformly partitioned overlap-save.
+    # The filter is cut into partitions of partition_size taps whose spectra
+    # multiply a delay line of past input spectra, so a long FIR costs a few
+    # small FFTs per partition and adds no latency beyond its own delay.
+    # Blocks that end mid-partition are computed with the missing samples as
+    # zeros and recomputed once the partition fills, so any block size works.
+    # The delay line is a ring (newest spectrum first, wrapping), and with
+    # NumPy 2's out= FFTs a block is filtered without allocating.
+    # taps may be one FIR or one per channel (channels, taps); audio is then
+    # (channels, frames) and every channel runs through the same FFTs.
+
+    def __init__(self, taps, partition_size=128):
+        self.partition_size = size = partition_size
+        taps = np.atleast_2d(taps)
+        channels = len(taps)
+        count = -(-taps.shape[1] // size)
+        padded = np.zeros((channels, count * size))
+        padded[:, :taps.shape[1]] = taps
+        # (partitions, channels, bins), so each partition is contiguous
+        spectra = np.fft.rfft(padded.reshape(channels, count, size), n=2 * size, axis=2)
+        self.spectra = np.ascontiguousarray(spectra.transpose(1, 0, 2))
+        self.channels = channels
+        self.reset()
+
+    def reset(self):
+        size, channels = self.partition_size, self.channels
+        bins = size + 1
+        self._input = np.zeros((channels, 2 * size))
+        self._fill = 0
+        self._delay_line = np.zeros((len(self.spectra) - 1, channels, bins), dtype=complex)
+        self._head = 0
+        self._history = np.zeros((channels, bins), dtype=complex)
+        self._spectrum = np.zeros((channels, bins), dtype=complex)
+        self._product = np.zeros((channels, bins), dtype=complex)
+        self._older = np.zeros((channels, bins), dtype=complex)
+        self._output = np.zeros((channels, 2 * size))
+
+    def _rfft(self, audio, out):
+        if FFT_OUT:
+            return np.fft.rfft(audio, axis=-1, out=out)
+        out[:] = np.fft.rfft(audio, axis=-1)
+        return out
+
+    def _irfft(self, spectrum, out):
+        if FFT_OUT:
+            return np.fft.irfft(spectrum, axis=-1, out=out)
+        out[:] = np.fft.irfft(spectrum, axis=-1)
+        return out
+
+    def _update_history(self):
+        # History for the next partition: spectra[k] times the input
+        # spectrum k-1 partitions old, for k >= 1. Ring slot head holds the
+        # newest spectrum and older ones follow it, so that's two einsums
+        # over contiguous runs.
+        head = self._head
+        wrap = len(self._delay_line) - head
+        np.einsum('kcf,kcf->cf', self.spectra[1:1 + wrap], self._delay_line[head:],
+                  out=self._history)
+        if head:
+            np.einsum('kcf,kcf->cf', self.spectra[1 + wrap:], self._delay_line[:head],
+                      out=self._older)
+            self._history += self._older
+
+    def process(self, audio_in, out=None):
+        # Mono audio for a one-channel filter comes back mono
+        rows = audio_in if audio_in.ndim == 2 else audio_in[None, :]
+        if len(rows) != self.channels:
+            raise ValueError(f"{len(rows)} channels for a {self.channels}-channel filter")
+        size = self.partition_size
+        frames = rows.shape[1]
+        if out is None:
+            out = np.empty(audio_in.shape)
+        out_rows = out if out.ndim == 2 else out[None, :]
+        done = 0
+        while done < frames:
+            fill = self._fill
+            take = min(size - fill, frames - done)
+            self._input[:, size + fill:size + fill + take] = rows[:, done:done + take]
+
+            spectrum = self._rfft(self._input, self._spectrum)
+            np.multiply(self.spectra[0], spectrum, out=self._product)
+            self._product += self._history
+            partition = self._irfft(self._product, self._output)
+            out_rows[:, done:done + take] = partition[:, size + fill:size + fill + take]
+            self._fill += take
+            done += take
+
+            if self._fill == size:
+                # Partition complete: push it into the delay line and
+                # precompute the older partitions' share of the next one
+                # Row by row: NumPy copies a shift within a 2-D array first
+                for row in self._input:
+                    row[:size] = row[size:]
+                self._input[:, size:] = 0
+                self._fill = 0
+                if len(self._delay_line):
+                    self._head = (self._head - 1) % len(self._delay_line)
+                    self._delay_line[self._head] = spectrum
+                    self._update_history()
+        return out
+
+
+class FittingNode(Node):
+    # Graph stage applying a Fitting's FIR for the graph's sample rate.
+    # fitting may be a list with one Fitting per channel (e.g. left and
+    # right ear); FIRs of different lengths are zero-padded to the longest.
+    def __init__(self, fitting, partition_size=128):
+        super().__init__()
+        self.fitting = fitting
+        self.partition_size = partition_size
+
+    def design(self):
+        designs = [fitting.design(self.fs)
+                   for fitting in channel_fittings(self.fitting, self.channels)]
+        taps = np.zeros((len(designs), max(len(d) for d in designs)))
+        for row, design in zip(taps, designs):
+            row[:len(design)] = design
+        self.convolver = PartitionedConvolver(taps, self.partition_size)
+
+    def reset(self):
+        self.convolver.reset()
+
+    def process(self, block, params):
+        return self.convolver.process(block, out=self.output(block))
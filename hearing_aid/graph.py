@@ -0,0 +1,124 @@
+import numpy as np
+
+
+class Node:
+    # One stage of a processing graph.
+    # Blocks are (channels, frames): each channel is a contiguous row with
+    # its own filter state, and every stage works on all rows at once.
+    # prepare() is called whenever the graph's sample rate, block size or
+    # channel count changes: it sizes the node's output buffer once and
+    # redesigns any coefficients, so process() only ever writes into memory
+    # it already owns. process() returns a view of that buffer, valid until
+    # the next call.
+
+    def __init__(self):
+        self.fs = None
+        self.channels = 1
+        self.blocksize = 0
+        self.out = np.zeros(0)
+
+    def prepare(self, fs, blocksize, channels=1):
+        self.blocksize = max(self.blocksize, blocksize)
+        if len(self.out) < self.blocksize * channels:
+            self.out = np.zeros(self.blocksize * channels)
+        if fs != self.fs or channels != self.channels:
+            self.fs = fs
+            self.channels = channels
+            self.design()
+
+    def fit(self, block):
+        # For nodes used on their own: grow for a block the node wasn't
+        # prepared for. Inside a graph, Graph.run has already done this.
+        channels, frames = block.shape
+        if frames > self.blocksize or channels != self.channels:
+            self.prepare(self.fs, frames, channels)
+
+    def output(self, block):
+        # Contiguous (channels, frames) view of the output buffer
+        return self.out[:block.size].reshape(block.shape)
+
+    def design(self):
+        # Build coefficients for self.fs and self.channels; must leave the
+        # node reset
+        self.reset()
+
+    def reset(self):
+        pass
+
+    def process(self, block, params):
+        raise NotImplementedError
+
+
+class Graph:
+    # A linear chain of nodes: source -> nodes -> sink.
+    # The source is whatever block the caller passes in, mono (frames,) or
+    # (channels, frames), or a callback's indata via run_callback, and the
+    # sink writes the result into the output buffer.
+
+    def __init__(self, nodes, fs=44100, blocksize=1024, channels=1):
+        self.nodes = list(nodes)
+        self.fs = fs
+        self.blocksize = blocksize
+        self.channels = channels
+        self._source = np.zeros(0)
+        self.prepare(fs, blocksize, channels)
+
+    def prepare(self, fs, blocksize, channels=None):
+        self.fs = fs
+        self.blocksize = blocksize
+        if channels is not None:
+            self.channels = channels
+        if len(self._source) < blocksize * self.channels:
+            self._source = np.zeros(blocksize * self.channels)
+        for node in self.nodes:
+            node.prepare(fs, blocksize, self.channels)
+
+    def reset(self):
+        for node in self.nodes:
+            node.reset()
+
+    def find(self, node_type):
+        for node in self.nodes:
+            if isinstance(node, node_type):
+                return node
+        return None
+
+    def run(self, block, params):
+        # Mono blocks come back mono, (channels, frames) blocks as such
+        rows = block if block.ndim == 2 else block[None, :]
+        channels, frames = rows.shape
+        if frames > self.blocksize or channels != self.channels:
+            # Grow the buffers once; later blocks of this size reuse them
+            self.prepare(self.fs, max(frames, self.blocksize), channels)
+        rows = self.process_nodes(rows, params)
+        return rows if block.ndim == 2 else rows[0]
+
+    def process_nodes(self, rows, params):
+        for node in self.nodes:
+            rows = node.process(rows, params)
+        return rows
+
+    def read_input(self, indata, frames):
+        # A callback's (frames, channels) indata as a (channels, frames) block
+        channels = indata.shape[1]
+        if len(self._source) < channels * frames:
+            self._source = np.zeros(channels * frames)
+        source = self._source[:channels * frames].reshape(channels, frames)
+        source[:] = indata[:frames].T
+        return source
+
+    def run_callback(self, indata, outdata, frames, params):
+        processed = self.run(self.read_input(indata, frames), params)
+        write_output(outdata, processed)
+
+
+def write_output(outdata, processed):
+    # Copy a (channels, frames) block into a (frames, channels) output
+    # buffer, padding with silence. Mono blocks go to every channel.
+    rows = processed if processed.ndim == 2 else processed[None, :]
+    frames = rows.shape[1]
+    if len(rows) == 1:
+        outdata[:frames] = rows[0][:, None]
+    else:
+        outdata[:frames] = rows.T
+    outdata[frames:] = 0
@@ -0,0 +1,212 @@
+import functools
+import importlib.util
+import warnings
+
+import numpy as np
+
+# scipy.signal takes most of a second to import, so it's loaded the first
+# time a filter is set up rather than with this module
+_sosfilt = None
+_sosfilt_public = None
+# SciPy releases (from, up to but not including) whose private in-place
+# sosfilt kernel is used; outside them the public sosfilt is
+SOSFILT_KERNEL_SCIPY = ((1, 4), (2, 0))
+
+# Sample-by-sample loops are compiled with Numba when it's installed. The
+# machine code is cached on disk next to this module, so only the first run
+# after an install or upgrade pays for compiling. Without Numba the same
+# loops still run, interpreted, which is only useful for checking them.
+COMPILED = importlib.util.find_spec('numba') is not None
+BACKENDS = ('numpy', 'compiled')
+_backend = 'compiled' if COMPILED else 'numpy'
+_warmed_up = False
+
+
+def jit(function):
+    # Compiled on first call (or by warm_up()), so importing this module
+    # doesn't import Numba
+    compiled = None
+
+    @functools.wraps(function)
+    def kernel(*args):
+        nonlocal compiled
+        if compiled is None:
+            compiled = _compile(function)
+        return compiled(*args)
+    return kernel
+
+
+def _compile(function):
+    if not COMPILED:
+        return function
+    import numba
+    # nogil so kernels on several worker threads run in parallel
+    return numba.njit(cache=True, nogil=True)(function)
+
+
+def backend():
+    return _backend
+
+
+def set_backend(name):
+    # 'compiled' for the Numba loops, 'numpy' for the vectorized reference
+    # implementations. Results agree to rounding; nodes check the backend
+    # on every block, so this may be switched between blocks.
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown kernel backend: {name}")
+    _backend = name
+
+
+def use_compiled():
+    return _backend == 'compiled'
+
+
+def warm_up():
+    # Compile (or load from the cache) every kernel once, so the first
+    # audio callback doesn't
+    global _warmed_up
+    if _warmed_up or not COMPILED:
+        return
+    bands = np.zeros((1, 4))
+    row = np.zeros(1)
+    follow_envelope(bands, 2, row, row, row, row, row, np.zeros((1, 2)))
+    work = np.zeros((3, 1, 5))
+    lookahead_limit(bands, work, row, 0.99, 0.5, 2, np.zeros((1, 4)))
+    _warmed_up = True
+
+
+def _load_sosfilt():
+    global _sosfilt, _sosfilt_public
+    import scipy
+    from scipy.signal import sosfilt
+    _sosfilt_public = sosfilt
+    _sosfilt = _sosfilt_kernel(scipy.__version__)
+    if _sosfilt is None:
+        warnings.warn(f"SciPy {scipy.__version__} has no usable in-place sosfilt kernel; "
+                      "the IIR stages fall back to scipy.signal.sosfilt, which allocates "
+                      "on every block", RuntimeWarning, stacklevel=3)
+
+
+def _sosfilt_kernel(version):
+    # The kernel behind scipy.signal.sosfilt. It filters x and zi in place
+    # where the public function copies both on every call. It's private,
+    # so it's only used in the SciPy releases above, and only if it gives
+    # the public function's output and state on a test block.
+    try:
+        release = tuple(int(part) for part in version.split('.')[:2])
+    except ValueError:
+        return None
+    low, high = SOSFILT_KERNEL_SCIPY
+    if not low <= release < high:
+        return None
+    try:
+        from scipy.signal._sosfilt import _sosfilt as kernel
+    except ImportError:
+        return None
+    sos = np.array([[0.2, 0.3, 0.1, 1.0, -0.5, 0.2], [1.0, -0.4, 0.3, 1.0, 0.1, -0.3]])
+    rows = np.linspace(-1.0, 1.0, 32)[None, :]
+    expected, state = _sosfilt_public(sos, rows, zi=np.full((2, 1, 2), 0.1))
+    zi = np.full((1, 2, 2), 0.1)
+    try:
+        kernel(sos, rows, zi)
+    except (TypeError, ValueError):
+        return None
+    if not (np.allclose(rows, expected) and np.allclose(zi, state.transpose(1, 0, 2))):
+        return None
+    return kernel
+
+
+def sosfilt_in_place():
+    # Whether sosfilt_inplace() runs without allocating
+    if _sosfilt_public is None:
+        _load_sosfilt()
+    return _sosfilt is not None
+
+
+def sos_state(sos, channels=1):
+    # Filter state in the layout sosfilt_inplace() expects. Loads scipy's
+    # filter here, while a chain is being set up, so the first block
+    # doesn't.
+    if _sosfilt_public is None:
+        _load_sosfilt()
+    return np.zeros((channels, sos.shape[0], 2))
+
+
+def sosfilt_inplace(sos, x, zi):
+    # Filter a float64 block in place along its last axis, carrying zi
+    # (from sos_state()). x is one channel (frames,) or several
+    # (channels, frames), each row filtered with its own state. No
+    # allocation when scipy's kernel is usable (see _sosfilt_kernel);
+    # falls back to the public sosfilt, which allocates, with a warning
+    # when it isn't.
+    if _sosfilt_public is None:
+        _load_sosfilt()
+    rows = x if x.ndim == 2 else x[None, :]
+    if _sosfilt is not None and rows.flags.c_contiguous:
+        _sosfilt(sos, rows, zi)
+    else:
+        filtered, state = _sosfilt_public(sos, rows, zi=zi.transpose(1, 0, 2))
+        rows[:] = filtered
+        zi[:] = state.transpose(1, 0, 2)
+    return x
+
+
+@jit
+def follow_envelope(bands, hop, envelope, attack_coef, attack_rest,
+                    release_coef, release_rest, levels):
+    # Compressor detector: the peak of each row of bands over
+    # each hop feeds an attack/release follower. envelope carries the
+    # follower between blocks; levels (rows, hops) gets its value after
+    # every hop. Same arithmetic as MultibandCompressor's NumPy path.
+    rows, frames = bands.shape
+    hops = (frames + hop - 1) // hop
+    for r in range(rows):
+        level = envelope[r]
+        for k in range(hops):
+            peak = 0.0
+            for i in range(k * hop, min((k + 1) * hop, frames)):
+                value = abs(bands[r, i])
+                if value > peak:
+                    peak = value
+            if peak > level:
+                level = attack_rest[r] * peak + attack_coef[r] * level
+            else:
+                level = release_rest[r] * peak + release_coef[r] * level
+            levels[r, k] = level
+        envelope[r] = level
+
+
+@jit
+def lookahead_limit(block, work, reduction, ceiling, release, length, out):
+    # Look-ahead limiter, one row per channel; see LimiterNode for the
+    # method. work is (3, channels, length - 1 + frames): the delayed
+    # input, the required gains and the released gains, each with the
+    # previous block's last length - 1 samples in front. reduction carries
+    # the released gain reduction between blocks.
+    rows, frames = block.shape
+    lead = length - 1
+    for r in range(rows):
+        delayed = work[0, r]
+        required = work[1, r]
+        released = work[2, r]
+        d = reduction[r]
+        for i in range(frames):
+            x = block[r, i]
+            delayed[lead + i] = x
+            required[lead + i] = ceiling / max(abs(x), ceiling)
+            held = required[i]
+            for j in range(i + 1, i + length):
+                if required[j] < held:
+                    held = required[j]
+            d = max(1.0 - held, release * d)
+            released[lead + i] = 1.0 - d
+            gain = 0.0
+            for j in range(i, i + length):
+                gain += released[j]
+            out[r, i] = delayed[i] * (gain / length)
+        reduction[r] = d
+        for j in range(lead):
+            delayed[j] = delayed[frames + j]
+            required[j] = required[frames + j]
+            released[j] = released[frames + j]
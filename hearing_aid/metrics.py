@@ -0,0 +1,136 @@
+import bisect
+import csv
+import json
+
+import numpy as np
+
+# sounddevice.CallbackFlags attributes that mean audio was lost or repeated
+XRUN_FLAGS = ('input_underflow', 'input_overflow', 'output_underflow', 'output_overflow')
+
+
+class CallbackMetrics:
+    # Timing telemetry for one audio stream.
+    # The audio callback is the only writer: it bumps a fixed histogram bin
+    # and a few counters per block, with no locks and no allocation. Readers
+    # (GUI, exporters) take whatever values are current; a reading that is
+    # one callback stale is fine for monitoring.
+
+    # Log-spaced processing-time bins from 1 us to 1 s
+    BIN_EDGES = np.geomspace(1e-6, 1.0, 121)
+
+    def __init__(self, name, fs, blocksize):
+        self.name = name
+        self.fs = fs
+        self.blocksize = blocksize
+        self._edges = self.BIN_EDGES.tolist()
+        self.counts = np.zeros(len(self._edges) + 1, dtype=np.int64)
+        self.callbacks = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.overruns = 0
+        self.xruns = dict.fromkeys(XRUN_FLAGS, 0)
+        self.latency = None
+        # The chain's VoiceActivityGate, if it has one
+        self.gate = None
+        # Prefetch RingBuffer of a playback session, if it has one, and the
+        # callbacks that found it short
+        self.buffer = None
+        self.buffer_underruns = 0
+
+    @property
+    def budget(self):
+        # Time available per block before the device runs dry
+        return self.blocksize / self.fs
+
+    def set_stream(self, stream):
+        # Device latency as reported by PortAudio: a float, or an
+        # (input, output) pair for full-duplex streams
+        self.latency = stream.latency
+
+    def record(self, elapsed, frames, status=None):
+        self.counts[bisect.bisect_left(self._edges, elapsed)] += 1
+        self.callbacks += 1
+        self.total_time += elapsed
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+        if elapsed > frames / self.fs:
+            self.overruns += 1
+        if status:
+            for flag in XRUN_FLAGS:
+                if getattr(status, flag, False):
+                    self.xruns[flag] += 1
+
+    def percentile(self, q):
+        # Upper edge of the bin containing the q-th percentile
+        counts = self.counts.copy()
+        total = counts.sum()
+        if total == 0:
+            return 0.0
+        index = int(np.searchsorted(np.cumsum(counts), q / 100 * total))
+        return self._edges[min(index, len(self._edges) - 1)]
+
+    @property
+    def total_latency(self):
+        if self.latency is None:
+            return None
+        if isinstance(self.latency, (tuple, list)):
+            return sum(self.latency)
+        return self.latency
+
+    def summary(self):
+        budget = self.budget
+        p99 = self.percentile(99)
+        return {
+            'name': self.name,
+            'samplerate': self.fs,
+            'blocksize': self.blocksize,
+            'callbacks': self.callbacks,
+            'budget_ms': budget * 1e3,
+            'mean_ms': self.total_time / self.callbacks * 1e3 if self.callbacks else 0.0,
+            'p50_ms': self.percentile(50) * 1e3,
+            'p99_ms': p99 * 1e3,
+            'max_ms': self.max_time * 1e3,
+            'p99_utilization': p99 / budget,
+            'overruns': self.overruns,
+            'xruns': sum(self.xruns.values()),
+            **self.xruns,
+            'latency_ms': self.total_latency * 1e3 if self.latency is not None else None,
+            'skipped_fraction': self.gate.skip_fraction if self.gate is not None else None,
+            'buffer_fill': self.buffer.fill_level if self.buffer is not None else None,
+            'buffer_underruns': self.buffer_underruns if self.buffer is not None else None,
+        }
+
+    def status_line(self):
+        s = self.summary()
+        line = (f"p99 {s['p99_ms']:.2f} ms of {s['budget_ms']:.1f} ms "
+                f"({s['p99_utilization']:.0%}), {s['xruns']} xruns")
+        if s['latency_ms'] is not None:
+            line += f", latency {s['latency_ms']:.0f} ms"
+        if s['skipped_fraction'] is not None:
+            line += f", {s['skipped_fraction']:.0%} skipped as silence"
+        if s['buffer_fill'] is not None:
+            line += f", buffer {s['buffer_fill']:.0%} full, {s['buffer_underruns']} underruns"
+        return line
+
+    def to_dict(self):
+        data = self.summary()
+        data['histogram'] = {
+            'bin_upper_s': self._edges + [None],
+            'counts': self.counts.tolist(),
+        }
+        data['latency'] = self.latency
+        return data
+
+
+def export_metrics(filename, metrics):
+    # JSON keeps the full histograms; CSV has one summary row per stream
+    if filename.lower().endswith('.json'):
+        with open(filename, 'w') as f:
+            json.dump([m.to_dict() for m in metrics], f, indent=2)
+        return
+
+    rows = [m.summary() for m in metrics]
+    with open(filename, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]) if rows else [])
+        writer.writeheader()
+        writer.writerows(rows)
@@ -0,0 +1,82 @@
+from collections import namedtuple
+
+import numpy as np
+
+ProcessingParams = namedtuple('ProcessingParams', ['gain', 'clarity'])
+
+
+class ParameterStore:
+    # Hand-off point between the GUI and the audio thread.
+    # The GUI replaces the snapshot with a new immutable tuple and the audio
+    # thread only ever reads the reference, so neither side takes a lock and
+    # the audio thread never calls into Tcl.
+
+    def __init__(self, gain=2.0, clarity=0.7):
+        self._snapshot = ProcessingParams(gain, clarity)
+
+    def snapshot(self):
+        return self._snapshot
+
+    def update(self, **changes):
+        # Single writer (the Tk thread), so read-modify-write is safe
+        self._snapshot = self._snapshot._replace(**changes)
+
+    def trace(self, name, variable):
+        # Mirror a Tk variable into the store on every write
+        from tkinter import TclError
+
+        def on_write(*args):
+            try:
+                value = float(variable.get())
+            except (TclError, ValueError):
+                # Entry widgets can hold half-typed values
+                return
+            self.update(**{name: value})
+
+        variable.trace_add('write', on_write)
+        on_write()
+
+
+class ParameterSmoother:
+    # Audio-thread side of a ParameterStore.
+    # Ramps linearly towards the latest snapshot over ramp_time seconds so
+    # slider moves don't cause zipper noise. Returns plain floats once the
+    # ramp has settled and per-sample arrays while it is moving; the arrays
+    # are reused from block to block, so they're only valid until the next
+    # call.
+
+    def __init__(self, store, fs=44100, ramp_time=0.02):
+        self.store = store
+        self.ramp_samples = max(1, int(fs * ramp_time))
+        self._target = store.snapshot()
+        self._current = self._target
+        self._remaining = 0
+        self._counter = np.zeros(0)
+        self._steps = np.zeros(0)
+        self._ramps = np.zeros((len(self._target), 0))
+
+    def next_block(self, frames):
+        target = self.store.snapshot()
+        if target is not self._target:
+            self._target = target
+            self._remaining = self.ramp_samples
+        if self._remaining <= 0:
+            self._current = target
+            return target
+
+        if len(self._counter) < frames:
+            self._counter = np.arange(1, frames + 1, dtype=float)
+            self._steps = np.zeros(frames)
+            self._ramps = np.zeros((len(target), frames))
+
+        # Fraction of the way to the target at every sample of this block
+        steps = self._steps[:frames]
+        np.minimum(self._counter[:frames], self._remaining, out=steps)
+        steps /= self._remaining
+        ramps = self._ramps[:, :frames]
+        for ramp, cur, tgt in zip(ramps, self._current, target):
+            np.multiply(steps, tgt - cur, out=ramp)
+            ramp += cur
+        self._current = ProcessingParams(*(float(ramp[-1]) for ramp in ramps))
+        self._remaining -= frames
+        return ProcessingParams(*ramps)
@@ -0,0 +1,95 @@
+import threading
+import time
+
+from .metrics import CallbackMetrics
+from .ringbuffer import RingBuffer
+from .wavio import WavWriter
+
+
+class StreamingRecorder:
+    # Records from the input device straight to a WAV file.
+    # The audio callback copies each block into a preallocated ring buffer
+    # and a writer thread drains it to disk, so recordings have no length
+    # limit and memory use is capped at buffer_seconds of audio. With
+    # normalize, stop() rescales the finished file so its peak is full
+    # scale. The callback's timing and the device's overflow flags go to
+    # `metrics`.
+    name = 'record'
+
+    def __init__(self, filename, fs=44100, channels=1, buffer_seconds=5, poll_interval=0.05,
+                 backend=None, blocksize=1024, normalize=True):
+        if backend is None:
+            from .backends import SoundDeviceBackend
+            backend = SoundDeviceBackend()
+        self.backend = backend
+        self.filename = filename
+        self.fs = fs
+        self.channels = channels
+        self.blocksize = blocksize
+        self.poll_interval = poll_interval
+        self.normalize = normalize
+        self.ring = RingBuffer(int(fs * buffer_seconds), channels)
+        self.dropped_frames = 0
+        self.metrics = CallbackMetrics(self.name, fs, blocksize)
+        self._writer = None
+        self._stream = None
+        self._thread = None
+        self._stopping = threading.Event()
+
+    @property
+    def frames_written(self):
+        return self._writer.frames_written if self._writer else 0
+
+    @property
+    def duration(self):
+        return self.frames_written / self.fs
+
+    def _callback(self, indata, frames, time_info, status):
+        started = time.perf_counter()
+        written = self.ring.write(indata)
+        if written < frames:
+            # Writer thread fell behind by more than the ring can hold
+            self.dropped_frames += frames - written
+        self.metrics.record(time.perf_counter() - started, frames, status)
+
+    def _drain(self):
+        block = self.ring.read(self.ring.available())
+        if len(block):
+            self._writer.write(block)
+        return len(block)
+
+    def _writer_loop(self):
+        while not self._stopping.is_set():
+            if not self._drain():
+                self._stopping.wait(self.poll_interval)
+        # Whatever arrived before the stream closed
+        self._drain()
+
+    def start(self):
+        self._writer = WavWriter(self.filename, self.fs, self.channels)
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self._thread.start()
+        try:
+            self._stream = self.backend.open_input_stream(self._callback, self.fs,
+                                                          blocksize=self.blocksize,
+                                                          channels=self.channels)
+            self.metrics.set_stream(self._stream)
+            self._stream.start()
+        except Exception:
+            self.stop()
+            raise
+
+    def stop(self):
+        if self._stream is not None:
+            self._stream.stop()
+            self._stream.close()
+            self._stream = None
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._writer is not None:
+            self._writer.close()
+            if self.normalize:
+                self._writer.normalize()
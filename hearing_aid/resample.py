@@ -0,0 +1,179 @@
+from math import ceil, gcd
+
+import numpy as np
+
+from .cache import cached_design
+
+
+def resample_filter(up, down, half_length=10, beta=5.0):
+    # Anti-aliasing FIR as scipy.signal.resample_poly designs it
+    rate = max(up, down)
+    if rate == 1:
+        return np.ones(1)
+    return cached_design('resample', (up, down, half_length, float(beta)),
+                         lambda: _design_resample(up, down, half_length, beta))
+
+
+def _design_resample(up, down, half_length, beta):
+    from scipy.signal import firwin
+    rate = max(up, down)
+    length = 2 * half_length * rate + 1
+    return firwin(length, 1.0 / rate, window=('kaiser', beta)) * up
+
+
+class Resampler:
+    # Streaming polyphase resampler from fs_in to fs_out.
+    # Uses resample_poly's filter and gives the same samples as one
+    # upfirdn over the whole signal. resample_poly also trims the filter's
+    # group delay; a stream can't look ahead, so here it stays in (`delay`,
+    # in output samples). Each block returns every output
+    # sample its input completes, so output block lengths vary by a sample
+    # or so around len(block) * fs_out / fs_in. Blocks are (frames,) or
+    # (channels, frames), resampled along the last axis.
+    # Input goes into a ring of recent samples and each output sample is
+    # one row of the filter's polyphase table dotted with the inputs it
+    # covers, gathered into a scratch buffer, so once the largest block
+    # has been seen a block allocates nothing. The ring is stored twice
+    # over, end to end, so the inputs a block needs are always one run of
+    # it and never wrap. The result is a view of the output buffer,
+    # overwritten by the next call.
+
+    def __init__(self, fs_in, fs_out, half_length=10):
+        common = gcd(int(fs_in), int(fs_out))
+        self.fs_in = fs_in
+        self.fs_out = fs_out
+        self.up = int(fs_out) // common
+        self.down = int(fs_in) // common
+        self.taps = resample_filter(self.up, self.down, half_length)
+        # Phase p's taps are taps[p::up], zero-padded to a common length
+        up = self.up
+        self._span = -(-len(self.taps) // up)
+        padded = np.zeros(self._span * up)
+        padded[:len(self.taps)] = self.taps
+        self._phases = padded.reshape(self._span, up).T
+        self._ring = None
+        self._capacity = 0
+        self.reset()
+
+    @property
+    def delay(self):
+        return (len(self.taps) - 1) / 2 / self.down
+
+    def reset(self):
+        if self._ring is not None:
+            self._ring.fill(0)
+        self._end = 0    # inputs written to the ring so far
+        self._next = 0   # index of the next output sample
+
+    def _prepare(self, channels, frames):
+        # Sizes the ring and the tables for blocks of up to `frames`
+        up, down, span = self.up, self.down, self._span
+        capacity = frames + span + 1
+        if self._ring is not None and self._ring.shape[0] == channels \
+                and capacity <= self._capacity:
+            return
+        ring = np.zeros((channels, 2 * capacity))
+        if self._ring is not None and self._ring.shape[0] == channels:
+            # Carry over what the next outputs still reach back to
+            kept = np.arange(max(0, self._end - self._capacity), self._end)
+            ring[:, kept % capacity] = self._ring[:, kept % self._capacity]
+            ring[:, kept % capacity + capacity] = ring[:, kept % capacity]
+        else:
+            self._end = self._next = 0
+        self._ring, self._capacity = ring, capacity
+        # Output n = c * up + r (r from 0 to up - 1 plus the block) takes
+        # phase (r * down) % up and inputs back from c * down + r * down // up
+        # (here without the c * down)
+        most = frames * up // down + 2
+        rows = np.arange(up + most)
+        self._coefficients = self._phases[rows * down % up]
+        self._inputs = (rows * down // up)[:, None] - np.arange(span)
+        self._index = np.zeros((most, span), dtype=np.int64)
+        self._gathered = np.zeros(channels * most * span)
+        self._out = np.zeros(channels * most)
+
+    def process(self, block):
+        if self.up == self.down:
+            return np.asarray(block, dtype=float)
+        rows = block if block.ndim == 2 else block[None, :]
+        channels, frames = rows.shape
+        self._prepare(channels, frames)
+        ring, capacity = self._ring, self._capacity
+        at = self._end % capacity
+        first = min(frames, capacity - at)
+        for offset in (0, capacity):
+            ring[:, offset+at:offset+at+first] = rows[:, :first]
+            ring[:, offset:offset+frames-first] = rows[:, first:]
+        self._end += frames
+
+        # Output n needs inputs up to n * down // up, all of which exist
+        # for n below this
+        start = self._next
+        stop = ((self._end - 1) * self.up) // self.down + 1
+        self._next = stop
+        count = stop - start
+        cycle, phase = divmod(start, self.up)
+        # Oldest input the block reaches back to (before the first, the
+        # ring's zeros), and where its run starts in the doubled ring
+        oldest = cycle * self.down + self._inputs[phase, -1]
+        index = self._index[:count]
+        np.add(self._inputs[phase:phase+count], oldest % capacity - self._inputs[phase, -1],
+               out=index)
+        gathered = self._gathered[:channels * count * self._span]
+        gathered = gathered.reshape(channels, count, self._span)
+        # mode='clip' so out isn't buffered; every index is in range
+        np.take(ring, index, axis=1, out=gathered, mode='clip')
+        out = self._out[:channels * count].reshape(channels, count)
+        np.einsum('ckj,kj->ck', gathered, self._coefficients[phase:phase+count], out=out)
+        return out if block.ndim == 2 else out[0]
+
+
+class ResampledReader:
+    # Presents an audio source (len(), fs, read(pos, frames)) at another
+    # sample rate. Reads must be sequential; reading from anywhere else
+    # restarts the resampler there. Sources may return (frames,) or
+    # (frames, channels) blocks; the same shape comes back. The resampled
+    # audio runs `delay` frames past the source's end, so the filter's
+    # tail is flushed out rather than cut off.
+
+    def __init__(self, audio, fs):
+        self.audio = audio
+        self.fs = fs
+        self.channels = getattr(audio, 'channels', 1)
+        self.resampler = Resampler(audio.fs, fs)
+        self._length = int(len(audio) * fs / audio.fs) + ceil(self.resampler.delay)
+        self._pending = None
+        # Trailing shape of the source's blocks, for the silence that
+        # flushes the filter; a seek past the end has nothing read to copy
+        self._shape = () if self.channels == 1 else (self.channels,)
+        self._pos = 0
+        self._source_pos = 0
+
+    def __len__(self):
+        return self._length
+
+    def read(self, pos, frames):
+        if pos != self._pos:
+            self.resampler.reset()
+            self._pending = None
+            self._source_pos = int(pos * self.audio.fs / self.fs)
+            self._pos = pos
+        frames = min(frames, self._length - pos)
+        chunk = max(frames * self.audio.fs // self.fs + 1, 256)
+        while self._pending is None or len(self._pending) < frames:
+            if self._source_pos >= len(self.audio):
+                # Flush the filter tail with silence
+                block = np.zeros((chunk,) + self._shape)
+            else:
+                block = self.audio.read(self._source_pos, chunk)
+                self._shape = block.shape[1:]
+            self._source_pos += len(block)
+            # The resampler reuses its output buffer
+            resampled = self.resampler.process(block.T).T
+            if self._pending is None:
+                self._pending = resampled.copy()
+            else:
+                self._pending = np.concatenate([self._pending, resampled])
+        out, self._pending = self._pending[:frames], self._pending[frames:]
+        self._pos += frames
+        return out.astype(np.float32)
@@ -0,0 +1,50 @@
+import numpy as np
+
+
+class RingBuffer:
+    # Preallocated single-producer/single-consumer ring of audio frames.
+    # Each side only advances its own counter and the counters only grow,
+    # so one thread can write while another reads without a lock.
+
+    def __init__(self, capacity, channels=1, dtype=np.float32):
+        self.capacity = capacity
+        self.channels = channels
+        self._buffer = np.zeros((capacity, channels), dtype=dtype)
+        self._write_count = 0
+        self._read_count = 0
+
+    def available(self):
+        return self._write_count - self._read_count
+
+    def free(self):
+        return self.capacity - self.available()
+
+    @property
+    def fill_level(self):
+        return self.available() / self.capacity
+
+    def write(self, data):
+        # Returns the number of frames stored; the rest is dropped when full
+        data = data.reshape(len(data), -1)
+        frames = min(len(data), self.free())
+        start = self._write_count % self.capacity
+        first = min(frames, self.capacity - start)
+        self._buffer[start:start+first] = data[:first]
+        self._buffer[:frames-first] = data[first:frames]
+        self._write_count += frames
+        return frames
+
+    def read(self, frames, out=None):
+        frames = min(frames, self.available())
+        if out is None:
+            out = np.empty((frames, self.channels), dtype=self._buffer.dtype)
+        start = self._read_count % self.capacity
+        first = min(frames, self.capacity - start)
+        out[:first] = self._buffer[start:start+first]
+        out[first:frames] = self._buffer[:frames-first]
+        self._read_count += frames
+        return out[:frames]
+
+    def clear(self):
+        # Consumer side only; drops everything written so far
+        self._read_count = self._write_count
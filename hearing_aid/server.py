@@ -0,0 +1,621 @@
+"""Multi-session relay server and load generator.
+
+    python -m hearing_aid.server --listen 127.0.0.1:5055
+    python -m hearing_aid.server --connect 127.0.0.1:5055 --sessions 16 --duration 10
+    python -m hearing_aid.server --capacity
+
+A relay processes many independent audio streams at once, e.g. hearing aid
+sessions for remote clients. Sessions with the same configuration (fitting,
+noise reduction, internal rate, compression) are grouped into batches, and
+each batch is one multichannel FilterChain with a row per session, so every
+tick filters all of them in one (sessions, frames) call. Batches are shared
+out over a fixed pool of worker threads; the DSP releases the GIL in
+scipy's filters and NumPy, so more workers use more cores.
+
+--listen serves sessions over TCP. A client sends framed messages (a one
+byte type and a little-endian length, then the payload): 'H' with a JSON
+config opens the session and is answered with the server's sample rate and
+block size, 'A' carries float32 mono audio and 'P' a JSON gain/clarity
+update. Processed audio comes back as 'A' messages. A config or update the
+server can't use is answered with 'E' and the reason; after a bad 'P' the
+session carries on.
+
+--connect runs that many concurrent clients streaming speech-shaped noise
+in real time and reports end-to-end latency and how much audio came back.
+
+--capacity runs the relay in-process on one worker and searches for the
+largest number of sessions whose tick still fits the block's real-time
+budget at the 99th percentile, i.e. how many concurrent real-time sessions
+one core sustains.
+"""
+import argparse
+import json
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .filters import FilterChain
+from .fitting import fitting_from_json
+from .metrics import CallbackMetrics
+from .noise import NOISE_REDUCTION_PRESETS
+from .params import ParameterSmoother, ParameterStore, ProcessingParams
+from .ringbuffer import RingBuffer
+
+# Message type byte and payload length
+HEADER = struct.Struct('<cI')
+# Largest batch: one chain with this many rows
+MAX_BATCH = 32
+# Blocks of input a session queues before it is processed, so network
+# jitter doesn't turn into underruns
+JITTER_BLOCKS = 2
+# Share of the block budget a tick may use in --capacity
+HEADROOM = 0.8
+
+# Sessions with equal configs share a batch
+SessionConfig = namedtuple('SessionConfig', ['fitting', 'noise_reduction', 'internal_rate',
+                                             'compression'])
+
+
+class RelaySession:
+    # One client stream on a relay.
+    # The client side writes input and reads output through two rings; the
+    # relay's tick is the other end of both. params is the session's own
+    # ParameterStore, so gain and clarity changes ramp like in the app.
+
+    def __init__(self, session_id, config, fs, blocksize, gain=2.0, clarity=0.7,
+                 buffer_blocks=32):
+        self.id = session_id
+        self.config = config
+        self.params = ParameterStore(gain=gain, clarity=clarity)
+        self.smoother = ParameterSmoother(self.params, fs=fs)
+        self.input = RingBuffer(buffer_blocks * blocksize)
+        self.output = RingBuffer(buffer_blocks * blocksize)
+        self.prebuffer = JITTER_BLOCKS * blocksize
+        self.started = False
+        self.underruns = 0
+        self.overflows = 0
+        self.dropped = 0
+        self.closed = False
+
+    def write(self, audio):
+        # Client side; returns the number of frames queued
+        stored = self.input.write(np.asarray(audio, dtype=np.float32))
+        self.dropped += len(audio) - stored
+        return stored
+
+    def read(self, frames=None):
+        # Client side; whatever processed audio is ready, up to frames
+        if frames is None:
+            frames = self.output.available()
+        return self.output.read(frames)[:, 0]
+
+
+class SessionBatch:
+    # Up to `capacity` sessions sharing one FilterChain, a row each.
+    # A freed row keeps running on silence and is only handed to a new
+    # session once `settle` silent blocks have flushed its filter state, so
+    # rows never need resetting while the others are live.
+
+    def __init__(self, config, fitting, fs, blocksize, capacity, settle):
+        self.config = config
+        self.fs = fs
+        self.blocksize = blocksize
+        self.capacity = capacity
+        self.settle = settle
+        self.chain = FilterChain(fs=fs, fitting=fitting, noise_reduction=config.noise_reduction,
+                                 compression=config.compression, blocksize=blocksize,
+                                 internal_rate=config.internal_rate, channels=capacity)
+        self.sessions = [None] * capacity
+        # Silent blocks each free row has run since it was released
+        self._idle = [settle] * capacity
+        self._block = np.zeros((capacity, blocksize))
+        self._gain = np.zeros((capacity, blocksize))
+        self._clarity = np.zeros((capacity, blocksize))
+        self._params = ProcessingParams(self._gain, self._clarity)
+
+    @property
+    def active(self):
+        return sum(session is not None for session in self.sessions)
+
+    def free_row(self):
+        for row, session in enumerate(self.sessions):
+            if session is None and self._idle[row] >= self.settle:
+                return row
+        return None
+
+    def add(self, session):
+        row = self.free_row()
+        self.sessions[row] = session
+        return row
+
+    def remove(self, session):
+        row = self.sessions.index(session)
+        self.sessions[row] = None
+        self._idle[row] = 0
+
+    def process(self):
+        frames = self.blocksize
+        live = []
+        for row, session in enumerate(self.sessions):
+            block = self._block[row]
+            if session is None:
+                block[:] = 0
+                self._idle[row] += 1
+                continue
+            if not session.started:
+                if session.input.available() < session.prebuffer:
+                    block[:] = 0
+                    continue
+                session.started = True
+            got = len(session.input.read(frames, out=block[:, None]))
+            if got < frames:
+                block[got:] = 0
+                session.underruns += 1
+            if got == 0:
+                # Ran dry (or the client stopped sending): wait for the
+                # jitter buffer to refill rather than stream silence
+                session.started = False
+                continue
+            params = session.smoother.next_block(frames)
+            # Floats and per-sample ramps both broadcast into the row
+            self._gain[row] = params.gain
+            self._clarity[row] = params.clarity
+            live.append((row, session))
+        if not live:
+            return 0
+        processed = self.chain.run(self._block, self._params)
+        for row, session in live:
+            if session.output.write(processed[row][:, None]) < frames:
+                session.overflows += 1
+        return len(live)
+
+
+class RelayServer:
+    # Processes every open session once per tick of `blocksize` frames.
+    # Session configs are grouped into batches of growing size (1, 2, 4, ...
+    # up to `batch` rows), so a handful of sessions doesn't pay for a full
+    # batch of idle rows, and many sessions end up in few, wide chains.
+    # Sessions open and close from any thread; ticks run on one.
+
+    def __init__(self, fs=16000, blocksize=256, workers=1, batch=MAX_BATCH, settle_time=0.5):
+        self.fs = fs
+        self.blocksize = blocksize
+        self.workers = workers
+        self.batch = batch
+        self.settle = max(1, int(np.ceil(settle_time * fs / blocksize)))
+        self.metrics = CallbackMetrics('relay', fs, blocksize)
+        self.batches = {}
+        self._lock = threading.Lock()
+        self._opening = threading.Lock()
+        self._next_id = 0
+        self._pool = ThreadPoolExecutor(workers) if workers > 1 else None
+        # Counters of sessions that have closed
+        self._closed_underruns = 0
+        self._closed_overflows = 0
+
+    def open_session(self, gain=2.0, clarity=0.7, fitting=None, noise_reduction=False,
+                     internal_rate=None, compression=True):
+        # fitting is a Fitting or a load_fitting-style dict
+        if noise_reduction and noise_reduction not in NOISE_REDUCTION_PRESETS:
+            raise ValueError(f"Unknown noise reduction preset: {noise_reduction}")
+        if isinstance(fitting, dict):
+            fitting = fitting_from_json(fitting)
+        config = SessionConfig(fitting.key() if fitting is not None else None,
+                               noise_reduction or False, internal_rate, bool(compression))
+        # Only one session opens at a time, so concurrent clients fill the
+        # same new batch instead of each designing their own
+        with self._opening:
+            with self._lock:
+                session = RelaySession(self._next_id, config, self.fs, self.blocksize,
+                                       gain, clarity)
+                self._next_id += 1
+                batches = self.batches.get(config, [])
+                target = next((b for b in batches if b.free_row() is not None), None)
+                if target is not None:
+                    target.add(session)
+                    return session
+                rows = sum(b.capacity for b in batches)
+            # Designing a chain takes a while; ticks carry on meanwhile
+            batch = SessionBatch(config, fitting, self.fs, self.blocksize,
+                                 min(self.batch, max(1, rows)), self.settle)
+            with self._lock:
+                self.batches.setdefault(config, []).append(batch)
+                batch.add(session)
+        return session
+
+    def close_session(self, session):
+        with self._lock:
+            session.closed = True
+            for batch in self.batches.get(session.config, []):
+                if session in batch.sessions:
+                    batch.remove(session)
+            self._closed_underruns += session.underruns
+            self._closed_overflows += session.overflows
+
+    @property
+    def sessions(self):
+        return [s for batches in self.batches.values() for b in batches
+                for s in b.sessions if s is not None]
+
+    @property
+    def underruns(self):
+        return self._closed_underruns + sum(s.underruns for s in self.sessions)
+
+    @property
+    def overflows(self):
+        return self._closed_overflows + sum(s.overflows for s in self.sessions)
+
+    def _prune(self):
+        # Empty batches are dropped rather than kept running on silence
+        for config, batches in list(self.batches.items()):
+            batches[:] = [b for b in batches if b.active]
+            if not batches:
+                del self.batches[config]
+
+    def tick(self):
+        # One block for every session; returns the number processed
+        started = time.perf_counter()
+        with self._lock:
+            self._prune()
+            batches = [b for batches in self.batches.values() for b in batches]
+            if self._pool is None:
+                processed = sum(b.process() for b in batches)
+            else:
+                processed = sum(self._pool.map(SessionBatch.process, batches))
+        self.metrics.record(time.perf_counter() - started, self.blocksize)
+        return processed
+
+    def run(self, keep_running, on_report=None, report_interval=1.0):
+        # Ticks at real time until keep_running() is false. A late tick
+        # doesn't shift the schedule; a tick more than a block late skips
+        # ahead instead of bursting to catch up.
+        period = self.blocksize / self.fs
+        deadline = time.perf_counter()
+        last_report = deadline
+        while keep_running():
+            self.tick()
+            deadline += period
+            now = time.perf_counter()
+            if now < deadline:
+                time.sleep(deadline - now)
+            elif now - deadline > period:
+                deadline = now
+            if on_report is not None and now - last_report >= report_interval:
+                last_report = now
+                on_report(self)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+
+    def status_line(self):
+        return (f"{len(self.sessions)} sessions in "
+                f"{sum(len(b) for b in self.batches.values())} batches, "
+                f"{self.metrics.status_line()}, "
+                f"{self.underruns} underruns, {self.overflows} overflows")
+
+
+def send_message(sock, kind, payload):
+    sock.sendall(HEADER.pack(kind, len(payload)) + payload)
+
+
+def recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
+
+
+def recv_message(sock):
+    # (kind, payload), or (None, None) once the peer has closed
+    header = recv_exact(sock, HEADER.size)
+    if header is None:
+        return None, None
+    kind, length = HEADER.unpack(header)
+    payload = recv_exact(sock, length)
+    if payload is None:
+        return None, None
+    return kind, payload
+
+
+# What a malformed JSON config or update raises: bad JSON or values, a
+# missing key, or a list or number where an object belongs
+PAYLOAD_ERRORS = (AttributeError, KeyError, TypeError, ValueError)
+
+
+class RelayHandler(socketserver.BaseRequestHandler):
+    # One TCP client: this thread reads input, a second one sends output
+
+    def handle(self):
+        relay = self.server.relay
+        self._sending = threading.Lock()
+        kind, payload = recv_message(self.request)
+        if kind != b'H':
+            return
+        try:
+            options = json.loads(payload)
+            gain = float(options.pop('gain', 2.0))
+            clarity = float(options.pop('clarity', 0.7))
+            session = relay.open_session(gain, clarity, **options)
+        except PAYLOAD_ERRORS as e:
+            send_message(self.request, b'E', repr(e).encode())
+            return
+        send_message(self.request, b'H', json.dumps({
+            'session': session.id, 'samplerate': relay.fs, 'blocksize': relay.blocksize,
+        }).encode())
+        sender = threading.Thread(target=self.send_output, args=(session,), daemon=True)
+        sender.start()
+        try:
+            while True:
+                kind, payload = recv_message(self.request)
+                if kind is None:
+                    break
+                if kind == b'A':
+                    session.write(np.frombuffer(payload, dtype='<f4'))
+                elif kind == b'P':
+                    try:
+                        changes = json.loads(payload)
+                        session.params.update(**{name: float(changes[name])
+                                                 for name in ('gain', 'clarity')
+                                                 if name in changes})
+                    except PAYLOAD_ERRORS as e:
+                        self.send(b'E', repr(e).encode())
+        except (OSError, ValueError):
+            pass
+        finally:
+            relay.close_session(session)
+            sender.join()
+
+    def send_output(self, session):
+        poll = self.server.relay.blocksize / self.server.relay.fs / 2
+        try:
+            while not session.closed:
+                audio = session.read()
+                if len(audio):
+                    self.send(b'A', audio.astype('<f4').tobytes())
+                else:
+                    time.sleep(poll)
+        except OSError:
+            pass
+
+    def send(self, kind, payload):
+        # Both threads send once the session is open; one message at a time
+        with self._sending:
+            send_message(self.request, kind, payload)
+
+
+class RelayTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, relay):
+        super().__init__(address, RelayHandler)
+        self.relay = relay
+
+
+def serve(relay, host, port, report_interval=5.0):
+    server = RelayTCPServer((host, port), relay)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Relay listening on {host}:{port} ({relay.fs} Hz, {relay.blocksize}-frame ticks, "
+          f"{relay.workers} worker(s))")
+    try:
+        relay.run(lambda: True, on_report=lambda r: print(r.status_line()),
+                  report_interval=report_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        relay.close()
+
+
+def run_client(host, port, signal, duration, options, result):
+    # One real-time client: sends the signal block by block on the relay's
+    # clock and timestamps when each block's worth of output comes back
+    with socket.create_connection((host, port)) as sock:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        send_message(sock, b'H', json.dumps(options).encode())
+        kind, payload = recv_message(sock)
+        if kind != b'H':
+            result['error'] = payload.decode() if payload else "connection closed"
+            return
+        info = json.loads(payload)
+        fs, blocksize = info['samplerate'], info['blocksize']
+        sent = []
+        latencies = []
+        received = 0
+
+        def receive():
+            nonlocal received
+            while True:
+                kind, payload = recv_message(sock)
+                if kind is None:
+                    return
+                if kind != b'A':
+                    continue
+                received += len(payload) // 4
+                now = time.perf_counter()
+                while len(latencies) < len(sent) and received >= (len(latencies) + 1) * blocksize:
+                    latencies.append(now - sent[len(latencies)])
+
+        receiver = threading.Thread(target=receive, daemon=True)
+        receiver.start()
+        blocks = int(duration * fs / blocksize)
+        period = blocksize / fs
+        started = time.perf_counter()
+        for i in range(blocks):
+            start = i * blocksize % (len(signal) - blocksize)
+            block = signal[start:start + blocksize].astype('<f4')
+            deadline = started + i * period
+            wait = deadline - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            sent.append(time.perf_counter())
+            send_message(sock, b'A', block.tobytes())
+        # Let the last blocks come back before hanging up
+        time.sleep(0.5)
+        sock.shutdown(socket.SHUT_WR)
+        receiver.join(timeout=1.0)
+        result.update(sent=blocks * blocksize, received=received, latencies=latencies)
+
+
+def load_test(host, port, sessions, duration, options, seed=0):
+    from .bench import speech_shaped_noise
+    # The test signal is made at the rate the relay is expected to run at
+    results = [{} for _ in range(sessions)]
+    fs = options.pop('samplerate', 16000)
+    signal = speech_shaped_noise(fs, max(duration, 1.0) + 1.0, seed)
+    threads = [threading.Thread(target=run_client,
+                                args=(host, port, np.roll(signal, 997 * i), duration,
+                                      options, results[i]))
+               for i in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def load_summary(results):
+    errors = [r['error'] for r in results if 'error' in r]
+    done = [r for r in results if 'sent' in r]
+    latencies = np.concatenate([r['latencies'] for r in done if r['latencies']] or [[np.nan]])
+    sent = sum(r['sent'] for r in done)
+    received = sum(r['received'] for r in done)
+    return {
+        'sessions': len(results),
+        'errors': len(errors),
+        'completeness': received / sent if sent else 0.0,
+        'latency_p50_ms': float(np.percentile(latencies, 50)) * 1e3,
+        'latency_p99_ms': float(np.percentile(latencies, 99)) * 1e3,
+    }
+
+
+def tick_time(sessions, fs, blocksize, options, batch=MAX_BATCH, seconds=2.0):
+    # p99 tick time of `sessions` fed directly, on a single worker
+    from .bench import speech_shaped_noise
+    relay = RelayServer(fs, blocksize, workers=1, batch=batch)
+    opened = [relay.open_session(**options) for _ in range(sessions)]
+    signal = speech_shaped_noise(fs, seconds + 1.0).astype(np.float32)
+    ticks = int(seconds * fs / blocksize)
+    warm_up = JITTER_BLOCKS + 4
+    times = []
+    for i in range(warm_up + ticks):
+        block = signal[i * blocksize % (len(signal) - blocksize):][:blocksize]
+        for session in opened:
+            session.write(block)
+            session.output.clear()
+        started = time.perf_counter()
+        relay.tick()
+        if i >= warm_up:
+            times.append(time.perf_counter() - started)
+    relay.close()
+    return float(np.percentile(times, 99))
+
+
+def measure_capacity(fs, blocksize, options, batch=MAX_BATCH, headroom=HEADROOM,
+                     max_sessions=4096, seconds=2.0, on_step=None):
+    # Doubles the session count until a tick no longer fits, then bisects
+    budget = headroom * blocksize / fs
+
+    def fits(sessions):
+        p99 = tick_time(sessions, fs, blocksize, options, batch, seconds)
+        if on_step is not None:
+            on_step(sessions, p99)
+        return p99 <= budget
+
+    if not fits(1):
+        return 0
+    low, high = 1, 2
+    while high <= max_sessions and fits(high):
+        low, high = high, high * 2
+    if high > max_sessions:
+        return low
+    while high - low > 1:
+        middle = (low + high) // 2
+        if fits(middle):
+            low = middle
+        else:
+            high = middle
+    return low
+
+
+def parse_address(text):
+    host, _, port = text.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m hearing_aid.server',
+                                     description="Serve, load-test or size a multi-session relay.")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument('--listen', default=None, metavar='HOST:PORT', help="serve sessions over TCP")
+    mode.add_argument('--connect', default=None, metavar='HOST:PORT',
+                      help="run real-time load-test clients against a relay")
+    mode.add_argument('--capacity', action='store_true',
+                      help="find how many real-time sessions one core sustains")
+    parser.add_argument('--samplerate', type=int, default=16000)
+    parser.add_argument('--blocksize', type=int, default=256)
+    parser.add_argument('--workers', type=int, default=1, help="worker threads (default: 1)")
+    parser.add_argument('--batch', type=int, default=MAX_BATCH,
+                        help=f"most sessions per batch (default: {MAX_BATCH})")
+    parser.add_argument('--sessions', type=int, default=8, help="clients for --connect")
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds each client streams")
+    parser.add_argument('--gain', type=float, default=2.0)
+    parser.add_argument('--clarity', type=float, default=0.7)
+    parser.add_argument('--fitting', default=None, help="JSON fitting used by the sessions")
+    parser.add_argument('--noise-reduction', default=None, choices=list(NOISE_REDUCTION_PRESETS))
+    parser.add_argument('--internal-rate', type=int, default=None)
+    parser.add_argument('--json', default=None, help="write results to this file")
+    args = parser.parse_args(argv)
+
+    options = {'gain': args.gain, 'clarity': args.clarity,
+               'noise_reduction': args.noise_reduction or False,
+               'internal_rate': args.internal_rate}
+    if args.fitting:
+        with open(args.fitting) as f:
+            options['fitting'] = json.load(f)
+
+    if args.listen:
+        relay = RelayServer(args.samplerate, args.blocksize, args.workers, args.batch)
+        serve(relay, *parse_address(args.listen))
+        return 0
+
+    if args.connect:
+        host, port = parse_address(args.connect)
+        results = load_test(host, port, args.sessions, args.duration,
+                            dict(options, samplerate=args.samplerate))
+        summary = load_summary(results)
+        print(f"{summary['sessions']} sessions, {summary['errors']} errors, "
+              f"{summary['completeness']:.1%} of the audio came back, latency "
+              f"p50 {summary['latency_p50_ms']:.1f} ms, p99 {summary['latency_p99_ms']:.1f} ms")
+    else:
+        def on_step(sessions, p99):
+            print(f"{sessions:6d} sessions: p99 tick {p99 * 1e3:7.2f} ms")
+
+        budget = args.blocksize / args.samplerate
+        sessions = measure_capacity(args.samplerate, args.blocksize, options, args.batch,
+                                    on_step=on_step)
+        print(f"One core sustains {sessions} real-time sessions at {args.samplerate} Hz "
+              f"({budget * 1e3:.1f} ms blocks, ticks within {HEADROOM:.0%} of the budget)")
+        summary = {'samplerate': args.samplerate, 'blocksize': args.blocksize,
+                   'batch': args.batch, 'headroom': HEADROOM, 'sessions': sessions}
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return 0 if summary.get('errors', 0) == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+"""Startup-time benchmark and coefficient cache tools.
+
+    python -m hearing_aid.startup --save-baseline startup.json
+    python -m hearing_aid.startup --baseline startup.json
+    python -m hearing_aid.startup --precompute
+
+Each measurement runs in a fresh interpreter: importing the app, building
+the first chain (mostly importing scipy.signal, which the app does in the
+background once its window is up), designing chains with an empty and with
+a filled coefficient cache, and (when a display is available) showing the
+app's first window. With
+--baseline it exits non-zero if any of them got slower than the stored run
+by more than --tolerance. Like the throughput baselines, these are machine
+specific.
+
+--precompute designs the default chains for the common sample rates into
+the coefficient cache (see hearing_aid.cache), so even the first start on a
+new machine loads them from disk.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+# Sample rates the app and tools usually open streams at
+COMMON_RATES = (16000, 22050, 24000, 44100, 48000)
+# Below this, a difference from the baseline is timer noise
+SLACK = 0.005
+
+IMPORT_APP = """
+import time
+started = time.perf_counter()
+import realtime
+print(time.perf_counter() - started)
+"""
+
+FIRST_CHAIN = """
+import time
+started = time.perf_counter()
+from hearing_aid.filters import FilterChain
+FilterChain(fs=44100)
+print(time.perf_counter() - started)
+"""
+
+CHAIN_DESIGN = """
+import scipy.signal
+import time
+from hearing_aid.filters import FilterChain
+from hearing_aid.fitting import Fitting
+started = time.perf_counter()
+FilterChain(fs=44100)
+FilterChain(fs=44100, fitting=Fitting({500: 20, 1000: 30, 2000: 45, 4000: 60}))
+print(time.perf_counter() - started)
+"""
+
+FIRST_WINDOW = """
+import time
+started = time.perf_counter()
+import tkinter as tk
+import realtime
+from hearing_aid.backends import SimulatedBackend
+try:
+    root = tk.Tk()
+except tk.TclError:
+    print('nan')
+    raise SystemExit
+realtime.SimpleHearingAid(root, backend=SimulatedBackend())
+root.update()
+print(time.perf_counter() - started)
+root.destroy()
+"""
+
+
+def preload(fs=44100):
+    # Import the DSP modules and design the default chain (loading scipy's
+    # filters, cached coefficients and compiled kernels) ahead of first use;
+    # safe to run on a background thread
+    from .filters import FilterChain
+    FilterChain(fs=fs)
+
+
+def precompute(rates=COMMON_RATES):
+    from .filters import FilterChain
+    from .noise import NOISE_REDUCTION_PRESETS
+    for fs in rates:
+        FilterChain(fs=fs)
+        for preset in NOISE_REDUCTION_PRESETS:
+            FilterChain(fs=fs, noise_reduction=preset)
+        for rate in rates:
+            if rate < fs:
+                FilterChain(fs=fs, internal_rate=rate)
+
+
+def time_in_subprocess(code, cache=None):
+    # Seconds printed by `code` run in a fresh interpreter from the app's
+    # directory; cache overrides the coefficient cache location
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root)
+    if cache is not None:
+        env['HEARING_AID_CACHE'] = cache
+    result = subprocess.run([sys.executable, '-c', code], cwd=root, env=env,
+                            capture_output=True, text=True, check=True)
+    return float(result.stdout.split()[-1])
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def measure(repeats=5):
+    results = {
+        'import_app': median([time_in_subprocess(IMPORT_APP) for _ in range(repeats)]),
+        'first_chain': median([time_in_subprocess(FIRST_CHAIN) for _ in range(repeats)]),
+    }
+    cold, warm = [], []
+    for _ in range(repeats):
+        with tempfile.TemporaryDirectory() as cache:
+            cold.append(time_in_subprocess(CHAIN_DESIGN, cache))
+            warm.append(time_in_subprocess(CHAIN_DESIGN, cache))
+    results['design_uncached'] = median(cold)
+    results['design_cached'] = median(warm)
+    window = median([time_in_subprocess(FIRST_WINDOW) for _ in range(repeats)])
+    # NaN when there's no display to open a window on
+    if window == window:
+        results['first_window'] = window
+    return results
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, seconds in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        if seconds > old * (1 + tolerance) + SLACK:
+            regressions.append(f"{name}: {seconds * 1e3:.1f} ms > baseline {old * 1e3:.1f} ms")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m hearing_aid.startup',
+                                     description="Benchmark the hearing aid app's startup.")
+    parser.add_argument('--repeats', type=int, default=5,
+                        help="runs per measurement; the median is reported (default: 5)")
+    parser.add_argument('--json', default=None, help="write results to this file")
+    parser.add_argument('--save-baseline', default=None, help="store results as a baseline")
+    parser.add_argument('--baseline', default=None, help="fail on regressions against this baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed slowdown before a step counts as a regression (default: 0.25)")
+    parser.add_argument('--precompute', action='store_true',
+                        help="fill the coefficient cache for the common sample rates and exit")
+    parser.add_argument('--clear-cache', action='store_true',
+                        help="empty the coefficient cache and exit")
+    args = parser.parse_args(argv)
+
+    if args.precompute or args.clear_cache:
+        from .cache import coefficients
+        if coefficients.path is None:
+            print("The coefficient cache is turned off (HEARING_AID_CACHE is empty)")
+            return 1
+        if args.clear_cache:
+            coefficients.clear()
+            print(f"Cleared {coefficients.path}")
+        if args.precompute:
+            precompute()
+            print(f"Cached {coefficients.misses} design(s) in {coefficients.path} "
+                  f"({coefficients.hits} already there)")
+        return 0
+
+    results = measure(args.repeats)
+    for name, seconds in results.items():
+        print(f"{name:>20}: {seconds * 1e3:8.1f} ms")
+
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s) against {args.baseline}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"No regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
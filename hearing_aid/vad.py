@@ -0,0 +1,276 @@
+import numpy as np
+
+from .fitting import FFT_OUT
+
+
+class VoiceActivityDetector:
+    # Streaming speech/silence decision, one per block, from the mix of all
+    # channels.
+    # The input is cut into frames of frame_size samples and every frame
+    # completed by a block is scored at once; samples left over carry into
+    # the next block's first frame, and a block that completes no frame
+    # keeps the last decision. A frame's score is its energy above a
+    # tracked noise floor, and the spectral flatness of its windowed
+    # spectrum. Speech is louder than the room and, when voiced, far from
+    # flat; frames loud enough count as speech whatever their flatness, so
+    # fricatives and plosives get through.
+    # The floor follows the quietest frame down at once and rises by at most
+    # floor_rise_db per second, like NoiseReducer's noise tracker.
+
+    def __init__(self, frame_size=256, margin_db=6.0, loud_margin_db=15.0, max_flatness=0.3,
+                 floor_rise_db=3.0, silence_db=-70.0):
+        self.frame_size = frame_size
+        self.margin_db = margin_db
+        self.loud_margin_db = loud_margin_db
+        self.max_flatness = max_flatness
+        self.floor_rise_db = floor_rise_db
+        # Frames quieter than this (dBFS) are never speech
+        self.silence_db = silence_db
+        self.fs = None
+        self.blocksize = 0
+
+    def prepare(self, fs, blocksize):
+        size = self.frame_size
+        self.fs = fs
+        self.blocksize = blocksize
+        # A block completes at most this many frames, counting leftovers
+        count = max(1, (blocksize + size - 1) // size)
+        bins = size // 2 + 1
+        self._window = np.hanning(size)
+        self._history = np.zeros(size + blocksize)
+        self._tail = np.zeros(size)
+        self._frames = np.zeros((count, size))
+        self._spectra = np.zeros((count, bins), dtype=complex)
+        self._power = np.zeros((count, bins))
+        self._energy = np.zeros(count)
+        self._flatness = np.zeros(count)
+        self._scratch = np.zeros(count)
+        self._voiced = np.zeros(count, dtype=bool)
+        self._loud = np.zeros(count, dtype=bool)
+        self.reset()
+
+    def reset(self):
+        self._history[:] = 0
+        self.floor_db = None
+        self.speech = False
+        # Samples in that no scored frame has covered yet
+        self._fresh = 0
+
+    def detect(self, rows):
+        channels, frames = rows.shape
+        if frames > self.blocksize:
+            self.prepare(self.fs, frames)
+        size, history = self.frame_size, self._history
+        mix = history[size:size+frames]
+        np.sum(rows, axis=0, out=mix)
+        if channels > 1:
+            mix *= 1 / channels
+        self._fresh += frames
+        if self._fresh < size:
+            self._keep_tail(frames)
+            return self.speech
+        count = self._fresh // size
+        elapsed = count * size
+        start = size + frames - self._fresh
+        analysed = history[start:start+elapsed].reshape(count, size)
+        self._fresh -= elapsed
+
+        energy = self._energy[:count]
+        squared = self._frames[:count]
+        np.multiply(analysed, analysed, out=squared)
+        np.mean(squared, axis=1, out=energy)
+        energy += 1e-20
+        np.log10(energy, out=energy)
+        energy *= 10
+
+        # Flatness: geometric over arithmetic mean of the power spectrum
+        # Row by row: NumPy buffers a broadcast window through a temporary
+        windowed = self._frames[:count]
+        for frame, out in zip(analysed, windowed):
+            np.multiply(frame, self._window, out=out)
+        if FFT_OUT:
+            spectra = np.fft.rfft(windowed, axis=1, out=self._spectra[:count])
+        else:
+            spectra = np.fft.rfft(windowed, axis=1)
+        power = self._power[:count]
+        np.abs(spectra, out=power)
+        power *= power
+        power += 1e-20
+        flatness, geometric = self._flatness[:count], self._scratch[:count]
+        np.mean(power, axis=1, out=flatness)
+        np.log(power, out=power)
+        np.mean(power, axis=1, out=geometric)
+        np.exp(geometric, out=geometric)
+        np.divide(geometric, flatness, out=flatness)
+
+        # The floor only follows frames above silence_db: digital silence
+        # (leading zeros, a muted input) would drag it far below any real
+        # room, and at floor_rise_db per second it would take minutes to
+        # climb back
+        audible, silent = self._scratch[:count], self._loud[:count]
+        np.less_equal(energy, self.silence_db, out=silent)
+        np.copyto(audible, energy)
+        np.copyto(audible, np.inf, where=silent)
+        quietest = audible.min()
+        if quietest == np.inf:
+            # Nothing above silence_db, so no speech either
+            self.speech = False
+        else:
+            # Judged against the floor from before this block, so a block
+            # of speech can't hide itself by pulling the floor up
+            floor = quietest if self.floor_db is None else self.floor_db
+            voiced, loud = self._voiced[:count], self._loud[:count]
+            energy -= floor
+            np.greater(energy, self.margin_db, out=voiced)
+            np.less(flatness, self.max_flatness, out=loud)
+            voiced &= loud
+            np.greater(energy, self.loud_margin_db, out=loud)
+            voiced |= loud
+            energy += floor
+            np.greater(energy, self.silence_db, out=loud)
+            voiced &= loud
+            self.speech = bool(voiced.any())
+            self.floor_db = min(floor + self.floor_rise_db * elapsed / self.fs, quietest)
+        self._keep_tail(frames)
+        return self.speech
+
+    def _keep_tail(self, frames):
+        # Keep the latest frame_size samples, which hold any not yet scored
+        size, history = self.frame_size, self._history
+        self._tail[:] = history[frames:frames+size]
+        history[:size] = self._tail
+
+
+class VoiceActivityGate:
+    # Runs a chain's heavy stages only around speech.
+    # Once the detector has heard hang_time seconds of silence, the stages
+    # are skipped and the chain's output is its own input, delayed to line
+    # up with the stages' latency and scaled by the volume less
+    # expansion_db, which turns room hiss down rather than up. Changes
+    # crossfade over ramp_in (speech onset) or ramp_out seconds. On onset
+    # the stages first run over the last `preroll` seconds of input, output
+    # discarded, so their delay lines and noise estimates hold the room as
+    # it is now rather than whatever came before the silence.
+    # blocks and skipped count blocks seen and blocks the stages sat out.
+
+    FULL = 'full'
+    BYPASS = 'bypass'
+    FADE = 'fade'
+
+    def __init__(self, detector=None, hang_time=0.3, ramp_in=0.01, ramp_out=0.05,
+                 expansion_db=18.0, preroll=0.02, ceiling=0.99):
+        self.detector = detector or VoiceActivityDetector()
+        self.hang_time = hang_time
+        self.ramp_in = ramp_in
+        self.ramp_out = ramp_out
+        self.expansion = 10 ** (-expansion_db / 20)
+        self.preroll = preroll
+        self.ceiling = ceiling
+        self.fs = None
+        self.blocksize = 0
+        self.channels = 1
+        self.delay = 0
+        self.blocks = 0
+        self.skipped = 0
+
+    @property
+    def skip_fraction(self):
+        return self.skipped / self.blocks if self.blocks else 0.0
+
+    def prepare(self, fs, blocksize, channels=1, delay=0):
+        self.fs = fs
+        self.blocksize = blocksize
+        self.channels = channels
+        self.delay = delay
+        self.detector.prepare(fs, blocksize)
+        self._hang = int(self.hang_time * fs)
+        # Enough input to flush the stages' delay lines on onset
+        self._preroll = max(int(self.preroll * fs), 2 * delay, 1)
+        self._counter = np.arange(1, blocksize + 1, dtype=float)
+        self._weights = np.zeros(blocksize)
+        self._delayed = np.zeros((channels, delay + blocksize))
+        self._recent = np.zeros((channels, self._preroll + blocksize))
+        self._tail = np.zeros(max(delay, self._preroll))
+        self._bypass = np.zeros(channels * blocksize)
+        self.out = np.zeros(channels * blocksize)
+        self.reset()
+
+    def reset(self):
+        self.detector.reset()
+        self._delayed[:] = 0
+        self._recent[:] = 0
+        self._quiet = 0
+        # Full path weight at the end of the last block
+        self.level = 1.0
+        self.onset = False
+
+    def update(self, rows):
+        # Mode for this block; after onset, recent_blocks() is the pre-roll
+        channels, frames = rows.shape
+        if frames > self.blocksize or channels != self.channels:
+            self.prepare(self.fs, frames, channels, self.delay)
+        if self.detector.detect(rows):
+            self._quiet = 0
+        else:
+            self._quiet += frames
+        target = 1.0 if self._quiet <= self._hang else 0.0
+        self.onset = target == 1.0 and self.level == 0.0
+        self.blocks += 1
+        if self.level == target:
+            if target == 0.0:
+                self.skipped += 1
+                return self.BYPASS
+            return self.FULL
+        ramp = self.ramp_in if target else self.ramp_out
+        step = 1 / max(1, ramp * self.fs)
+        weights = self._weights[:frames]
+        np.multiply(self._counter[:frames], step if target else -step, out=weights)
+        weights += self.level
+        np.clip(weights, 0.0, 1.0, out=weights)
+        self.level = float(weights[-1])
+        return self.FADE
+
+    def recent_blocks(self):
+        # The last pre-roll of input before this block, in pieces no longer
+        # than the block size the stages were prepared for
+        recent = self._recent[:, :self._preroll]
+        for start in range(0, self._preroll, self.blocksize):
+            yield recent[:, start:start+self.blocksize]
+
+    def bypass(self, rows, gain):
+        # Delayed input at the volume (a scalar, a ramp, or a ramp per row)
+        # less the expansion. Every block goes through here so the delay
+        # line and pre-roll stay current.
+        channels, frames = rows.shape
+        out = self._bypass[:channels * frames].reshape(channels, frames)
+        delayed = self._delayed
+        delayed[:, self.delay:self.delay+frames] = rows
+        row_gains = isinstance(gain, np.ndarray) and gain.ndim == 2
+        for i in range(channels):
+            np.multiply(delayed[i, :frames], gain[i] if row_gains else gain, out=out[i])
+        out *= self.expansion
+        np.clip(out, -self.ceiling, self.ceiling, out=out)
+        self._shift(delayed, self.delay, frames)
+        self._recent[:, self._preroll:self._preroll+frames] = rows
+        self._shift(self._recent, self._preroll, frames)
+        return out
+
+    def _shift(self, buffer, keep, frames):
+        # buffer holds `keep` older samples, then the block just added; move
+        # the newest `keep` to the front a row at a time, through scratch so
+        # NumPy doesn't copy the overlapping slices into a temporary
+        tail = self._tail[:keep]
+        for row in buffer:
+            tail[:] = row[frames:frames+keep]
+            row[:keep] = tail
+
+    def blend(self, processed, bypassed):
+        # bypassed + (processed - bypassed) * weights
+        channels, frames = processed.shape
+        out = self.out[:channels * frames].reshape(channels, frames)
+        weights = self._weights[:frames]
+        np.subtract(processed, bypassed, out=out)
+        for row in out:
+            row *= weights
+        out += bypassed
+        return out
@@ -0,0 +1,131 @@
+import os
+import wave
+
+import numpy as np
+
+
+class WavReader:
+    # Lazy reader for long WAV files.
+    # The samples stay memory-mapped on disk and are converted to normalized
+    # float32 one block at a time, so memory use does not depend on the
+    # file length. The peak used for normalization comes from a streaming
+    # pre-scan over the mapped data. Blocks are mono (frames,) mixdowns, or
+    # with mono=False (frames, channels) with every channel kept; all
+    # channels share one scale so their balance is preserved.
+
+    SCAN_BLOCKSIZE = 1 << 20
+
+    def __init__(self, filename, mono=True):
+        self.filename = filename
+        self.mono = mono
+        from scipy.io import wavfile
+        try:
+            self.fs, self._data = wavfile.read(filename, mmap=True)
+        except ValueError:
+            # Formats numpy can't map directly (e.g. 24-bit PCM)
+            self.fs, self._data = wavfile.read(filename)
+        self.file_channels = 1 if self._data.ndim == 1 else self._data.shape[1]
+        # Channels in the blocks read() returns
+        self.channels = 1 if mono else self.file_channels
+        self.peak = self._scan_peak()
+        self._scale = 1.0 / self.peak if self.peak > 0 else 1.0
+
+    def _scan_peak(self):
+        peak = 0.0
+        for pos in range(0, len(self), self.SCAN_BLOCKSIZE):
+            block = self._convert(self._data[pos:pos+self.SCAN_BLOCKSIZE])
+            if len(block):
+                peak = max(peak, float(np.max(np.abs(block))))
+        return peak
+
+    def _convert(self, data):
+        audio = data.astype(np.float32)
+        if self.mono:
+            if audio.ndim > 1:
+                audio = np.mean(audio, axis=1)
+        else:
+            audio = audio.reshape(len(audio), -1)
+        return audio
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def duration(self):
+        return len(self) / self.fs
+
+    def read(self, pos, frames):
+        audio = self._convert(self._data[pos:pos+frames])
+        audio *= self._scale
+        return audio
+
+    def blocks(self, blocksize):
+        for pos in range(0, len(self), blocksize):
+            yield self.read(pos, blocksize)
+
+    def close(self):
+        # Drops the mapping so the file can be replaced or deleted
+        self._data = None
+
+
+def write_wav(filename, fs, audio):
+    from scipy.io import wavfile
+    wavfile.write(filename, fs, (np.clip(audio, -1, 1) * 32767).astype(np.int16))
+
+
+class WavWriter:
+    # 16-bit WAV file written incrementally.
+    # Frames are appended as they arrive and the header sizes are patched
+    # when the file is closed, so recordings can be any length. peak is the
+    # largest sample written so far, for normalize().
+
+    FULL_SCALE = 32767
+    NORMALIZE_BLOCKSIZE = 1 << 20
+
+    def __init__(self, filename, fs, channels=1):
+        self.filename = filename
+        self.fs = fs
+        self.channels = channels
+        self.frames_written = 0
+        self.peak = 0
+        self._wave = wave.open(filename, 'wb')
+        self._wave.setnchannels(channels)
+        self._wave.setsampwidth(2)
+        self._wave.setframerate(fs)
+
+    def write(self, audio):
+        samples = (np.clip(audio, -1, 1) * self.FULL_SCALE).astype('<i2')
+        self._wave.writeframesraw(samples.tobytes())
+        self.frames_written += len(samples)
+        if samples.size:
+            self.peak = max(self.peak, int(np.max(np.abs(samples))))
+
+    def normalize(self):
+        # Rescales the closed file in place so its peak is full scale, a
+        # block at a time through a memory map of the sample data (which
+        # ends the file, after whatever header the wave module wrote)
+        if self._wave is not None:
+            raise ValueError("close the file before normalizing it")
+        if self.peak in (0, self.FULL_SCALE):
+            return
+        size = self.frames_written * self.channels
+        offset = os.path.getsize(self.filename) - 2 * size
+        data = np.memmap(self.filename, dtype='<i2', mode='r+', offset=offset, shape=(size,))
+        scale = self.FULL_SCALE / self.peak
+        for pos in range(0, size, self.NORMALIZE_BLOCKSIZE):
+            block = data[pos:pos+self.NORMALIZE_BLOCKSIZE]
+            block[:] = np.round(block * scale)
+        data.flush()
+        del data
+        self.peak = self.FULL_SCALE
+
+    def close(self):
+        if self._wave is not None:
+            self._wave.close()
+            self._wave = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
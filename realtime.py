@@ -1,17 +1,27 @@
-import numpy as np
-import sounddevice as sd
 import tkinter as tk
 from tkinter import ttk, filedialog
 import threading
-from scipy.signal import butter, lfilter
-from scipy.io import wavfile
 import os
-import time
-import queue
+from hearing_aid.backends import SoundDeviceBackend
+from hearing_aid.cache import RenderCache
+from hearing_aid.engine import LATENCY_PROFILES, LiveSession, OfflineRender, PlaybackSession
+from hearing_aid.fitting import load_fitting
+from hearing_aid.metrics import export_metrics
+from hearing_aid.noise import NOISE_REDUCTION_PRESETS
+from hearing_aid.params import ParameterStore
+from hearing_aid.recorder import StreamingRecorder
+from hearing_aid.startup import preload
+from hearing_aid.wavio import WavReader
+
+def format_time(seconds):
+    return f"{int(seconds // 60)}:{seconds % 60:04.1f}"
 
 class SimpleHearingAid:
-    def __init__(self, root):
+    def __init__(self, root, backend=None):
         self.root = root
+        # All streams go through the backend so the app can run without
+        # a sound card (see hearing_aid.backends.SimulatedBackend)
+        self.backend = backend or SoundDeviceBackend()
         self.root.title("Simple Hearing Aid")
         self.root.geometry("550x500")
         
@@ -48,6 +58,79 @@ class SimpleHearingAid:
         self.clarity_var = tk.DoubleVar(value=0.7)
         ttk.Scale(self.live_frame, from_=0.0, to=1.0, variable=self.clarity_var).pack(fill="x")
         
+        # Audio callbacks read parameters from the store, never from Tk
+        self.live_params = ParameterStore()
+        self.live_params.trace('gain', self.gain_var)
+        self.live_params.trace('clarity', self.clarity_var)
+        
+        # Audiogram fitting, shared by all tabs
+        self.fitting = None
+        self.fitting_frame = ttk.Frame(self.live_frame)
+        self.fitting_frame.pack(fill="x", pady=5)
+        
+        ttk.Label(self.fitting_frame, text="Fitting:").pack(side=tk.LEFT)
+        self.fitting_var = tk.StringVar(value="None (fixed bandpass)")
+        ttk.Label(self.fitting_frame, textvariable=self.fitting_var, width=30).pack(side=tk.LEFT, padx=5)
+        ttk.Button(self.fitting_frame, text="Clear", command=self.clear_fitting).pack(side=tk.RIGHT)
+        ttk.Button(self.fitting_frame, text="Load...", command=self.browse_fitting).pack(side=tk.RIGHT, padx=5)
+        
+        # Noise reduction, shared by all tabs and applied when a stream starts
+        self.noise_reduction = False
+        self.noise_frame = ttk.Frame(self.live_frame)
+        self.noise_frame.pack(fill="x", pady=5)
+        
+        ttk.Label(self.noise_frame, text="Noise Reduction:").pack(side=tk.LEFT)
+        self.noise_reduction_var = tk.StringVar(value="Off")
+        ttk.Combobox(self.noise_frame, textvariable=self.noise_reduction_var, state="readonly",
+                     values=["Off"] + list(NOISE_REDUCTION_PRESETS)).pack(side=tk.LEFT, padx=5)
+        self.noise_reduction_var.trace_add('write', self.set_noise_reduction)
+        
+        # Voice activity gate, shared by all tabs: the chain idles while
+        # nobody is speaking and room hiss is turned down instead of up
+        self.vad = False
+        self.vad_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.live_frame, text="Skip Processing During Silence",
+                        variable=self.vad_var).pack(anchor="w")
+        self.vad_var.trace_add('write', self.set_vad)
+        
+        # Latency profile (block size), shared by all tabs
+        self.latency_profile = "standard"
+        self.latency_frame = ttk.Frame(self.live_frame)
+        self.latency_frame.pack(fill="x", pady=5)
+        
+        ttk.Label(self.latency_frame, text="Latency:").pack(side=tk.LEFT)
+        self.latency_var = tk.StringVar(value=self.latency_profile)
+        ttk.Combobox(self.latency_frame, textvariable=self.latency_var, state="readonly",
+                     values=list(LATENCY_PROFILES)).pack(side=tk.LEFT, padx=5)
+        self.latency_var.trace_add('write', self.set_latency_profile)
+        
+        # Processing rate: "Device" runs the DSP at the stream's own rate,
+        # a lower rate saves CPU at the cost of bandwidth
+        self.internal_rate = None
+        self.rate_frame = ttk.Frame(self.live_frame)
+        self.rate_frame.pack(fill="x", pady=5)
+        
+        ttk.Label(self.rate_frame, text="Processing Rate:").pack(side=tk.LEFT)
+        self.internal_rate_var = tk.StringVar(value="Device")
+        ttk.Combobox(self.rate_frame, textvariable=self.internal_rate_var, state="readonly",
+                     values=["Device", "16000", "22050", "24000"]).pack(side=tk.LEFT, padx=5)
+        self.internal_rate_var.trace_add('write', self.set_internal_rate)
+        
+        # Feedback cancellation only applies to the live microphone path
+        self.feedback_cancellation = False
+        self.feedback_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.live_frame, text="Feedback Cancellation",
+                        variable=self.feedback_var).pack(anchor="w")
+        self.feedback_var.trace_add('write', self.set_feedback_cancellation)
+        
+        # Stereo runs one chain per ear on the live path and for recordings;
+        # files always play with their own channels
+        self.channels = 1
+        self.stereo_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.live_frame, text="Stereo (separate left/right processing)",
+                        variable=self.stereo_var).pack(anchor="w")
+        self.stereo_var.trace_add('write', self.set_channels)
+        
         # Start/Stop button
         self.is_processing = False
         self.button = ttk.Button(self.live_frame, text="Start Hearing Aid", command=self.toggle_processing)
@@ -57,6 +140,44 @@ class SimpleHearingAid:
         self.status_var = tk.StringVar(value="Ready")
         ttk.Label(self.live_frame, textvariable=self.status_var).pack()
         
+        # Callback timing for every stream path, keyed by path name
+        self.metrics = {}
+        # The playback session of each tab while it runs, for its controls
+        self.sessions = {}
+        ttk.Button(self.live_frame, text="Export Metrics...", command=self.export_metrics).pack(pady=5)
+        
+        # Processed audio of both playback tabs, so replaying a clip with
+        # unchanged settings doesn't run the chain again
+        self.render_cache = RenderCache()
+        
+        # Audio file data
+        self.audio_file = None
+        self.audio_fs = None
+        self.is_playing = False
+        self.is_exporting = False
+        # A/B loop marks in frames of the loaded file, and whether the
+        # position slider is being dragged
+        self.loop_start = None
+        self.loop_end = None
+        self.seeking = False
+        
+        # Recording data
+        self.is_recording = False
+        self.recorded_audio = None
+        self.record_fs = 44100
+        self.is_custom_playing = False
+        
+        # The live tab is usable as soon as the window shows; the other tabs
+        # are filled in once it's up, then the DSP modules load in the
+        # background so pressing Start doesn't wait for them
+        self.root.after_idle(self.build_other_tabs)
+    
+    def build_other_tabs(self):
+        self.build_recorded_tab()
+        self.build_recording_tab()
+        threading.Thread(target=preload, daemon=True).start()
+    
+    def build_recorded_tab(self):
         # === Pre-recorded Audio Tab Controls ===
         # File selection
         ttk.Label(self.recorded_frame, text="Audio File:").pack(anchor="w")
@@ -78,6 +199,30 @@ class SimpleHearingAid:
         self.recorded_clarity_var = tk.DoubleVar(value=0.7)
         ttk.Scale(self.recorded_frame, from_=0.0, to=1.0, variable=self.recorded_clarity_var).pack(fill="x")
         
+        self.recorded_params = ParameterStore()
+        self.recorded_params.trace('gain', self.recorded_gain_var)
+        self.recorded_params.trace('clarity', self.recorded_clarity_var)
+        
+        # Playback position; releasing the slider seeks, and while stopped
+        # it picks where Play starts
+        ttk.Label(self.recorded_frame, text="Position:").pack(anchor="w")
+        self.position_var = tk.DoubleVar(value=0.0)
+        self.position_scale = ttk.Scale(self.recorded_frame, from_=0.0, to=1.0, variable=self.position_var)
+        self.position_scale.pack(fill="x")
+        self.position_scale.bind("<ButtonPress-1>", self.start_seek)
+        self.position_scale.bind("<ButtonRelease-1>", self.seek_recorded)
+        self.position_label_var = tk.StringVar(value="")
+        ttk.Label(self.recorded_frame, textvariable=self.position_label_var).pack(anchor="w")
+        
+        # A/B loop: the stretch between the marks repeats without a gap
+        self.loop_frame = ttk.Frame(self.recorded_frame)
+        self.loop_frame.pack(fill="x", pady=5)
+        ttk.Button(self.loop_frame, text="Set A", command=self.set_loop_start).pack(side=tk.LEFT, padx=5)
+        ttk.Button(self.loop_frame, text="Set B", command=self.set_loop_end).pack(side=tk.LEFT, padx=5)
+        ttk.Button(self.loop_frame, text="Clear Loop", command=self.clear_loop).pack(side=tk.LEFT, padx=5)
+        self.loop_var = tk.StringVar(value="Loop: off")
+        ttk.Label(self.loop_frame, textvariable=self.loop_var).pack(side=tk.LEFT, padx=5)
+        
         # Playback control buttons
         self.playback_frame = ttk.Frame(self.recorded_frame)
         self.playback_frame.pack(pady=20)
@@ -85,13 +230,23 @@ class SimpleHearingAid:
         self.play_button = ttk.Button(self.playback_frame, text="Play", command=self.play_audio, state="disabled")
         self.play_button.pack(side=tk.LEFT, padx=5)
         
+        # Pausing keeps the stream open; it plays silence until resumed
+        self.pause_button = ttk.Button(self.playback_frame, text="Pause", command=self.toggle_pause, state="disabled")
+        self.pause_button.pack(side=tk.LEFT, padx=5)
+        
         self.stop_button = ttk.Button(self.playback_frame, text="Stop", command=self.stop_audio, state="disabled")
         self.stop_button.pack(side=tk.LEFT, padx=5)
         
+        # Renders the file through the current settings faster than real time
+        self.export_button = ttk.Button(self.playback_frame, text="Export Processed...",
+                                        command=self.toggle_export, state="disabled")
+        self.export_button.pack(side=tk.LEFT, padx=5)
+        
         # Status for recorded playback
         self.recorded_status_var = tk.StringVar(value="No file loaded")
         ttk.Label(self.recorded_frame, textvariable=self.recorded_status_var).pack()
-        
+    
+    def build_recording_tab(self):
         # === Recording Tab Controls ===
         # Recording controls
         ttk.Label(self.recording_frame, text="Record New Audio").pack(anchor="w", pady=5)
@@ -100,9 +255,9 @@ class SimpleHearingAid:
         self.duration_frame = ttk.Frame(self.recording_frame)
         self.duration_frame.pack(fill="x", pady=5)
         
-        ttk.Label(self.duration_frame, text="Recording Duration (sec):").pack(side=tk.LEFT)
+        ttk.Label(self.duration_frame, text="Recording Duration (sec, 0 = until stopped):").pack(side=tk.LEFT)
         self.duration_var = tk.IntVar(value=10)
-        ttk.Spinbox(self.duration_frame, from_=1, to=60, textvariable=self.duration_var, width=5).pack(side=tk.LEFT, padx=5)
+        ttk.Spinbox(self.duration_frame, from_=0, to=3600, textvariable=self.duration_var, width=5).pack(side=tk.LEFT, padx=5)
         
         # File name frame
         self.record_file_frame = ttk.Frame(self.recording_frame)
@@ -119,6 +274,10 @@ class SimpleHearingAid:
         self.record_button = ttk.Button(self.record_buttons_frame, text="Start Recording", command=self.start_recording)
         self.record_button.pack(side=tk.LEFT, padx=5)
         
+        self.record_stop_button = ttk.Button(self.record_buttons_frame, text="Stop Recording", 
+                                           command=self.stop_recording, state="disabled")
+        self.record_stop_button.pack(side=tk.LEFT, padx=5)
+        
         # Playback controls for recorded audio
         ttk.Separator(self.recording_frame, orient="horizontal").pack(fill="x", pady=10)
         ttk.Label(self.recording_frame, text="Recorded Audio Playback").pack(anchor="w", pady=5)
@@ -133,6 +292,10 @@ class SimpleHearingAid:
         self.custom_clarity_var = tk.DoubleVar(value=0.7)
         ttk.Scale(self.recording_frame, from_=0.0, to=1.0, variable=self.custom_clarity_var).pack(fill="x")
         
+        self.custom_params = ParameterStore()
+        self.custom_params.trace('gain', self.custom_gain_var)
+        self.custom_params.trace('clarity', self.custom_clarity_var)
+        
         # Custom recording playback buttons
         self.custom_playback_frame = ttk.Frame(self.recording_frame)
         self.custom_playback_frame.pack(pady=10)
@@ -148,43 +311,114 @@ class SimpleHearingAid:
         # Recording status
         self.recording_status_var = tk.StringVar(value="Ready to record")
         ttk.Label(self.recording_frame, textvariable=self.recording_status_var).pack()
+    
+    def export_metrics(self):
+        if not self.metrics:
+            self.status_var.set("No stream metrics yet")
+            return
+        filetypes = [("JSON files", "*.json"), ("CSV files", "*.csv")]
+        filename = filedialog.asksaveasfilename(title="Export Metrics", defaultextension=".json",
+                                                filetypes=filetypes)
+        if filename:
+            try:
+                export_metrics(filename, list(self.metrics.values()))
+                self.status_var.set(f"Metrics saved as {os.path.basename(filename)}")
+            except Exception as e:
+                self.status_var.set(f"Error exporting metrics: {str(e)}")
+    
+    def report_metrics(self, active, status_var, prefix, metrics):
+        # Stream threads call this through root.after; reports that arrive
+        # after the stream was stopped are dropped
+        if active():
+            status_var.set(f"{prefix} | {metrics.status_line()}")
+    
+    def browse_fitting(self):
+        filetypes = [("Fitting files", "*.json"), ("All files", "*.*")]
+        filename = filedialog.askopenfilename(title="Select Audiogram Fitting", filetypes=filetypes)
         
-        # Audio file data
-        self.audio_file = None
-        self.audio_fs = None
-        self.is_playing = False
-        
-        # Recording data
-        self.is_recording = False
-        self.recorded_audio = None
-        self.record_fs = 44100
-        self.recording_queue = queue.Queue()
-        self.is_custom_playing = False
-        
+        if filename:
+            try:
+                self.fitting = load_fitting(filename)
+                if isinstance(self.fitting, list):
+                    # One fitting per ear
+                    detail = f"{len(self.fitting)} channels"
+                else:
+                    detail = self.fitting.rule
+                self.fitting_var.set(f"{os.path.basename(filename)} ({detail})")
+            except Exception as e:
+                self.fitting = None
+                self.fitting_var.set(f"Error loading fitting: {str(e)}")
+    
+    def clear_fitting(self):
+        self.fitting = None
+        self.fitting_var.set("None (fixed bandpass)")
+    
+    def set_noise_reduction(self, *args):
+        # Kept as a plain attribute so stream threads never read Tk variables
+        preset = self.noise_reduction_var.get()
+        self.noise_reduction = preset if preset in NOISE_REDUCTION_PRESETS else False
+    
+    def set_vad(self, *args):
+        self.vad = self.vad_var.get()
+    
+    def set_latency_profile(self, *args):
+        self.latency_profile = self.latency_var.get()
+    
+    def set_internal_rate(self, *args):
+        rate = self.internal_rate_var.get()
+        self.internal_rate = int(rate) if rate.isdigit() else None
+    
+    def set_feedback_cancellation(self, *args):
+        self.feedback_cancellation = self.feedback_var.get()
+    
+    def set_channels(self, *args):
+        self.channels = 2 if self.stereo_var.get() else 1
+    
     def browse_file(self):
         filetypes = [("WAV files", "*.wav"), ("All files", "*.*")]
         filename = filedialog.askopenfilename(title="Select Audio File", filetypes=filetypes)
         
         if filename:
-            try:
-                self.audio_fs, self.audio_file = wavfile.read(filename)
-                # Convert to float and normalize
-                self.audio_file = self.audio_file.astype(np.float32)
-                if self.audio_file.ndim > 1:  # Stereo to mono
-                    self.audio_file = np.mean(self.audio_file, axis=1)
-                self.audio_file = self.audio_file / np.max(np.abs(self.audio_file))
-                
-                # Update UI
-                basename = os.path.basename(filename)
-                self.file_path_var.set(basename)
-                self.recorded_status_var.set(f"Loaded: {basename}")
-                self.play_button.config(state="normal")
-                
-            except Exception as e:
-                self.recorded_status_var.set(f"Error loading file: {str(e)}")
-                self.audio_file = None
-                self.audio_fs = None
-                self.play_button.config(state="disabled")
+            if self.is_playing:
+                self.stop_audio()
+            self.is_exporting = False
+            self.play_button.config(state="disabled")
+            self.export_button.config(state="disabled", text="Export Processed...")
+            self.recorded_status_var.set(f"Loading: {os.path.basename(filename)}")
+            
+            # Map the file and scan its peak without blocking the UI
+            threading.Thread(target=self.load_file, args=(filename,), daemon=True).start()
+    
+    def load_file(self, filename):
+        try:
+            reader = WavReader(filename, mono=False)
+        except Exception as e:
+            message = f"Error loading file: {str(e)}"
+            self.root.after(0, lambda: self.file_load_failed(message))
+            return
+        self.root.after(0, lambda: self.file_loaded(filename, reader))
+    
+    def file_loaded(self, filename, reader):
+        # Samples stay on disk; blocks are read on demand during playback
+        self.audio_file = reader
+        self.audio_fs = reader.fs
+        
+        # Update UI
+        basename = os.path.basename(filename)
+        self.file_path_var.set(basename)
+        self.recorded_status_var.set(f"Loaded: {basename} ({reader.duration:.1f} sec)")
+        self.loop_start = self.loop_end = None
+        self.apply_loop()
+        self.show_position(0)
+        self.play_button.config(state="normal")
+        self.export_button.config(state="normal")
+    
+    def file_load_failed(self, message):
+        self.recorded_status_var.set(message)
+        self.audio_file = None
+        self.audio_fs = None
+        self.play_button.config(state="disabled")
+        self.export_button.config(state="disabled")
     
     def start_recording(self):
         if self.is_recording:
@@ -200,72 +434,61 @@ class SimpleHearingAid:
         
         self.is_recording = True
         self.record_button.config(text="Recording...", state="disabled")
-        self.recording_status_var.set(f"Recording... ({duration} seconds)")
-        
-        # Clear the queue
-        while not self.recording_queue.empty():
-            try:
-                self.recording_queue.get_nowait()
-            except queue.Empty:
-                break
+        self.record_stop_button.config(state="normal")
+        if duration > 0:
+            self.recording_status_var.set(f"Recording... ({duration} seconds)")
+        else:
+            self.recording_status_var.set("Recording... (until stopped)")
         
         # Start recording in a separate thread
         threading.Thread(target=self.record_audio, args=(duration, filename), daemon=True).start()
     
+    def stop_recording(self):
+        # The recording thread finishes the file and resets the UI
+        self.is_recording = False
+        self.record_stop_button.config(state="disabled")
+    
     def record_audio(self, duration, filename):
-        fs = self.record_fs
-        channels = 1
-        
-        # Calculate total frames to record
-        total_frames = int(fs * duration)
-        recorded_frames = []
-        
-        def audio_callback(indata, frames, time, status):
-            if status:
-                print(f"Recording status: {status}")
-            self.recording_queue.put(indata.copy())
+        # Audio goes straight to disk, so only a few seconds are ever in memory
+        recorder = StreamingRecorder(filename, fs=self.record_fs, channels=self.channels,
+                                     backend=self.backend)
+        self.metrics[recorder.name] = recorder.metrics
         
         try:
-            # Start recording
-            with sd.InputStream(samplerate=fs, channels=channels, callback=audio_callback):
-                # Update countdown timer
-                for remaining in range(duration, 0, -1):
-                    if not self.root.winfo_exists():
-                        return
-                    self.root.after(0, lambda r=remaining: self.recording_status_var.set(f"Recording... ({r} seconds remaining)"))
-                    sd.sleep(1000)  # Sleep for 1 second
-            
-            # Process recorded audio
-            while not self.recording_queue.empty():
-                try:
-                    recorded_frames.append(self.recording_queue.get_nowait())
-                except queue.Empty:
-                    break
+            recorder.start()
+            try:
+                # Update status until the duration is reached or stop is pressed
+                while self.is_recording and self.root.winfo_exists():
+                    elapsed = recorder.duration
+                    if duration > 0 and elapsed >= duration:
+                        break
+                    if duration > 0:
+                        message = f"Recording... ({int(duration - elapsed)} seconds remaining)"
+                    else:
+                        message = f"Recording... ({int(elapsed)} seconds)"
+                    self.root.after(0, lambda m=message: self.recording_status_var.set(m))
+                    self.backend.sleep(200)
+            finally:
+                recorder.stop()
             
-            if not recorded_frames:
+            if recorder.frames_written == 0:
                 self.root.after(0, lambda: self.recording_status_var.set("Error: No audio recorded"))
-                self.root.after(0, self.reset_recording_ui)
                 return
-                
-            # Concatenate all frames
-            recorded_data = np.concatenate(recorded_frames, axis=0)
-            if recorded_data.ndim > 1:
-                recorded_data = recorded_data[:, 0]  # Use only first channel if stereo
-            
-            # Normalize
-            recorded_data = recorded_data / np.max(np.abs(recorded_data)) if np.max(np.abs(recorded_data)) > 0 else recorded_data
             
-            # Save to file
-            try:
-                wavfile.write(filename, fs, (recorded_data * 32767).astype(np.int16))
-                self.recorded_audio = recorded_data
-                self.root.after(0, lambda: self.recording_status_var.set(f"Recording saved as {filename}"))
-                self.root.after(0, lambda: self.custom_play_button.config(state="normal"))
-            except Exception as e:
-                self.root.after(0, lambda: self.recording_status_var.set(f"Error saving recording: {str(e)}"))
+            # Playback reads the saved file back block by block
+            self.recorded_audio = WavReader(filename, mono=False)
+            message = f"Recording saved as {filename} ({recorder.duration:.1f} seconds)"
+            if recorder.dropped_frames:
+                message += f", {recorder.dropped_frames} frames dropped"
+            xruns = sum(recorder.metrics.xruns.values())
+            if xruns:
+                message += f", {xruns} device overflows"
+            self.root.after(0, lambda: self.recording_status_var.set(message))
+            self.root.after(0, lambda: self.custom_play_button.config(state="normal"))
         
         except Exception as e:
-            self.root.after(0, lambda: self.recording_status_var.set(f"Recording error: {str(e)}"))
+            message = f"Recording error: {str(e)}"
+            self.root.after(0, lambda: self.recording_status_var.set(message))
         
         finally:
             self.root.after(0, self.reset_recording_ui)
@@ -273,6 +496,7 @@ class SimpleHearingAid:
     def reset_recording_ui(self):
         self.is_recording = False
         self.record_button.config(text="Start Recording", state="normal")
+        self.record_stop_button.config(state="disabled")
     
     def play_custom_recording(self):
         if self.recorded_audio is None or self.is_custom_playing:
@@ -293,66 +517,43 @@ class SimpleHearingAid:
         self.recording_status_var.set("Playback stopped")
     
     def process_custom_recording(self):
-        fs = self.record_fs
-        blocksize = 1024
-        b, a = self.design_bandpass_filter(fs=fs)
-        
-        # Process the entire audio recording in chunks
-        audio_len = len(self.recorded_audio)
-        pos = 0
+        self.play_through_chain(self.recorded_audio, self.custom_params, 'custom',
+                                lambda: self.is_custom_playing, self.recording_status_var,
+                                "Playing recorded audio...", self.stop_custom_playback)
+    
+    def play_through_chain(self, audio, params, name, active, status_var, prefix, stop,
+                           start=0, loop=None):
+        # Shared by both playback tabs; the engine session owns the chain,
+        # the callback and the metrics, the UI only reports on them. The
+        # chain runs ahead on the session's own thread, so the callback
+        # just copies and a busy machine doesn't cause dropouts.
+        session = PlaybackSession(self.backend, audio, params, fitting=self.fitting,
+                                  noise_reduction=self.noise_reduction, name=name,
+                                  profile=self.latency_profile, internal_rate=self.internal_rate,
+                                  cache=self.render_cache, vad=self.vad,
+                                  prefetch=PlaybackSession.PREFETCH)
+        if start:
+            session.seek(start)
+        if loop is not None:
+            session.set_loop(*loop)
+        self.metrics[name] = session.metrics
+        self.sessions[name] = session
+        
+        def on_report(metrics):
+            self.root.after(0, self.report_metrics, active, status_var, prefix, metrics)
         
         try:
-            def callback(outdata, frames, time, status):
-                nonlocal pos
-                if status:
-                    print(f"Status: {status}")
-                
-                if pos >= audio_len or not self.is_custom_playing or not self.root.winfo_exists():
-                    # End of recording or stopped
-                    if self.is_custom_playing and pos >= audio_len:
-                        # Auto-stop at end of recording
-                        self.root.after(0, self.stop_custom_playback)
-                        self.recording_status_var.set("Playback complete")
-                    
-                    # Provide silence if we're still playing
-                    outdata.fill(0)
-                    return
-                
-                # Calculate how many frames to read
-                chunk_size = min(frames, audio_len - pos)
-                
-                # Get chunk and apply processing
-                chunk = self.recorded_audio[pos:pos+chunk_size]
-                gain = self.custom_gain_var.get()
-                clarity = self.custom_clarity_var.get()
-                
-                processed = self.apply_processing(chunk, gain, clarity, b, a)
-                
-                # Output processed audio
-                if len(processed) < frames:
-                    outdata[:len(processed), 0] = processed
-                    outdata[len(processed):, 0] = 0
-                else:
-                    outdata[:, 0] = processed
-                
-                # If stereo output, duplicate to all channels
-                if outdata.shape[1] > 1:
-                    for i in range(1, outdata.shape[1]):
-                        outdata[:, i] = outdata[:, 0]
-                
-                # Move position forward
-                pos += chunk_size
-            
-            # Start streaming
-            with sd.OutputStream(samplerate=fs, channels=1, callback=callback, 
-                               blocksize=blocksize, finished_callback=None):
-                while self.is_custom_playing and self.root.winfo_exists():
-                    sd.sleep(100)
-                    
+            finished = session.run(lambda: active() and self.root.winfo_exists(), on_report)
+            if finished and active():
+                # Auto-stop at end of audio
+                self.root.after(0, stop)
+                self.root.after(0, lambda: status_var.set("Playback complete"))
+        
         except Exception as e:
-            print(f"Error in custom playback: {e}")
-            self.root.after(0, lambda: self.recording_status_var.set(f"Error: {str(e)}"))
-            self.root.after(0, self.stop_custom_playback)
+            print(f"Error in {name} playback: {e}")
+            message = f"Error: {str(e)}"
+            self.root.after(0, lambda: status_var.set(message))
+            self.root.after(0, stop)
     
     def play_audio(self):
         if self.audio_file is None or self.is_playing:
@@ -360,18 +561,169 @@ class SimpleHearingAid:
             
         self.is_playing = True
         self.play_button.config(state="disabled")
+        self.pause_button.config(state="normal", text="Pause")
         self.stop_button.config(state="normal")
         self.recorded_status_var.set("Playing...")
         
+        # Start from the slider, or from the top once it's at the end
+        start = self.recorded_position()
+        if start >= len(self.audio_file):
+            start = 0
+        
         # Start playback in a separate thread
-        threading.Thread(target=self.process_recorded_audio, daemon=True).start()
+        threading.Thread(target=self.process_recorded_audio, args=(start, self.apply_loop()),
+                         daemon=True).start()
+        self.root.after(100, self.update_position)
     
     def stop_audio(self):
         self.is_playing = False
+        self.sessions.pop('recorded', None)
         self.play_button.config(state="normal")
+        self.pause_button.config(state="disabled", text="Pause")
         self.stop_button.config(state="disabled")
         self.recorded_status_var.set("Stopped")
     
+    def toggle_pause(self):
+        session = self.sessions.get('recorded')
+        if session is None:
+            return
+        if session.paused:
+            session.resume()
+            self.pause_button.config(text="Pause")
+        else:
+            session.pause()
+            self.pause_button.config(text="Resume")
+    
+    def recorded_position(self):
+        # Frame the pre-recorded tab has played up to, or the slider's
+        # while stopped
+        session = self.sessions.get('recorded')
+        if session is not None:
+            return session.position
+        return int(self.position_var.get() * len(self.audio_file))
+    
+    def show_position(self, pos):
+        length = len(self.audio_file)
+        self.position_var.set(pos / length if length else 0.0)
+        fs = self.audio_file.fs
+        self.position_label_var.set(f"{format_time(pos / fs)} / {format_time(length / fs)}")
+    
+    def update_position(self):
+        # Polls the playing session into the slider, except mid-drag
+        session = self.sessions.get('recorded')
+        if not self.is_playing or session is None:
+            if self.is_playing:
+                self.root.after(100, self.update_position)
+            return
+        if not self.seeking:
+            self.show_position(session.position)
+        self.root.after(100, self.update_position)
+    
+    def start_seek(self, event):
+        self.seeking = True
+    
+    def seek_recorded(self, event=None):
+        self.seeking = False
+        if self.audio_file is None:
+            return
+        pos = int(self.position_var.get() * len(self.audio_file))
+        session = self.sessions.get('recorded')
+        if session is not None:
+            session.seek(pos)
+        self.show_position(pos)
+    
+    def set_loop_start(self):
+        if self.audio_file is not None:
+            self.loop_start = self.recorded_position()
+            self.apply_loop()
+    
+    def set_loop_end(self):
+        if self.audio_file is not None:
+            self.loop_end = self.recorded_position()
+            self.apply_loop()
+    
+    def clear_loop(self):
+        self.loop_start = self.loop_end = None
+        self.apply_loop()
+    
+    def apply_loop(self):
+        # Shows the marks and hands the loop to a running session; it's on
+        # once both are set with A before B. Returns (start, end) or None.
+        marks = [format_time(mark / self.audio_file.fs) if mark is not None else "-"
+                 for mark in (self.loop_start, self.loop_end)] if self.audio_file else ["-", "-"]
+        loop = None
+        if self.loop_start is not None and self.loop_end is not None \
+                and self.loop_start < self.loop_end:
+            loop = (self.loop_start, self.loop_end)
+            self.loop_var.set(f"Loop: {marks[0]} to {marks[1]}")
+        elif self.loop_start is None and self.loop_end is None:
+            self.loop_var.set("Loop: off")
+        else:
+            self.loop_var.set(f"Loop: A {marks[0]}, B {marks[1]} (not active)")
+        session = self.sessions.get('recorded')
+        if session is not None:
+            session.set_loop(*(loop or ()))
+        return loop
+    
+    def toggle_export(self):
+        # The export button doubles as Cancel while a render runs
+        if self.is_exporting:
+            self.is_exporting = False
+            return
+        if self.audio_file is None:
+            return
+        base = os.path.splitext(os.path.basename(self.audio_file.filename))[0]
+        filename = filedialog.asksaveasfilename(title="Export Processed Audio",
+                                                defaultextension=".wav",
+                                                initialfile=f"{base}_processed.wav",
+                                                filetypes=[("WAV files", "*.wav")])
+        if not filename:
+            return
+        self.is_exporting = True
+        self.export_button.config(text="Cancel Export")
+        self.recorded_status_var.set("Exporting...")
+        threading.Thread(target=self.export_recorded_audio,
+                         args=(self.audio_file, filename), daemon=True).start()
+    
+    def export_recorded_audio(self, audio, filename):
+        # Same chain and settings as playback, but rendered straight to disk
+        # at full speed; the UI only sees progress through root.after
+        basename = os.path.basename(filename)
+        
+        def on_report(render):
+            message = (f"Exporting {basename}... {render.progress:.0%} "
+                       f"({render.speedup:.0f}x real time)")
+            self.root.after(0, self.report_export, message)
+        
+        try:
+            render = OfflineRender(audio, self.recorded_params, filename, fitting=self.fitting,
+                                   noise_reduction=self.noise_reduction,
+                                   internal_rate=self.internal_rate, vad=self.vad,
+                                   stream_blocksize=LATENCY_PROFILES[self.latency_profile].blocksize)
+            finished = render.run(lambda: self.is_exporting and self.root.winfo_exists(), on_report)
+            if finished:
+                result = render.summary()
+                message = (f"Exported {basename} ({result['duration_s']:.1f} sec in "
+                           f"{result['processing_s']:.1f} sec, "
+                           f"{result['speedup']:.0f}x real time)")
+            else:
+                message = f"Export cancelled; {basename} is incomplete"
+        except Exception as e:
+            print(f"Error exporting: {e}")
+            message = f"Error exporting: {str(e)}"
+        self.root.after(0, self.export_done, message)
+    
+    def report_export(self, message):
+        # Progress that arrives after a cancel is dropped
+        if self.is_exporting:
+            self.recorded_status_var.set(message)
+    
+    def export_done(self, message):
+        self.is_exporting = False
+        self.recorded_status_var.set(message)
+        self.export_button.config(text="Export Processed...",
+                                  state="normal" if self.audio_file is not None else "disabled")
+    
     def toggle_processing(self):
         if self.is_processing:
             self.is_processing = False
@@ -383,123 +735,30 @@ class SimpleHearingAid:
             self.status_var.set("Processing audio...")
             threading.Thread(target=self.process_audio, daemon=True).start()
     
-    def design_bandpass_filter(self, lowcut=300, highcut=5000, fs=44100):
-        nyquist = 0.5 * fs
-        low = lowcut / nyquist
-        high = highcut / nyquist
-        b, a = butter(4, [low, high], btype='band')
-        return b, a
-    
-    def apply_processing(self, audio_in, gain, clarity, b, a):
-        # Apply bandpass filter
-        filtered = lfilter(b, a, audio_in)
-        
-        # Apply speech clarity enhancement
-        if clarity > 0:
-            speech_b, speech_a = butter(2, [1000/22050, 3000/22050], btype='band')
-            enhanced = lfilter(speech_b, speech_a, filtered)
-            # Blend original and enhanced based on clarity setting
-            filtered = (1-clarity) * filtered + clarity * enhanced * 1.5
-        
-        # Apply gain and prevent clipping
-        processed = np.clip(filtered * gain, -0.99, 0.99)
-        return processed
-    
     def process_audio(self):
-        fs = 44100
-        blocksize = 1024
-        b, a = self.design_bandpass_filter()
+        session = LiveSession(self.backend, self.live_params, fitting=self.fitting,
+                              noise_reduction=self.noise_reduction,
+                              feedback_cancellation=self.feedback_cancellation,
+                              profile=self.latency_profile, internal_rate=self.internal_rate,
+                              channels=self.channels, vad=self.vad)
+        self.metrics['live'] = session.metrics
         
-        def audio_callback(indata, outdata, frames, time, status):
-            if status:
-                print(f"Status: {status}")
-            
-            audio_in = indata[:, 0] if indata.ndim > 1 else indata[:]
-            gain = self.gain_var.get()
-            clarity = self.clarity_var.get()
-            
-            processed = self.apply_processing(audio_in, gain, clarity, b, a)
-            
-            # Output to all channels
-            if outdata.ndim > 1:
-                for i in range(outdata.shape[1]):
-                    outdata[:, i] = processed
-            else:
-                outdata[:] = processed
+        def on_report(metrics):
+            self.root.after(0, self.report_metrics, lambda: self.is_processing,
+                            self.status_var, "Processing audio...", metrics)
         
         try:
-            with sd.Stream(channels=1, callback=audio_callback, 
-                          samplerate=fs, blocksize=blocksize,
-                          latency='low'):
-                while self.is_processing and self.root.winfo_exists():
-                    sd.sleep(100)
+            session.run(lambda: self.is_processing and self.root.winfo_exists(), on_report)
         except Exception as e:
             print(f"Error: {e}")
             self.is_processing = False
             self.status_var.set(f"Error: {str(e)}")
             self.button.config(text="Start Hearing Aid")
 
-    def process_recorded_audio(self):
-        fs = self.audio_fs
-        blocksize = 1024
-        b, a = self.design_bandpass_filter(fs=fs)
-        
-        # Process the entire audio file in chunks
-        audio_len = len(self.audio_file)
-        pos = 0
-        
-        try:
-            def callback(outdata, frames, time, status):
-                nonlocal pos
-                if status:
-                    print(f"Status: {status}")
-                
-                if pos >= audio_len or not self.is_playing or not self.root.winfo_exists():
-                    # End of file or stopped
-                    if self.is_playing and pos >= audio_len:
-                        # Auto-stop at end of file
-                        self.root.after(0, self.stop_audio)
-                        self.recorded_status_var.set("Playback complete")
-                    
-                    # Provide silence if we're still playing
-                    outdata.fill(0)
-                    return
-                
-                # Calculate how many frames to read
-                chunk_size = min(frames, audio_len - pos)
-                
-                # Get chunk and apply processing
-                chunk = self.audio_file[pos:pos+chunk_size]
-                gain = self.recorded_gain_var.get()
-                clarity = self.recorded_clarity_var.get()
-                
-                processed = self.apply_processing(chunk, gain, clarity, b, a)
-                
-                # Output processed audio
-                if len(processed) < frames:
-                    outdata[:len(processed), 0] = processed
-                    outdata[len(processed):, 0] = 0
-                else:
-                    outdata[:, 0] = processed
-                
-                # If stereo output, duplicate to all channels
-                if outdata.shape[1] > 1:
-                    for i in range(1, outdata.shape[1]):
-                        outdata[:, i] = outdata[:, 0]
-                
-                # Move position forward
-                pos += chunk_size
-            
-            # Start streaming
-            with sd.OutputStream(samplerate=fs, channels=1, callback=callback, 
-                               blocksize=blocksize, finished_callback=None):
-                while self.is_playing and self.root.winfo_exists():
-                    sd.sleep(100)
-                    
-        except Exception as e:
-            print(f"Error in playback: {e}")
-            self.root.after(0, lambda: self.recorded_status_var.set(f"Error: {str(e)}"))
-            self.root.after(0, self.stop_audio)
+    def process_recorded_audio(self, start=0, loop=None):
+        self.play_through_chain(self.audio_file, self.recorded_params, 'recorded',
+                                lambda: self.is_playing, self.recorded_status_var,
+                                "Playing...", self.stop_audio, start, loop)
 
 if __name__ == "__main__":
     root = tk.Tk()